@@ -0,0 +1,69 @@
+# actions.py
+# ------------------------------------------------------------------------------
+# План вызовов Bot API внутри одного действия пользователя.
+#
+# То, что видно в чате и зависит от порядка (баннер → меню, две реплики
+# подряд, новая карточка → удаление старой), по-прежнему идёт через await
+# по очереди. Независимые вызовы — ответ на callback (крутилка на кнопке),
+# правка старого сообщения, пока уходит новое, удаление нескольких сообщений —
+# запускаются через plan.side(...) и идут параллельно с основной веткой:
+#
+#   async with ActionPlan("loc") as plan:
+#       await plan.side(query.answer())     # запрос уже ушёл, ответа не ждём
+#       await send_card(...)                # основная ветка
+#
+# side() отдаёт управление один раз, чтобы побочный запрос встал в очередь
+# раньше основного. Выход из блока ждёт все побочные вызовы: хендлер
+# заканчивается, когда сделано всё, и порядок апдейтов чата в ChatScheduler
+# не нарушается. Ошибка побочного вызова не роняет действие — такие вызовы
+# и раньше были «best effort» (try/except вокруг правок и удалений).
+# ------------------------------------------------------------------------------
+
+import asyncio
+import logging
+from typing import Awaitable, List, Tuple
+
+from metrics import REGISTRY
+
+logger = logging.getLogger("bot.actions")
+
+SIDE_ERRORS = REGISTRY.counter("bot_side_call_errors_total", "Ошибки параллельных вызовов Bot API", ("call",))
+
+
+def _label(coro) -> str:
+    return getattr(coro, "__qualname__", None) or type(coro).__name__
+
+
+class ActionPlan:
+    __slots__ = ("name", "_tasks")
+
+    def __init__(self, name: str = "action"):
+        self.name = name
+        self._tasks: List[Tuple[str, asyncio.Task]] = []
+
+    async def side(self, coro: Awaitable) -> asyncio.Task:
+        """Запустить независимый вызов параллельно с остальным действием."""
+        task = asyncio.ensure_future(coro)
+        self._tasks.append((_label(coro), task))
+        await asyncio.sleep(0)
+        return task
+
+    async def wait(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        if not tasks:
+            return
+        results = await asyncio.gather(*(t for _, t in tasks), return_exceptions=True)
+        for (label, _), result in zip(tasks, results):
+            if isinstance(result, BaseException) and not isinstance(result, asyncio.CancelledError):
+                SIDE_ERRORS.inc(label)
+                logger.debug(f"{self.name}: {label} не удался: {result}")
+
+    async def __aenter__(self) -> "ActionPlan":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is asyncio.CancelledError:
+            for _, task in self._tasks:
+                task.cancel()
+        await self.wait()
+        return False
@@ -0,0 +1,130 @@
+# assets.py
+# ------------------------------------------------------------------------------
+# Манифест статики: sha256 каждого файла в static/ → версия в URL
+# (/static/locations/shopino/shopino.jpg?v=3f2a9c1b7d4e). Поменяли файл —
+# поменялась только его версия, остальные URL (и кэш Telegram/CDN/браузеров)
+# остаются прежними. Заменяет ручной CACHE_VER.
+#
+# Сборка: при старте бота (≈20 МБ хэшируются за десятки мс) или заранее:
+#   python assets.py > asset-manifest.json
+# ------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import hashlib
+import logging
+from typing import Dict, Optional, Set, Tuple
+
+from starlette.staticfiles import StaticFiles
+
+logger = logging.getLogger("bot.assets")
+
+TOKEN_LEN = 12
+# Предсжатые копии (static_server.py --precompress) — не отдельные файлы статики
+VARIANT_SUFFIXES = (".gz", ".br")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=300, must-revalidate"
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class AssetManifest:
+    """Относительный путь внутри static/ → (mtime_ns, size, sha256)."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._files: Dict[str, Tuple[int, int, str]] = {}
+
+    def walk(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for name in sorted(filenames):
+                if name.startswith(".") or name.endswith(VARIANT_SUFFIXES):
+                    continue
+                full = os.path.join(dirpath, name)
+                yield os.path.relpath(full, self.root).replace(os.sep, "/"), full
+
+    def refresh(self) -> Set[str]:
+        """Перехэшировать изменившиеся файлы. Возвращает пути с новой версией."""
+        changed: Set[str] = set()
+        seen: Set[str] = set()
+        for rel, full in self.walk():
+            seen.add(rel)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            old = self._files.get(rel)
+            if old and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+                continue
+            digest = _sha256(full)
+            self._files[rel] = (st.st_mtime_ns, st.st_size, digest)
+            if not old or old[2] != digest:
+                changed.add(rel)
+        for rel in set(self._files) - seen:
+            del self._files[rel]
+            changed.add(rel)
+        return changed
+
+    def build(self) -> "AssetManifest":
+        self.refresh()
+        logger.info(f"Манифест статики: {len(self._files)} файлов")
+        return self
+
+    def digest(self, rel: str) -> Optional[str]:
+        entry = self._files.get(rel)
+        return entry[2] if entry else None
+
+    def fresh(self, rel: str, st: os.stat_result) -> bool:
+        """Хэш в манифесте соответствует файлу — current() ответит без чтения файла."""
+        entry = self._files.get(rel)
+        return bool(entry) and entry[0] == st.st_mtime_ns and entry[1] == st.st_size
+
+    def current(self, rel: str, st: os.stat_result) -> str:
+        """Хэш файла для отдачи: из манифеста, а если файл с тех пор поменялся — пересчитать только его."""
+        if self.fresh(rel, st):
+            return self._files[rel][2]
+        digest = _sha256(os.path.join(self.root, rel))
+        self._files[rel] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def version(self, rel: str) -> Optional[str]:
+        digest = self.digest(rel)
+        return digest[:TOKEN_LEN] if digest else None
+
+    def url(self, base_url: str, rel: str, *, mount: str = "/static") -> Optional[str]:
+        """
+        Публичный URL файла с версией; None, если BASE_URL не задан.
+        mount="" — статика на отдельном хосте (static_server.py), отдаётся от корня.
+        """
+        if not base_url:
+            return None
+        token = self.version(rel)
+        return f"{base_url}{mount}/{rel}?v={token}" if token else f"{base_url}{mount}/{rel}"
+
+    def as_dict(self) -> Dict[str, dict]:
+        return {rel: {"v": d[:TOKEN_LEN], "sha256": d, "size": size}
+                for rel, (_, size, d) in sorted(self._files.items())}
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """Каталог, где имя файла уже содержит хэш (облегчённые копии картинок)."""
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if status_code == 200:
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    json.dump(AssetManifest(root).build().as_dict(), sys.stdout, ensure_ascii=False, indent=2)
+    print()
@@ -1,25 +1,158 @@
 import os
+import re
+import hmac
+import html
 import time
 import logging
 import asyncio
+from collections import namedtuple
 from urllib.parse import unquote
-from flask import Flask, jsonify, request as flask_request
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Mount, Route
 from telegram import (
-    Update, InlineKeyboardButton, InlineKeyboardMarkup,
-    ReplyKeyboardMarkup, ReplyKeyboardRemove, InputFile
+    Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton,
+    ReplyKeyboardMarkup, ReplyKeyboardRemove, InputFile, InputMediaPhoto,
+    InlineQueryResultArticle, InlineQueryResultCachedPhoto, InlineQueryResultPhoto, InputTextMessageContent
 )
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, CallbackQueryHandler,
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler,
     ContextTypes, filters
 )
-from telegram.request import HTTPXRequest
+from telegram.error import BadRequest, RetryAfter
+
+from assets import AssetManifest, ImmutableStaticFiles
+from actions import ActionPlan
+from broadcast import AudienceStore, Broadcaster, describe
+from callbacks import LOC, LOCS, MENU, PROJ, PROJS, CallbackRouter, encode
+from catalog import CatalogError, CatalogSource, build_catalog
+from dedup import make_dedup
+from estimate import PriceSource, answer, build_estimator, overview, parse_request
+from images import Derivatives
+from inline_search import build_search, deep_link, parse_start
+from knowledge import KnowledgeBase, is_stale, reindex
+from leads import CrmWebhook, LeadQueue, LeadStore
+from loadtest import UpdateRecorder
+from media_cache import MediaCache
+from metrics import CONTENT_TYPE, REGISTRY, instrument
+from ratelimit import OutboundLimiter
+from scheduler import ChatScheduler
+from state_store import make_state_store
+from static_server import StaticApp, StaticResolver
+from tracing import OtlpExporter, Tracer, activate, deactivate, span
+from transport import make_bot_request
 
 # ========= ENV =========
 BOT_TOKEN = os.environ["BOT_TOKEN"]
 BASE_URL  = os.environ.get("BASE_URL", "").rstrip("/")
+# /stats и /metrics — только с «Authorization: Bearer <токен>»; по умолчанию
+# тот же секрет, что у вебхука. Пусто — оба закрыты.
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+STATS_TOKEN = os.environ.get("STATS_TOKEN", WEBHOOK_SECRET)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Статика отдельным процессом (static_server.py): её публичный адрес, например
+# https://static.example. Пусто — отдаём сами на {BASE_URL}/static.
+STATIC_URL = os.environ.get("STATIC_URL", "").rstrip("/")
+
+# Каталог локаций/проектов и как часто проверять его изменения (сек)
+CATALOG_FILE = os.environ.get("CATALOG_FILE", os.path.join(STATIC_DIR, "catalog.json"))
+CATALOG_POLL = float(os.environ.get("CATALOG_POLL", "5"))
+# Прайс для «🧮 Расчёт стоимости» (перечитывается вместе с каталогом)
+# Прайс — только утверждённый отделом продаж; без него расчёт ведёт менеджер
+PRICES_FILE = os.environ.get("PRICES_FILE", "")
+# Сколько Telegram кэширует ответ на inline-запрос (сек)
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", "300"))
+# Индекс для «🤖 Задать вопрос ИИ» (knowledge.py; строится при прогреве, если устарел)
+KNOWLEDGE_INDEX = os.environ.get("KNOWLEDGE_INDEX", ".cache/knowledge.idx")
+
+# Где хранить file_id загруженных картинок (переживает рестарт)
+MEDIA_CACHE_FILE = os.environ.get("MEDIA_CACHE_FILE", ".media_cache.json")
+
+# Облегчённые копии картинок для отправки (1280 px, progressive, без EXIF)
+DERIVED_DIR = os.environ.get("DERIVED_DIR", ".cache/derived")
+
+# Параллельная обработка апдейтов: воркеры на процесс и предел очереди
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", "16"))
+UPDATE_QUEUE_MAX = int(os.environ.get("UPDATE_QUEUE_MAX", "1000"))
+
+# Повторы апдейтов от Telegram: memory (на процесс) или sqlite (общий для воркеров)
+DEDUP_BACKEND = os.environ.get("DEDUP_BACKEND", "memory")
+DEDUP_DB = os.environ.get("DEDUP_DB", ".dedup.sqlite3")
+DEDUP_TTL = float(os.environ.get("DEDUP_TTL", "3600"))
+DEDUP_MAX = int(os.environ.get("DEDUP_MAX", "10000"))
+
+# Соединения с Bot API: пул для JSON-вызовов и отдельный для заливки файлов
+TG_POOL_SIZE = int(os.environ.get("TG_POOL_SIZE", "16"))
+TG_MEDIA_POOL_SIZE = int(os.environ.get("TG_MEDIA_POOL_SIZE", "4"))
+TG_POOL_TIMEOUT = float(os.environ.get("TG_POOL_TIMEOUT", "20"))
+TG_KEEPALIVE = float(os.environ.get("TG_KEEPALIVE", "30"))         # сек простоя до закрытия соединения
+TG_HTTP_VERSION = os.environ.get("TG_HTTP_VERSION", "1.1")          # "2" — мультиплексирование (нужен h2)
+
+# Состояние пользователей (user_data): sqlite/redis — общее для воркеров и
+# переживает рестарт; memory — только в памяти процесса
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "sqlite")
+STATE_DB = os.environ.get("STATE_DB", ".state.sqlite3")
+STATE_REDIS_URL = os.environ.get("STATE_REDIS_URL", "redis://127.0.0.1:6380/0")
+STATE_TTL = float(os.environ.get("STATE_TTL", "1800"))              # сколько держать в памяти молчащих
+STATE_STORE_TTL = float(os.environ.get("STATE_STORE_TTL", str(30 * 24 * 3600)))
+STATE_FLUSH = float(os.environ.get("STATE_FLUSH", "1"))             # период пакетной записи, сек
+# Несколько воркеров — перечитываем пользователя перед каждым апдейтом
+STATE_SHARED = os.environ.get(
+    "STATE_SHARED", "1" if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1 else "0") == "1"
+
+# Лимиты Telegram на исходящие: ~30 сообщений/с на бота, ~1/с в чат
+TG_GLOBAL_RATE = float(os.environ.get("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.environ.get("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = float(os.environ.get("TG_CHAT_BURST", "3"))
+TG_MAX_RETRIES = int(os.environ.get("TG_MAX_RETRIES", "3"))
+
+# Прогрев воркера при старте: инициализация PTB (getMe), соединение с Bot API,
+# проверка статики, облегчённые копии. WARMUP=0 — PTB инициализируется лениво.
+WARMUP = os.environ.get("WARMUP", "1") == "1"
+# Служебный чат, куда заранее заливаем фото без file_id в кэше (пусто — не заливаем)
+MEDIA_WARMUP_CHAT_ID = os.environ.get("MEDIA_WARMUP_CHAT_ID", "").strip()
+WARMUP_UPLOADS = int(os.environ.get("WARMUP_UPLOADS", "4"))
+
+# Трассировка: апдейты дольше TRACE_SLOW_MS пишутся в лог bot.trace деревом шагов
+# (доля TRACE_SAMPLE); OTLP_ENDPOINT — коллектор OpenTelemetry (http://host:4318)
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "1000"))
+TRACE_SAMPLE = float(os.environ.get("TRACE_SAMPLE", "1"))
+OTLP_ENDPOINT = os.environ.get("OTLP_ENDPOINT", "").strip()
+OTLP_SAMPLE = float(os.environ.get("OTLP_SAMPLE", "0.01"))          # доля обычных апдейтов для экспорта
+
+# Нагрузочные прогоны: TG_API_BASE — адрес Bot API (fake_telegram.py вместо
+# api.telegram.org); RECORD_UPDATES — файл JSONL, куда писать обезличенные апдейты
+TG_API_BASE = os.environ.get("TG_API_BASE", "https://api.telegram.org/bot")
+TG_FILE_BASE = os.environ.get("TG_FILE_BASE", "https://api.telegram.org/file/bot")
+RECORD_UPDATES = os.environ.get("RECORD_UPDATES", "").strip()
+RECORD_SALT = os.environ.get("RECORD_SALT", "")
 
-# Принудительное обновление кэша Telegram (увидел новые картинки — увеличь версию)
-CACHE_VER = "2025-11-05-3"
+# Рассылки: аудитория (все, кто нажимал /start) и прогресс — в BROADCAST_DB.
+# Запускать /broadcast могут ADMIN_IDS (через запятую; по умолчанию —
+# TELEGRAM_ADMIN_CHAT_ID, как у scripts/notify.py). Темп чуть ниже 30/с Telegram:
+# остаток — живым ответам пользователей
+BROADCAST_DB = os.environ.get("BROADCAST_DB", ".broadcast.sqlite3")
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "28"))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "16"))
+ADMIN_IDS = {int(x) for x in (os.environ.get("ADMIN_IDS") or os.environ.get("TELEGRAM_ADMIN_CHAT_ID", "")).split(",")
+             if x.strip().lstrip("-").isdigit()}
+
+# Заявки «Связаться с менеджером»: база (переживает рестарт), чат менеджеров
+# (по умолчанию — TELEGRAM_ADMIN_CHAT_ID) и CRM-вебхук (пусто — не шлём)
+LEADS_DB = os.environ.get("LEADS_DB", ".leads.sqlite3")
+LEADS_CHAT_ID = os.environ.get("LEADS_CHAT_ID") or os.environ.get("TELEGRAM_ADMIN_CHAT_ID", "")
+CRM_WEBHOOK_URL = os.environ.get("CRM_WEBHOOK_URL", "").strip()
+CRM_TOKEN = os.environ.get("CRM_TOKEN", "")
+
+# Навигация: inplace — одна карточка на чат, правим её на месте;
+# classic — как раньше, каждая карточка новым сообщением
+NAV_MODE = os.environ.get("NAV_MODE", "inplace")
+
+# Точка отсчёта холодного старта: форк воркера (gunicorn post_fork) или импорт
+BOOT_TS = float(os.environ.get("WORKER_FORKED_AT") or time.time())
 
 # ========= LOGGING =========
 logging.basicConfig(level=logging.INFO)
@@ -30,28 +163,58 @@ try:
 except Exception:
     pass
 
-# ========= GLOBAL LOOP =========
-LOOP = asyncio.new_event_loop()
-asyncio.set_event_loop(LOOP)
-
 # ========= PTB APP (увеличенные таймауты) =========
-tg_request = HTTPXRequest(
+# Два пула: json (кнопки, тексты, фото по file_id) и media (заливка файлов)
+tg_request = make_bot_request(
+    json_pool=TG_POOL_SIZE,
+    media_pool=TG_MEDIA_POOL_SIZE,
+    keepalive=TG_KEEPALIVE,
+    http_version=TG_HTTP_VERSION,
+    pool_timeout=TG_POOL_TIMEOUT,
     connect_timeout=20.0,
     read_timeout=60.0,
     write_timeout=60.0,
-    pool_timeout=20.0,
 )
-application = Application.builder().token(BOT_TOKEN).request(tg_request).build()
+LIMITER = OutboundLimiter(
+    global_rate=TG_GLOBAL_RATE,
+    chat_rate=TG_CHAT_RATE,
+    chat_burst=TG_CHAT_BURST,
+    max_retries=TG_MAX_RETRIES,
+)
+STATE = make_state_store(
+    STATE_BACKEND,
+    path=STATE_DB,
+    url=STATE_REDIS_URL,
+    ttl=STATE_TTL,
+    store_ttl=STATE_STORE_TTL,
+    interval=STATE_FLUSH,
+    shared=STATE_SHARED,
+)
+builder = (Application.builder().token(BOT_TOKEN).base_url(TG_API_BASE).base_file_url(TG_FILE_BASE)
+           .request(tg_request).rate_limiter(LIMITER))
+if STATE:
+    builder = builder.persistence(STATE)
+application = builder.build()
 _initialized = False
+_init_lock = asyncio.Lock()
+# выставляется после initialize(): фоновые задачи ждут его, а не опрашивают флаг
+_init_done = asyncio.Event()
+MEDIA_CACHE = MediaCache(MEDIA_CACHE_FILE)
+IMAGES = Derivatives(DERIVED_DIR, digest_of=MEDIA_CACHE.digest)
+AUDIENCE = AudienceStore(BROADCAST_DB)
 
-def ensure_initialized() -> None:
+async def ensure_initialized() -> None:
     """Инициализируем PTB-Application ровно один раз в процессе."""
     global _initialized
     if _initialized:
         return
-    LOOP.run_until_complete(application.initialize())
-    _initialized = True
-    logger.info("✅ Telegram Application initialized")
+    async with _init_lock:
+        if _initialized:
+            return
+        await application.initialize()
+        _initialized = True
+        _init_done.set()
+        logger.info("✅ Telegram Application initialized")
 
 # ========= UI =========
 MAIN_MENU = [
@@ -63,186 +226,211 @@ MAIN_MENU = [
 def kb(rows):
     return ReplyKeyboardMarkup(rows, resize_keyboard=True)
 
-# ========= ЛОКАЦИИ (список, слаги, данные) =========
-LOCATIONS = [
-    "Шопино",
-    "Чижовка",
-    "р-н магазина METRO",
-    "КП Южный",
-    "Еловка",
-    "ВеснаЛэнд (Черносвитино)",
-    "Сивково",
-    "Некрасово",
-    "Груздово",
-    "КП Московский",
-]
+MAIN_MENU_KB = kb(MAIN_MENU)
+CONTACT_KB = kb([[KeyboardButton("📱 Отправить номер", request_contact=True)], ["⬅️ В меню"]])
+
+# ========= ЛОКАЦИИ И ПРОЕКТЫ =========
+# Описания живут в static/catalog.json (правка подхватывается без рестарта)
+
+def _local_path(photo_url):
+    """URL вида {BASE_URL}/static/... или {STATIC_URL}/... → локальный путь static/... (или None)."""
+    if photo_url and STATIC_URL and photo_url.startswith(f"{STATIC_URL}/"):
+        return "static/" + unquote(photo_url[len(STATIC_URL) + 1:].split("?", 1)[0])
+    if not (photo_url and BASE_URL and photo_url.startswith(f"{BASE_URL}/")):
+        return None
+    rel_url = photo_url[len(BASE_URL):].lstrip("/")
+    rel_path = unquote(rel_url.split("?", 1)[0])
+    return rel_path if rel_path.startswith("static/") else None
+
+# ========= СТАТИКА И КАТАЛОГ =========
+# Версия в URL картинок/PDF = хэш содержимого (вместо ручного CACHE_VER)
+ASSETS = AssetManifest(STATIC_DIR).build()
+
+WELCOME_PATH = "static/welcome.jpg"
+
+def asset_url(rel: str):
+    if STATIC_URL:
+        return ASSETS.url(STATIC_URL, rel, mount="")
+    return ASSETS.url(BASE_URL, rel)
+
+def derived_url(local_path, variant: str = "thumb"):
+    """Публичный URL облегчённой копии (превью и т.п.) или None."""
+    name = IMAGES.name(local_path, variant) if (BASE_URL and local_path) else None
+    return f"{BASE_URL}/derived/{name}" if name else None
 
-# человекочитаемое название → slug (для путей к файлам)
-LOC_SLUG = {
-    "Шопино": "shopino",
-    "Чижовка": "chizhovka",
-    "р-н магазина METRO": "metro",
-    "КП Южный": "kp_yuzhniy",
-    "Еловка": "elovka",
-    "ВеснаЛэнд (Черносвитино)": "vesnaland",
-    "Сивково": "sivkovo",
-    "Некрасово": "nekrasovo",
-    "Груздово": "gruzdovo",
-    "КП Московский": "kp_moskovskiy",
-}
-
-def _loc_data(name: str, body: str, *, has_video: bool=False) -> dict:
-    slug = LOC_SLUG[name]
-    photo = f"{BASE_URL}/static/locations/{slug}/{slug}.jpg?v={CACHE_VER}" if BASE_URL else None
-    pres  = f"{BASE_URL}/static/locations/{slug}/{slug}.pdf" if BASE_URL else None
-    video = f"{BASE_URL}/static/locations/{slug}/video.mp4" if (BASE_URL and has_video) else None
-    caption = f"<b>{name}</b>\n{body}"
-    return {"photo": photo, "presentation": pres, "video": video, "caption": caption}
-
-# === ТВОИ ОПИСАНИЯ ===
-LOCATIONS_DATA = {
-    "Шопино": _loc_data(
-        "Шопино",
-        "Современный посёлок в шаге от города: школы и детские сады в 5–7 минутах, "
-        "крупные ТЦ — около 10 минут на автомобиле. Спортивные площадки и прогулочные зоны рядом, "
-        "а до центра города — примерно 15–20 минут. Очень развитая система общественного транспорта."
-    ),
-    "Чижовка": _loc_data(
-        "Чижовка",
-        "Локация с развитой инфраструктурой: детские учреждения и школы в пешей доступности в мкр. Веснушки, "
-        "торговые точки и фитнес-клубы — 8–10 минут до ТЦ. До центра на машине — около 15–20 минут. "
-        "Отличный выбор для активных родителей: спорт, учёба и комфорт рядом."
-    ),
-    "р-н магазина METRO": _loc_data(
-        "р-н магазина METRO",
-        "Район около крупного гипермаркета METRO: торговые и бытовые услуги — в шаговой доступности. "
-        "Детские сады и школы — 5–10 минут, спортивные объекты — 10–12 минут. "
-        "До центра города — около 15–20 минут. Удобен для семей и тех, кто ценит быстрый доступ к сервисам."
-    ),
-    "КП Южный": _loc_data(
-        "КП Южный",
-        "Современный посёлок окруженный лесом на 23 домовладения в шаге от города: школы и детские сады в 10–15 минутах, "
-        "крупные ТЦ — около 10 минут на автомобиле, а до центра города — примерно 10–15 минут.",
-        has_video=True  # хотим кнопку «Смотреть видео»
-    ),
-    "Еловка": _loc_data(
-        "Еловка",
-        "Спокойный посёлок для тех, кто хочет уединения, но оставаться в пределах города: "
-        "школы и детсады есть, инфраструктура более пригородная. До центра — ~25–30 минут. "
-        "Подойдёт для удалённой работы и более размеренного темпа жизни: рядом природа и меньше суеты."
-    ),
-    "ВеснаЛэнд (Черносвитино)": _loc_data(
-        "ВеснаЛэнд (Черносвитино)",
-        "Новая жилая зона с акцентом на семейный комфорт: дворовые площадки, зелёные зоны и удобные связи с городом. "
-        "Детские учреждения и спорт — в близком окружении; до центра — около 10–15 минут. "
-        "Одна из немногих локаций со всеми центральными коммуникациями."
-    ),
-    "Сивково": _loc_data(
-        "Сивково",
-        "Пригородная локация: дальше от центра (~30 минут), но плюсы — тишина, свежий воздух, больше пространства. "
-        "Подходит тем, кто ценит размеренный стиль жизни, в том числе пенсионерам и удалённым специалистам."
-    ),
-    "Некрасово": _loc_data(
-        "Некрасово",
-        "Баланс близости и спокойствия: до центра — ~15–20 минут, школы и сады — 10–15 минут, "
-        "торговля и спорт — чуть дальше. Комфорт загородной жизни без значительного удаления от города."
-    ),
-    "Груздово": _loc_data(
-        "Груздово",
-        "Спокойная локация с акцентом на проживание: до центра — ~30 минут, инфраструктура есть, "
-        "но не ориентирована на интенсивный городской ритм. Хорошо для семей и тех, кто ценит тишину и пространство."
-    ),
-    "КП Московский": _loc_data(
-        "КП Московский",
-        "Коттеджный посёлок за городом: школы и сады — в пределах 10–15 минут на авто, до центра — ~20–25 минут. "
-        "Подходит тем, кто хочет дом-«отдушину»: тишина, зелень, комфорт загородной жизни при гибком графике."
-    ),
-}
+# Подписи, клавиатуры и локальные пути готовы заранее — в хендлерах только поиск в dict
+CATALOG_SOURCE = CatalogSource(
+    CATALOG_FILE,
+    build=lambda raw: build_catalog(raw, asset_url=asset_url, local_path_of=_local_path),
+)
+CATALOG = CATALOG_SOURCE.load()
+# Префиксный/триграммный индекс для inline-режима — пересобирается вместе с каталогом
+SEARCH = build_search(CATALOG)
+
+# Все варианты цены посчитаны заранее (estimate.py); None — прайса нет, считает менеджер
+PRICE_SOURCE = PriceSource(PRICES_FILE, build=lambda prices: build_estimator(CATALOG_SOURCE.raw, prices)) \
+    if PRICES_FILE else None
+ESTIMATOR = None
+if PRICE_SOURCE is None:
+    logger.info("PRICES_FILE не задан — расчёт стоимости у менеджера")
+else:
+    try:
+        ESTIMATOR = PRICE_SOURCE.load()
+    except (OSError, CatalogError) as e:
+        logger.error(f"Прайс {PRICES_FILE} не загружен, расчёт стоимости выключен: {e}")
+
+# Ответы на вопросы — из индекса по каталогу и презентациям; файл открывается при первом вопросе
+KNOWLEDGE = KnowledgeBase(KNOWLEDGE_INDEX)
+
+def refresh_knowledge() -> None:
+    """Переиндексировать, если каталог или презентации новее индекса."""
+    if is_stale(KNOWLEDGE_INDEX, STATIC_DIR, CATALOG_FILE):
+        reindex(KNOWLEDGE_INDEX, STATIC_DIR, CATALOG_FILE)
+
+def catalog_photos(catalog=None):
+    """Локальные пути всех картинок каталога + баннер."""
+    catalog = catalog or CATALOG
+    entries = (*catalog.locations.values(), *catalog.projects.values())
+    return [e.local_path for e in entries if e.local_path] + [WELCOME_PATH]
+
+def _poll_catalog():
+    """Новый каталог, если поменялся файл каталога или версии статики; иначе None."""
+    changed_assets = ASSETS.refresh()
+    fresh = CATALOG_SOURCE.poll()
+    if fresh is None and changed_assets:
+        logger.info(f"Обновилась статика: {sorted(changed_assets)}")
+        fresh = CATALOG_SOURCE.rebuild()
+    return fresh
+
+def _poll_prices(catalog_changed: bool):
+    """Новый Estimator, если поменялся прайс или каталог (площади, локации); иначе None."""
+    if PRICE_SOURCE is None:
+        return None
+    fresh = PRICE_SOURCE.poll()
+    if fresh is None and catalog_changed and PRICE_SOURCE.raw is not None:
+        try:
+            fresh = PRICE_SOURCE.rebuild()
+        except CatalogError as e:
+            logger.error(f"Прайс не пересобран под новый каталог, работаем на старом: {e}")
+    return fresh
+
+async def watch_catalog() -> None:
+    """Следим за каталогом, прайсом и статикой и атомарно подменяем CATALOG / ESTIMATOR."""
+    global CATALOG, ESTIMATOR, SEARCH
+    while True:
+        await asyncio.sleep(CATALOG_POLL)
+        try:
+            fresh = await asyncio.to_thread(_poll_catalog)
+            estimator = await asyncio.to_thread(_poll_prices, fresh is not None)
+            if fresh is not None:
+                await asyncio.to_thread(refresh_knowledge)
+                await asyncio.to_thread(MEDIA_CACHE.prime, catalog_photos(fresh))
+        except Exception:
+            logger.exception("Ошибка перечитывания каталога")
+            continue
+        if fresh is not None:
+            CATALOG, SEARCH = fresh, build_search(fresh)
+        if estimator is not None:
+            ESTIMATOR = estimator
 
 def make_locations_inline() -> InlineKeyboardMarkup:
-    rows = [[InlineKeyboardButton(name, callback_data=f"loc:{name}")] for name in LOCATIONS]
-    rows.append([InlineKeyboardButton("🏠 Вернуться в меню", callback_data="back_to_menu")])
-    return InlineKeyboardMarkup(rows)
-
-# ========= ПРОЕКТЫ (как были) =========
-PROJECTS = ["Весна 90", "Весна 98", "Весна 105", "Весна 112"]
-
-PROJECTS_DATA = {
-    "Весна 90": {
-        "photo": f"{BASE_URL}/static/projects/vesna90/vesna90.jpg" if BASE_URL else None,
-        "caption": (
-            "<b>Весна 90</b>\n"
-            "Чудесный дом 90 м² с большими окнами в пол, которые наполняют кухню-гостиную солнечным светом.\n\n"
-            "• Кухня-гостиная: 24,4 м²\n"
-            "• Спальня: 16,9 м²\n"
-            "• Кабинет: 14,4 м²\n"
-            "• Детская: 14,4 м²\n"
-            "• Санузел: 5,9 м²\n"
-            "• Прихожая: 12,2 м²\n"
-            "• Крыльцо: 3,9 м²"
-        ),
-        "presentation": f"{BASE_URL}/static/projects/vesna90/vesna90.pdf",
-    },
-    "Весна 98": {
-        "photo": f"{BASE_URL}/static/projects/vesna98/vesna98.jpg" if BASE_URL else None,
-        "caption": (
-            "<b>Весна 98</b>\n"
-            "Удобный и комфортный проект 98 м² с потолком 4,5 м и панорамным остеклением в обеденной зоне.\n\n"
-            "• Кухня-гостиная: 27,3 м²\n"
-            "• Спальня: 17,1 м²\n"
-            "• Детская: 14 м²\n"
-            "• Кабинет: 14 м²\n"
-            "• Санузел: 6 м²\n"
-            "• Санузел гостевой: 2,5 м²\n"
-            "• Прихожая: 13,3 м²\n"
-            "• Крыльцо: 3,5 м²"
-        ),
-        "presentation": f"{BASE_URL}/static/projects/vesna98/vesna98.pdf",
-    },
-    "Весна 105": {
-        "photo": f"{BASE_URL}/static/projects/vesna105/vesna105.jpg" if BASE_URL else None,
-        "caption": (
-            "<b>Весна 105</b>\n"
-            "Увеличенная версия Весна-98 — ещё больше света и пространства.\n\n"
-            "• Кухня-гостиная: 27,5 м²\n"
-            "• Спальня: 18,6 м²\n"
-            "• Детская: 16 м²\n"
-            "• Кабинет: 16 м²\n"
-            "• Санузел: 5,9 м²\n"
-            "• Санузел гостевой: 2,7 м²\n"
-            "• Прихожая: 14,1 м²\n"
-            "• Крыльцо: 3,5 м²"
-        ),
-        "presentation": f"{BASE_URL}/static/projects/vesna105/vesna105.pdf",
-    },
-    "Весна 112": {
-        "photo": f"{BASE_URL}/static/projects/vesna112/vesna112.jpg" if BASE_URL else None,
-        "caption": (
-            "<b>Весна 112</b>\n"
-            "Те же большие окна в пол, что нравятся в Весна-90, плюс 3 спальни и 2 санузла.\n\n"
-            "• Кухня-гостиная: 28,9 м²\n"
-            "• Детская: 14,9 м²\n"
-            "• Кабинет: 14,9 м²\n"
-            "• Спальня: 19,2 м²\n"
-            "• Санузел: 5,7 м²\n"
-            "• Санузел 2: 1,6 м²\n"
-            "• Гардероб: 6,7 м²\n"
-            "• Прихожая: 15,2 м²\n"
-            "• Крыльцо: 4,9 м²"
-        ),
-        "presentation": f"{BASE_URL}/static/projects/vesna112/vesna112.pdf",
-    },
-}
+    return CATALOG.locations_markup
 
 def make_projects_inline() -> InlineKeyboardMarkup:
-    rows = [[InlineKeyboardButton(f"🏡 {name}", callback_data=f"proj:{name}")] for name in PROJECTS]
-    rows.append([InlineKeyboardButton("🏠 Вернуться в меню", callback_data="back_to_menu")])
-    return InlineKeyboardMarkup(rows)
+    return CATALOG.projects_markup
 
 # ========= HELPERS =========
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.exception("❗ Unhandled error", exc_info=context.error)
 
+def _remember_file_id(local_path, message) -> None:
+    if local_path and message is not None and getattr(message, "photo", None):
+        MEDIA_CACHE.put(local_path, message.photo[-1].file_id)
+
+class CardGone(Exception):
+    """Сообщение-карточку больше нельзя редактировать (удалено или слишком старое)."""
+
+PHOTO_TOTAL = REGISTRY.counter("bot_photo_delivery_total", "Откуда ушло фото (text — не ушло)", ("source",))
+UPLOAD_SECONDS = REGISTRY.histogram("bot_photo_upload_seconds", "Заливка локального файла: копия + отправка")
+
+# Эти ошибки не лечатся другим источником фото — пробрасываем сразу.
+# RetryAfter: лимитер уже отработал повторы — fallback лишь добавит запросов.
+_NO_FALLBACK = (RetryAfter, CardGone)
+
+async def deliver_photo(send, local_path, photo_url, label: str):
+    """
+    Отправка фото цепочкой: file_id из кэша → локальный файл → URL.
+    send(photo) — корутина, которая реально шлёт фото (send_photo, edit_message_media).
+    Возвращает отправленное сообщение (или True), если фото ушло;
+    False — вызывающий шлёт текстовый fallback.
+    """
+    if local_path and not MEDIA_CACHE.known(local_path):
+        # фото не прогрето (новое или поменялось) — sha256 в потоке, не в цикле событий
+        await asyncio.to_thread(MEDIA_CACHE.digest, local_path)
+    file_id = MEDIA_CACHE.get(local_path) if local_path else None
+    if file_id:
+        try:
+            msg = await send(file_id)
+            PHOTO_TOTAL.inc("file_id")
+            return msg or True
+        except _NO_FALLBACK:
+            raise
+        except BadRequest as e:
+            # file_id протух или выдан другому боту — забываем и грузим заново
+            logger.warning(f"cached file_id rejected for {label}: {e}")
+            MEDIA_CACHE.forget(local_path)
+        except Exception as e:
+            logger.warning(f"send_photo(file_id) failed for {label}: {e}")
+
+    try:
+        if local_path and os.path.isfile(local_path) and os.path.getsize(local_path) > 0:
+            # заливаем облегчённую копию; file_id всё равно привязан к исходнику
+            started = time.perf_counter()
+            with span("photo.derive", path=local_path):
+                upload_path = await asyncio.to_thread(IMAGES.for_upload, local_path)
+            with span("photo.read", path=upload_path):
+                with open(upload_path, "rb") as f:
+                    photo = InputFile(f, filename=os.path.basename(local_path))
+            msg = await send(photo)
+            UPLOAD_SECONDS.observe(time.perf_counter() - started)
+            PHOTO_TOTAL.inc("local")
+            _remember_file_id(local_path, msg)
+            return msg or True
+    except _NO_FALLBACK:
+        raise
+    except Exception as e:
+        logger.warning(f"send_photo(local) failed for {label}: {e}")
+
+    if photo_url:
+        try:
+            msg = await send(photo_url)
+            PHOTO_TOTAL.inc("url")
+            _remember_file_id(local_path, msg)
+            return msg or True
+        except _NO_FALLBACK:
+            raise
+        except Exception as e:
+            logger.warning(f"send_photo(url) failed for {label}: {e}")
+    PHOTO_TOTAL.inc("text")
+    return False
+
+async def send_photo_card(chat_id, *, local_path, photo_url, caption, reply_markup,
+                          context: ContextTypes.DEFAULT_TYPE, label: str):
+    async def send(photo):
+        return await context.bot.send_photo(
+            chat_id=chat_id,
+            photo=photo,
+            caption=caption,
+            parse_mode="HTML",
+            reply_markup=reply_markup
+        )
+    return await deliver_photo(send, local_path, photo_url, label)
+
+WELCOME_CAPTION = (
+    "👋 Привет! Я бот <b>MR.House</b>.\n"
+    "Помогу выбрать локацию и проект, посчитать стоимость и связать с менеджером."
+)
+
 async def send_welcome_with_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Приветствие + баннер + главное меню (антидубль 10с)."""
     now = time.time()
@@ -251,26 +439,21 @@ async def send_welcome_with_photo(update: Update, context: ContextTypes.DEFAULT_
         return
     context.user_data["_last_welcome_ts"] = now
 
-    banner_url = f"{BASE_URL}/static/welcome.jpg" if BASE_URL else None
-    caption = (
-        "👋 Привет! Я бот <b>MR.House</b>.\n"
-        "Помогу выбрать локацию и проект, посчитать стоимость и связать с менеджером."
-    )
+    banner_url = asset_url("welcome.jpg")
+    banner_path = WELCOME_PATH
+    caption = WELCOME_CAPTION
 
     chat_id = update.effective_chat.id
-    sent_banner = False
-    if banner_url:
-        try:
-            await context.bot.send_photo(chat_id=chat_id, photo=banner_url, caption=caption, parse_mode="HTML")
-            sent_banner = True
-        except Exception as e:
-            logger.warning(f"Не смог отправить фото-баннер: {e}")
+    sent_banner = await send_photo_card(
+        chat_id, local_path=banner_path, photo_url=banner_url, caption=caption,
+        reply_markup=None, context=context, label="welcome"
+    )
 
     if not sent_banner:
         await context.bot.send_message(chat_id=chat_id,
                                        text="👋 Привет! Я бот MR.House. Готов помочь.",
                                        parse_mode="HTML")
-    await context.bot.send_message(chat_id=chat_id, text="Выберите раздел 👇", reply_markup=kb(MAIN_MENU))
+    await context.bot.send_message(chat_id=chat_id, text="Выберите раздел 👇", reply_markup=MAIN_MENU_KB)
     context.user_data["state"] = "MAIN"
 
 # ========= ЛОКАЦИИ (UI) =========
@@ -285,70 +468,36 @@ async def show_locations_inline(update: Update, context: ContextTypes.DEFAULT_TY
     else:
         await context.bot.send_message(update.effective_chat.id, text, reply_markup=markup)
 
-# Локация: сначала локальный файл → затем URL → затем fallback
-async def send_location_card(chat, location_name: str, context: ContextTypes.DEFAULT_TYPE):
-    data = LOCATIONS_DATA.get(location_name)
-    if not data:
-        await context.bot.send_message(chat_id=chat.id, text=f"Скоро добавим карточку для «{location_name}».")
-        return
-
-    photo_url = data.get("photo")
-    presentation = data.get("presentation")
-    video = data.get("video")
+# Карточка = всё, что нужно для показа: фото (локально/URL), подпись, кнопки.
+# Карточки каталога (catalog.Entry) устроены так же.
+Card = namedtuple("Card", "label local_path photo_url caption markup")
 
-    # Кнопки без дублей: сначала презентация, потом видео
-    buttons = []
-    if presentation:
-        buttons.append([InlineKeyboardButton("📘 Смотреть презентацию", url=presentation)])
-    if video:
-        buttons.append([InlineKeyboardButton("🎬 Смотреть видео", url=video)])
-    buttons.append([InlineKeyboardButton("📋 К списку локаций", callback_data="back_to_locs")])
-    buttons.append([InlineKeyboardButton("🏠 Вернуться в меню", callback_data="back_to_menu")])
-    markup = InlineKeyboardMarkup(buttons)
-
-    sent = False
-    try:
-        local_path = None
-        if photo_url and BASE_URL and photo_url.startswith(f"{BASE_URL}/"):
-            rel_url = photo_url[len(BASE_URL):].lstrip("/")
-            rel_path = unquote(rel_url.split("?", 1)[0])
-            if rel_path.startswith("static/"):
-                local_path = rel_path
+def location_card(location_name: str):
+    return CATALOG.location(location_name)
 
-        if local_path and os.path.isfile(local_path) and os.path.getsize(local_path) > 0:
-            with open(local_path, "rb") as f:
-                await context.bot.send_photo(
-                    chat_id=chat.id,
-                    photo=InputFile(f, filename=os.path.basename(local_path)),
-                    caption=data["caption"],
-                    parse_mode="HTML",
-                    reply_markup=markup
-                )
-                sent = True
-    except Exception as e:
-        logger.warning(f"send_photo(local) failed for {location_name}: {e}")
-
-    if not sent and photo_url:
-        try:
-            await context.bot.send_photo(
-                chat_id=chat.id,
-                photo=photo_url,
-                caption=data["caption"],
-                parse_mode="HTML",
-                reply_markup=markup
-            )
-            sent = True
-        except Exception as e:
-            logger.warning(f"send_photo(url) failed for {location_name}: {e}")
+async def send_card(chat_id, card: Card, context: ContextTypes.DEFAULT_TYPE):
+    """Новое сообщение-карточка: file_id из кэша → локальный файл → URL → текст."""
+    sent = await send_photo_card(
+        chat_id, local_path=card.local_path, photo_url=card.photo_url,
+        caption=card.caption, reply_markup=card.markup, context=context, label=card.label
+    )
+    if sent:
+        return sent
+    # Последний резерв: только текст + кнопки
+    return await context.bot.send_message(
+        chat_id=chat_id,
+        text=card.caption,
+        parse_mode="HTML",
+        reply_markup=card.markup
+    )
 
-    if not sent:
-        # Последний резерв: только текст + кнопки
-        await context.bot.send_message(
-            chat_id=chat.id,
-            text=data["caption"],
-            parse_mode="HTML",
-            reply_markup=markup
-        )
+@instrument("send_location_card")
+async def send_location_card(chat, location_name: str, context: ContextTypes.DEFAULT_TYPE):
+    card = location_card(location_name)
+    if not card:
+        await context.bot.send_message(chat_id=chat.id, text=f"Скоро добавим карточку для «{location_name}».")
+        return
+    return await send_card(chat.id, card, context)
 
 # ========= ПРОЕКТЫ (UI) =========
 async def show_projects_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -362,78 +511,195 @@ async def show_projects_inline(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         await context.bot.send_message(update.effective_chat.id, text, reply_markup=markup)
 
-# Проект: локальный файл → URL → fallback
+def project_card(project_name: str):
+    return CATALOG.project(project_name)
+
+@instrument("send_project_card")
 async def send_project_card(chat, project_name: str, context: ContextTypes.DEFAULT_TYPE):
-    data = PROJECTS_DATA.get(project_name)
-    if not data:
+    card = project_card(project_name)
+    if not card:
         await context.bot.send_message(chat_id=chat.id, text=f"Скоро добавим карточку для «{project_name}».")
         return
+    return await send_card(chat.id, card, context)
 
-    photo_url = data.get("photo")
-    presentation = data["presentation"]
+# ========= НАВИГАЦИЯ В ОДНОМ СООБЩЕНИИ =========
+# В режиме inplace у чата одна «карточка» — фото-сообщение, у которого мы
+# меняем фото, подпись и кнопки (edit_message_media / edit_message_caption).
+# Её message_id хранится в user_data["card_msg_id"]. Если карточку уже нельзя
+# править (удалена, старше 48 часов) — шлём новую.
+_GONE_MARKERS = ("message to edit not found", "message can't be edited", "message_id_invalid",
+                 "there is no media in the message to edit", "message to delete not found")
 
-    markup = InlineKeyboardMarkup([
-        [InlineKeyboardButton("📘 Смотреть презентацию", url=presentation)],
-        [InlineKeyboardButton("📋 К списку проектов", callback_data="back_to_projects")],
-        [InlineKeyboardButton("🏠 Вернуться в меню", callback_data="back_to_menu")],
-    ])
+def _is_not_modified(e: Exception) -> bool:
+    return "not modified" in str(e).lower()
 
-    sent = False
+def _is_gone(e: Exception) -> bool:
+    text = str(e).lower()
+    return any(m in text for m in _GONE_MARKERS)
 
-    try:
-        local_path = None
-        if photo_url and BASE_URL and photo_url.startswith(f"{BASE_URL}/"):
-            rel_url = photo_url[len(BASE_URL):].lstrip("/")
-            rel_path = unquote(rel_url.split("?", 1)[0])
-            if rel_path.startswith("static/"):
-                local_path = rel_path
-
-        if local_path and os.path.isfile(local_path) and os.path.getsize(local_path) > 0:
-            with open(local_path, "rb") as f:
-                await context.bot.send_photo(
-                    chat_id=chat.id,
-                    photo=InputFile(f, filename=os.path.basename(local_path)),
-                    caption=data["caption"],
-                    parse_mode="HTML",
-                    reply_markup=markup
-                )
-                sent = True
-    except Exception as e:
-        logger.warning(f"send_photo(local) failed for {project_name}: {e}")
+async def _drop_messages(context: ContextTypes.DEFAULT_TYPE, chat_id, message_ids) -> None:
+    # удаления друг от друга не зависят — все сразу
+    async with ActionPlan("drop") as plan:
+        for mid in message_ids:
+            await plan.side(context.bot.delete_message(chat_id=chat_id, message_id=mid))
 
-    if not sent and photo_url:
+async def edit_card(message, card: Card, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Меняет фото/подпись/кнопки фото-сообщения на месте. False — править нельзя."""
+    async def edit(photo):
         try:
-            await context.bot.send_photo(
-                chat_id=chat.id,
-                photo=photo_url,
-                caption=data["caption"],
-                parse_mode="HTML",
-                reply_markup=markup
+            return await context.bot.edit_message_media(
+                chat_id=message.chat_id,
+                message_id=message.message_id,
+                media=InputMediaPhoto(photo, caption=card.caption, parse_mode="HTML"),
+                reply_markup=card.markup
             )
-            sent = True
-        except Exception as e:
-            logger.warning(f"send_photo(url) failed for {project_name}: {e}")
+        except BadRequest as e:
+            if _is_not_modified(e):
+                return None  # та же карточка — уже показана
+            if _is_gone(e):
+                raise CardGone(str(e)) from e
+            raise
 
-    if not sent:
-        await context.bot.send_message(
-            chat_id=chat.id,
-            text=data["caption"],
-            parse_mode="HTML",
-            reply_markup=markup
-        )
+    try:
+        return bool(await deliver_photo(edit, card.local_path, card.photo_url, card.label))
+    except CardGone as e:
+        logger.info(f"Карточка {message.message_id} недоступна для правки: {e}")
+        return False
+
+async def show_card_inplace(query, card: Card, context: ContextTypes.DEFAULT_TYPE) -> None:
+    message = query.message
+    if message.photo and await edit_card(message, card, context):
+        context.user_data["card_msg_id"] = message.message_id
+        return
+
+    # Клик из текстового списка (или карточку не поправить) — новая карточка,
+    # а старые сообщения навигации убираем, чтобы в чате была одна карточка
+    sent = await send_card(message.chat_id, card, context)
+    new_id = getattr(sent, "message_id", None)
+    stale = {message.message_id, context.user_data.get("card_msg_id")} - {None, new_id}
+    if new_id:
+        context.user_data["card_msg_id"] = new_id
+    await _drop_messages(context, message.chat_id, stale)
+
+async def show_list_inplace(query, text: str, markup, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Карточка → список (фото остаётся, меняются подпись и кнопки). False — не вышло."""
+    message = query.message
+    if not message.photo:
+        return False
+    try:
+        await query.edit_message_caption(caption=text, reply_markup=markup)
+    except BadRequest as e:
+        if not _is_not_modified(e):
+            logger.info(f"Не смог превратить карточку в список: {e}")
+            return False
+    context.user_data["card_msg_id"] = message.message_id
+    return True
+
+async def show_welcome_inplace(query, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Карточка → приветственный баннер + главное меню. False — не вышло."""
+    message = query.message
+    if not message.photo:
+        return False
+    banner = Card("welcome", WELCOME_PATH, asset_url("welcome.jpg"), WELCOME_CAPTION, None)
+    if not await edit_card(message, banner, context):
+        return False
+    # reply-клавиатуру можно прислать только новым сообщением
+    await context.bot.send_message(chat_id=message.chat_id, text="Выберите раздел 👇", reply_markup=MAIN_MENU_KB)
+    context.user_data["state"] = "MAIN"
+    context.user_data["_last_welcome_ts"] = time.time()
+    return True
 
 # ========= COMMANDS & ROUTING =========
-async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def join_audience(update: Update) -> None:
+    """Нажал /start в личке — получатель будущих рассылок."""
+    chat = update.effective_chat
+    if chat is None or chat.type != "private":
+        return
+    try:
+        await asyncio.to_thread(AUDIENCE.add, chat.id)
+    except Exception as e:
+        logger.warning(f"Не смог записать {chat.id} в аудиторию: {e}")
+
+# Что пользователь смотрел последним — уходит в заявку менеджеру, сброс меню это не стирает
+VIEWED_KEYS = ("viewed_loc", "viewed_proj")
+
+def reset_user_data(context: ContextTypes.DEFAULT_TYPE) -> None:
+    viewed = {k: context.user_data[k] for k in VIEWED_KEYS if k in context.user_data}
     context.user_data.clear()
+    context.user_data.update(viewed)
+
+def remember_viewed(context: ContextTypes.DEFAULT_TYPE, card) -> None:
+    if card is not None:
+        context.user_data["viewed_loc" if card.kind == "loc" else "viewed_proj"] = card.name
+
+@instrument("cmd_start")
+async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    reset_user_data(context)
+    await join_audience(update)
     await send_welcome_with_photo(update, context)
+    # пришли по ссылке из inline-карточки — сразу показываем её
+    target = parse_start(context.args[0]) if context.args else None
+    if target:
+        kind, slug = target
+        remember_viewed(context, CATALOG.location(slug) if kind == "loc" else CATALOG.project(slug))
+        send = send_location_card if kind == "loc" else send_project_card
+        await send(update.effective_chat, slug, context)
 
+@instrument("cmd_menu")
 async def cmd_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["state"] = "MAIN"
-    await update.message.reply_text("Главное меню 👇", reply_markup=kb(MAIN_MENU))
+    await update.message.reply_text("Главное меню 👇", reply_markup=MAIN_MENU_KB)
 
+@instrument("cmd_ping")
 async def cmd_ping(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🏓 Pong! Бот работает ✅")
 
+MENU_BUTTONS = {text for row in MAIN_MENU for text in row}
+
+async def show_estimate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if ESTIMATOR is None:
+        return await update.message.reply_text(
+            "Расчёт стоимости сейчас у менеджера: +7 (910) 864-07-37", reply_markup=MAIN_MENU_KB)
+    context.user_data["state"] = "CALC"
+    await update.message.reply_text(overview(ESTIMATOR), parse_mode="HTML", reply_markup=MAIN_MENU_KB)
+
+async def show_ask(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["state"] = "ASK"
+    await update.message.reply_text(
+        "Спросите про посёлки и проекты — например, «где рядом лес и озеро» "
+        "или «какая площадь кухни в Весна 112».", reply_markup=MAIN_MENU_KB)
+
+def knowledge_reply(found):
+    """Найденные фрагменты → (HTML-текст, кнопки карточек и презентаций) или None."""
+    if not found:
+        return None
+    parts, buttons, seen = ["🤖 Вот что нашёл в наших материалах:"], [], set()
+    for doc, _score in found:
+        text = doc["text"] if len(doc["text"]) <= 400 else doc["text"][:400].rsplit(" ", 1)[0] + "…"
+        parts.append(f"<b>{html.escape(doc['title'])}</b>\n{html.escape(text)}")
+        key = (doc["kind"], doc["slug"])
+        entry = CATALOG.location(doc["slug"]) if doc["kind"] == "loc" else CATALOG.project(doc["slug"])
+        if entry is None or key in seen or len(seen) == 2:
+            continue
+        seen.add(key)
+        tag = LOC if doc["kind"] == "loc" else PROJ
+        row = [InlineKeyboardButton(f"🏡 {entry.name}", callback_data=encode(tag, entry.slug))]
+        if entry.presentation:
+            page = f"#page={doc['page']}" if doc["page"] else ""
+            row.append(InlineKeyboardButton("📘 Презентация", url=entry.presentation + page))
+        buttons.append(row)
+    return "\n\n".join(parts), InlineKeyboardMarkup(buttons) if buttons else MAIN_MENU_KB
+
+async def answer_question(update: Update, context: ContextTypes.DEFAULT_TYPE, question: str):
+    reply = knowledge_reply(await asyncio.to_thread(KNOWLEDGE.ask, question))
+    if reply is None:
+        return await update.message.reply_text(
+            "Не нашёл ответа в наших материалах — спросите менеджера: +7 (910) 864-07-37",
+            reply_markup=MAIN_MENU_KB)
+    text, markup = reply
+    await update.message.reply_text(text, parse_mode="HTML", reply_markup=markup)
+
+@instrument("handle_text")
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (update.message.text or "").strip()
     state = context.user_data.get("state", "MAIN")
@@ -444,117 +710,656 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text == "🏗️ Проекты":
         return await show_projects_inline(update, context)
 
-    if state == "MAIN":
-        mapping = {
-            "🧮 Расчёт стоимости": "Введите желаемую площадь и бюджет (пока заглушка).",
-            "🤖 Задать вопрос ИИ": "Напишите вопрос, я постараюсь помочь (пока заглушка).",
-            "👨‍💼 Связаться с менеджером": "Наш менеджер свяжется с вами: +7 (910) 864-07-37",
-        }
-        if text in mapping:
-            return await update.message.reply_text(mapping[text], reply_markup=kb(MAIN_MENU))
-        return await update.message.reply_text("Выберите кнопку ниже 👇", reply_markup=kb(MAIN_MENU))
+    if text == "🧮 Расчёт стоимости":
+        return await show_estimate(update, context)
 
-    return  # остальное — кликами по inline
+    if text == "🤖 Задать вопрос ИИ":
+        return await show_ask(update, context)
 
-async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = query_update.callback_query
-    data = query.data or ""
-    await query.answer()
+    if text == "👨‍💼 Связаться с менеджером":
+        return await show_contact(update, context)
 
-    # Локации
-    if data.startswith("loc:"):
-        loc = data[4:]
-        try:
-            await query.edit_message_text(f"Локация {loc}:")
-        except Exception:
-            try:
-                await query.edit_message_reply_markup(reply_markup=None)
-            except Exception:
-                pass
-        return await send_location_card(query.message.chat, loc, context)
+    if state == "ASK" and text not in MENU_BUTTONS:
+        return await answer_question(update, context, text)
+
+    if state == "LEAD":
+        return await handle_lead_text(update, context, text)
+
+    if state == "CALC" and text not in MENU_BUTTONS:
+        request = parse_request(text) if ESTIMATOR is not None else None
+        if request is None:
+            return await update.message.reply_text(
+                "Напишите бюджет числом — например, «9 млн» или «8 500 000».", reply_markup=MAIN_MENU_KB)
+        return await update.message.reply_text(answer(ESTIMATOR, request), parse_mode="HTML",
+                                               reply_markup=MAIN_MENU_KB)
 
-    if data == "back_to_locs":
+    if state in ("MAIN", "CALC", "ASK"):
+        return await update.message.reply_text("Выберите кнопку ниже 👇", reply_markup=MAIN_MENU_KB)
+
+    return  # остальное — кликами по inline
+
+async def _retitle(query, title: str) -> None:
+    """Классический режим: прежнее сообщение со списком → заголовок без кнопок."""
+    try:
+        await query.edit_message_text(title)
+    except Exception:
         try:
-            await query.edit_message_text("Выберите локацию:")
-            await query.edit_message_reply_markup(reply_markup=make_locations_inline())
+            await query.edit_message_reply_markup(reply_markup=None)
         except Exception:
-            await context.bot.send_message(query.message.chat_id, "Выберите локацию:", reply_markup=make_locations_inline())
+            pass
+
+# Inline-кнопки: тег из callback_data → обработчик (см. callbacks.py)
+CALLBACKS = CallbackRouter()
+CALLBACK_TOTAL = REGISTRY.counter("bot_callbacks_total", "Клики по inline-кнопкам", ("route", "schema"))
+
+@CALLBACKS.route(LOC)
+async def on_location(query_update: Update, context: ContextTypes.DEFAULT_TYPE, key: str):
+    query = query_update.callback_query
+    card = location_card(key)
+    remember_viewed(context, card)
+    if NAV_MODE == "inplace" and card:
+        return await show_card_inplace(query, card, context)
+    name = card.name if card else key
+    # старый список переименовываем, пока уходит новая карточка
+    async with ActionPlan("loc") as plan:
+        await plan.side(_retitle(query, f"Локация {name}:"))
+        return await send_location_card(query.message.chat, key, context)
+
+@CALLBACKS.route(LOCS)
+async def on_locations(query_update: Update, context: ContextTypes.DEFAULT_TYPE, _arg: str):
+    query = query_update.callback_query
+    if NAV_MODE == "inplace" and await show_list_inplace(query, "Выберите локацию:", make_locations_inline(), context):
         context.user_data["state"] = "LOC_LIST"
         return
+    try:  # текст и кнопки одной правкой
+        await query.edit_message_text("Выберите локацию:", reply_markup=make_locations_inline())
+    except Exception:
+        await context.bot.send_message(query.message.chat_id, "Выберите локацию:", reply_markup=make_locations_inline())
+    context.user_data["state"] = "LOC_LIST"
 
-    # Проекты
-    if data.startswith("proj:"):
-        proj = data[5:]
-        try:
-            await query.edit_message_text(f"Проект {proj}:")
-        except Exception:
-            try:
-                await query.edit_message_reply_markup(reply_markup=None)
-            except Exception:
-                pass
-        return await send_project_card(query.message.chat, proj, context)
+@CALLBACKS.route(PROJ)
+async def on_project(query_update: Update, context: ContextTypes.DEFAULT_TYPE, key: str):
+    query = query_update.callback_query
+    card = project_card(key)
+    remember_viewed(context, card)
+    if NAV_MODE == "inplace" and card:
+        return await show_card_inplace(query, card, context)
+    name = card.name if card else key
+    async with ActionPlan("proj") as plan:
+        await plan.side(_retitle(query, f"Проект {name}:"))
+        return await send_project_card(query.message.chat, key, context)
 
-    if data == "back_to_projects":
-        try:
-            await query.edit_message_text("Выберите проект:")
-            await query.edit_message_reply_markup(reply_markup=make_projects_inline())
-        except Exception:
-            await context.bot.send_message(query.message.chat_id, "Выберите проект:", reply_markup=make_projects_inline())
+@CALLBACKS.route(PROJS)
+async def on_projects(query_update: Update, context: ContextTypes.DEFAULT_TYPE, _arg: str):
+    query = query_update.callback_query
+    if NAV_MODE == "inplace" and await show_list_inplace(query, "Выберите проект:", make_projects_inline(), context):
         context.user_data["state"] = "PROJ_LIST"
         return
+    try:
+        await query.edit_message_text("Выберите проект:", reply_markup=make_projects_inline())
+    except Exception:
+        await context.bot.send_message(query.message.chat_id, "Выберите проект:", reply_markup=make_projects_inline())
+    context.user_data["state"] = "PROJ_LIST"
 
-    # В меню
-    if data == "back_to_menu":
-        context.user_data.clear()
-        try:
-            await query.edit_message_reply_markup(reply_markup=None)
-        except Exception:
-            pass
+@CALLBACKS.route(MENU)
+async def on_menu(query_update: Update, context: ContextTypes.DEFAULT_TYPE, _arg: str):
+    query = query_update.callback_query
+    reset_user_data(context)
+    if NAV_MODE == "inplace" and await show_welcome_inplace(query, context):
+        return
+    async with ActionPlan("menu") as plan:
+        await plan.side(query.edit_message_reply_markup(reply_markup=None))
         return await send_welcome_with_photo(query_update, context)
 
+async def on_stale_button(query, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка из чужой версии схемы или удалённого раздела: говорим об этом и даём меню."""
+    logger.info(f"Устаревшая кнопка {query.data!r} в чате {query.message.chat_id if query.message else '?'}")
+    async with ActionPlan("stale") as plan:
+        await plan.side(query.answer("Кнопка устарела — выберите раздел заново 👇"))
+        if query.message:
+            await context.bot.send_message(query.message.chat_id, "Выберите раздел 👇", reply_markup=MAIN_MENU_KB)
+
+@instrument("handle_callback")
+async def handle_callback(query_update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = query_update.callback_query
+    handler, route = CALLBACKS.resolve(query.data or "")
+    if handler is None:
+        CALLBACK_TOTAL.inc("stale", "unknown")
+        return await on_stale_button(query, context)
+    CALLBACK_TOTAL.inc(handler.__name__, route.schema)
+    # ответ на callback невидим в чате и не ограничен лимитером — не ждём его
+    async with ActionPlan(handler.__name__) as plan:
+        await plan.side(query.answer())
+        return await handler(query_update, context, route.arg)
+
+# ========= ЗАЯВКИ =========
+# Номер (кнопкой или текстом) → LEADS.submit и сразу «спасибо»; запись в базу,
+# чат менеджеров и CRM — в фоне (leads.py), ответ пользователю их не ждёт.
+_PHONE_RE = re.compile(r"^\+?[\d\s\-()]{10,20}$")
+
+def parse_phone(text: str):
+    """Номер в виде +7XXXXXXXXXX: «8 (910) …» и «910 …» — российские, как их пишут у нас."""
+    digits = re.sub(r"\D", "", text)
+    if not _PHONE_RE.match(text) or not 10 <= len(digits) <= 15:
+        return None
+    if len(digits) == 11 and digits[0] == "8":
+        digits = "7" + digits[1:]
+    elif len(digits) == 10 and digits[0] == "9":
+        digits = "7" + digits
+    return f"+{digits}"
+
+async def show_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data["state"] = "LEAD"
+    await update.message.reply_text(
+        "Оставьте номер — менеджер перезвонит и ответит на вопросы. "
+        "Или позвоните сами: +7 (910) 864-07-37", reply_markup=CONTACT_KB)
+
+async def submit_lead(update: Update, context: ContextTypes.DEFAULT_TYPE, phone: str, source: str):
+    user = update.effective_user
+    LEADS.submit({
+        "chat_id": update.effective_chat.id, "user_id": user.id if user else None,
+        "name": user.full_name if user else "", "username": user.username if user else None,
+        "phone": phone, "source": source,
+        "location": context.user_data.get("viewed_loc"), "project": context.user_data.get("viewed_proj"),
+    })
+    context.user_data["state"] = "MAIN"
+    await update.message.reply_text("Спасибо! Менеджер свяжется с вами в ближайшее время 🙌",
+                                    reply_markup=MAIN_MENU_KB)
+
+@instrument("handle_contact")
+async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # заявкой считаем только свой номер и только после «Связаться с менеджером»;
+    # пересланная чужая карточка контакта — не заявка
+    if context.user_data.get("state") != "LEAD":
+        return
+    contact, user = update.message.contact, update.effective_user
+    if user is None or contact.user_id != user.id:
+        return await update.message.reply_text(
+            "Нажмите «📱 Отправить номер» — так придёт ваш номер, а не чужой контакт.", reply_markup=CONTACT_KB)
+    phone = parse_phone(contact.phone_number) or contact.phone_number
+    await submit_lead(update, context, phone, "contact")
+
+async def handle_lead_text(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str):
+    if text == "⬅️ В меню":
+        context.user_data["state"] = "MAIN"
+        return await update.message.reply_text("Главное меню 👇", reply_markup=MAIN_MENU_KB)
+    phone = parse_phone(text)
+    if phone is None:
+        return await update.message.reply_text(
+            "Нажмите «📱 Отправить номер» или напишите его — например, +7 910 123-45-67.", reply_markup=CONTACT_KB)
+    await submit_lead(update, context, phone, "text")
+
+def format_lead(lead_id: int, lead: dict) -> str:
+    lines = [f"🔥 <b>Заявка #{lead_id}</b>", f"{html.escape(lead.get('name') or '—')}: {html.escape(lead['phone'])}"]
+    if lead.get("username"):
+        lines.append(f"@{html.escape(lead['username'])}")
+    for label, key in (("Локация", "location"), ("Проект", "project")):
+        if lead.get(key):
+            lines.append(f"{label}: {html.escape(lead[key])}")
+    return "\n".join(lines)
+
+async def lead_to_managers(lead_id: int, lead: dict) -> None:
+    await application.bot.send_message(int(LEADS_CHAT_ID), format_lead(lead_id, lead), parse_mode="HTML")
+
+CRM = CrmWebhook(CRM_WEBHOOK_URL, token=CRM_TOKEN) if CRM_WEBHOOK_URL else None
+LEAD_TARGETS = {}
+if LEADS_CHAT_ID.lstrip("-").isdigit():
+    LEAD_TARGETS["managers"] = lead_to_managers
+if CRM:
+    LEAD_TARGETS["crm"] = CRM
+if not LEAD_TARGETS:
+    logger.warning("Заявки: ни LEADS_CHAT_ID, ни CRM_WEBHOOK_URL — только сохраняем в базу")
+LEADS = LeadQueue(LeadStore(LEADS_DB), LEAD_TARGETS)
+
+async def run_leads() -> None:
+    await _init_done.wait()  # менеджерам пишем через бота — ждём, как рассылки
+    await LEADS.run()
+
+# ========= INLINE-РЕЖИМ =========
+# «@бот шопино» в любом чате → карточки каталога. Callback-кнопки в чужом
+# чате не работают — в карточке только ссылки и переход в бота.
+def share_markup(entry, username):
+    buttons = []
+    if entry.presentation:
+        buttons.append([InlineKeyboardButton("📘 Смотреть презентацию", url=entry.presentation)])
+    if entry.video:
+        buttons.append([InlineKeyboardButton("🎬 Смотреть видео", url=entry.video)])
+    link = deep_link(username, entry)
+    if link:
+        buttons.append([InlineKeyboardButton("🏡 Подробнее в MR.House", url=link)])
+    return InlineKeyboardMarkup(buttons) if buttons else None
+
+def inline_result(entry, username):
+    """Фото по file_id из кэша (без скачивания), иначе по URL, иначе текстом."""
+    result_id = f"{entry.kind}:{entry.slug}"
+    markup = share_markup(entry, username)
+    file_id = MEDIA_CACHE.get(entry.local_path) if entry.local_path else None
+    if file_id:
+        return InlineQueryResultCachedPhoto(result_id, file_id, title=entry.name, caption=entry.caption,
+                                            parse_mode="HTML", reply_markup=markup)
+    if entry.photo_url:
+        thumb = derived_url(entry.local_path) or entry.photo_url
+        return InlineQueryResultPhoto(result_id, entry.photo_url, thumb, title=entry.name,
+                                      caption=entry.caption, parse_mode="HTML", reply_markup=markup)
+    return InlineQueryResultArticle(result_id, entry.name, InputTextMessageContent(entry.caption, parse_mode="HTML"),
+                                    reply_markup=markup)
+
+@instrument("handle_inline")
+async def handle_inline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.inline_query
+    entries, next_offset = SEARCH.page(query.query, query.offset)
+    username = context.bot.username
+    cold = [e.local_path for e in entries if e.local_path and not MEDIA_CACHE.known(e.local_path)]
+    if cold:
+        await asyncio.to_thread(MEDIA_CACHE.prime, cold)
+    await query.answer([inline_result(e, username) for e in entries],
+                       cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+
+# ========= РАССЫЛКИ =========
+async def report_broadcast(run, progress: dict) -> None:
+    """Прогресс — правкой сообщения, которым админ получил «рассылка в очереди»."""
+    notify = run.payload.get("notify")
+    if notify:
+        await application.bot.edit_message_text(describe(progress), chat_id=notify["chat_id"],
+                                                message_id=notify["message_id"])
+
+BROADCASTER = Broadcaster(
+    AUDIENCE,
+    application.bot,
+    media_cache=MEDIA_CACHE,
+    rate=BROADCAST_RATE,
+    concurrency=BROADCAST_CONCURRENCY,
+    on_progress=report_broadcast,
+)
+
+async def run_broadcasts() -> None:
+    """Фоновая задача воркера: рассылки из очереди и брошенные упавшим воркером."""
+    await _init_done.wait()  # PTB поднимет прогрев или первый апдейт (WARMUP=0)
+    await BROADCASTER.watch()
+
+@instrument("cmd_broadcast")
+async def cmd_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # текст (или подпись к фото) после команды, с разметкой админа
+    message = update.effective_message
+    raw = (message.caption_html if message.photo else message.text_html) or ""
+    parts = raw.split(maxsplit=1)
+    text = parts[1] if len(parts) > 1 else ""
+    if not text:
+        await message.reply_text("Текст рассылки — после команды: /broadcast Открыли продажи в …\n"
+                                 "С картинкой — фото с такой подписью.")
+        return
+    status = await message.reply_text("Ставлю рассылку в очередь…")
+    run_id, total = await BROADCASTER.enqueue({
+        "text": text,
+        "photo": message.photo[-1].file_id if message.photo else None,
+        "parse_mode": "HTML",
+        "notify": {"chat_id": status.chat_id, "message_id": status.message_id},
+    })
+    await status.edit_text(f"Рассылка #{run_id} в очереди: {total} получателей.\n"
+                           f"Ход — в этом сообщении, отменить: /broadcast_stop {run_id}")
+
+@instrument("cmd_broadcast_status")
+async def cmd_broadcast_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    audience = await asyncio.to_thread(AUDIENCE.stats)
+    runs = await asyncio.to_thread(AUDIENCE.runs)
+    lines = [f"Аудитория: {audience['active']}, заблокировали бота: {audience['blocked']}"]
+    for run in runs:
+        lines.append(f"#{run['run_id']} {run['status']}: {run['sent']} из {run['total']}, "
+                     f"заблокировали {run['blocked']}, ошибки {run['failed']}")
+    if BROADCASTER.current:
+        lines.append(describe(BROADCASTER.current.progress()))
+    await update.effective_message.reply_text("\n".join(lines))
+
+@instrument("cmd_broadcast_stop")
+async def cmd_broadcast_stop(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not context.args or not context.args[0].isdigit():
+        await update.effective_message.reply_text("Какую? /broadcast_stop <номер>")
+        return
+    run_id = int(context.args[0])
+    cancelled = await asyncio.to_thread(AUDIENCE.cancel, run_id)
+    await update.effective_message.reply_text(
+        f"Рассылка #{run_id} остановлена" if cancelled else f"Рассылка #{run_id} уже завершена или не найдена")
+
 # Регистрация
+ADMIN = filters.User(user_id=ADMIN_IDS)
 application.add_handler(CommandHandler(["start", "star"], cmd_start))
 application.add_handler(CommandHandler("menu", cmd_menu))
 application.add_handler(CommandHandler("ping", cmd_ping))
+application.add_handler(CommandHandler("broadcast", cmd_broadcast, filters=ADMIN))
+application.add_handler(MessageHandler(ADMIN & filters.PHOTO & filters.CaptionRegex(r"^/broadcast(\s|$)"),
+                                       cmd_broadcast))
+application.add_handler(CommandHandler("broadcast_status", cmd_broadcast_status, filters=ADMIN))
+application.add_handler(CommandHandler("broadcast_stop", cmd_broadcast_stop, filters=ADMIN))
 application.add_handler(CallbackQueryHandler(handle_callback))
+application.add_handler(InlineQueryHandler(handle_inline))
+application.add_handler(MessageHandler(filters.CONTACT, handle_contact))
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
 application.add_error_handler(error_handler)
+if STATE:
+    STATE.install(application)
+
+# ========= ПРОГРЕВ ВОРКЕРА =========
+# Всё, за что раньше платил первый пользователь после старта/форка, делаем
+# сразу в lifespan: сеть и диск параллельно, потом предзаливка фото.
+# /ready отвечает 200 только после прогрева; / — просто «процесс жив».
+WARMUP_STATE = {"ready": False, "steps": {}, "problems": [], "uploaded": 0,
+                "warmup_s": None, "first_reply_s": None}
+
+async def _step(name: str, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        WARMUP_STATE["steps"][name] = round(1000 * (time.perf_counter() - started), 1)
+
+async def _warm_telegram() -> None:
+    """getMe через общий HTTPX-клиент: заодно открывает соединение с Bot API."""
+    delay = 1.0
+    while True:
+        try:
+            await ensure_initialized()
+            return
+        except Exception as e:
+            logger.warning(f"Прогрев: Telegram недоступен ({e}), повтор через {delay:.0f}с")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+def verify_assets():
+    """Фото и PDF из каталога, которых нет в static/ (карточка уйдёт без них)."""
+    problems = []
+    for entry in (*CATALOG.locations.values(), *CATALOG.projects.values()):
+        if not entry.local_path:
+            problems.append(f"{entry.label}: нет фото")
+        pdf = _local_path(entry.presentation)
+        if pdf and not os.path.isfile(pdf):
+            problems.append(f"{entry.label}: нет презентации")
+    if not os.path.isfile(WELCOME_PATH):
+        problems.append(f"нет баннера {WELCOME_PATH}")
+    for problem in problems:
+        logger.warning(f"Прогрев: {problem}")
+    return problems
+
+async def preupload_media() -> int:
+    """Заливаем в служебный чат фото без file_id — первый показ карточки уже по file_id."""
+    todo = [p for p in catalog_photos() if MEDIA_CACHE.get(p) is None and os.path.isfile(p)]
+    slots = asyncio.Semaphore(WARMUP_UPLOADS)
+
+    async def upload(path) -> bool:
+        async def send(photo):
+            return await application.bot.send_photo(
+                MEDIA_WARMUP_CHAT_ID, photo, disable_notification=True,
+                rate_limit_args={"priority": "bulk"},  # живые пользователи — вперёд
+            )
+        async with slots:
+            msg = await deliver_photo(send, path, None, path)
+            if hasattr(msg, "message_id"):
+                try:
+                    await msg.delete()
+                except Exception:
+                    pass
+            return bool(msg)
 
-# ========= FLASK (экспортируем 'web_app') =========
-web_app = Flask(__name__)
+    results = await asyncio.gather(*(upload(p) for p in todo), return_exceptions=True)
+    return sum(r is True for r in results)
 
-@web_app.get("/")
-def index():
-    return jsonify({"ok": True, "service": "MR.House bot"})
+def warm_images() -> int:
+    """Хэши фото (ключи file_id и копий) и облегчённые копии — всё в потоке прогрева."""
+    photos = catalog_photos()
+    MEDIA_CACHE.prime(photos)
+    return IMAGES.warm(photos)
 
-@web_app.get("/set_webhook")
-def set_webhook_route():
+async def warm_up() -> None:
+    started = time.perf_counter()
+    tasks = [
+        _step("assets", asyncio.to_thread(verify_assets)),
+        _step("images", asyncio.to_thread(warm_images)),
+        _step("knowledge", asyncio.to_thread(refresh_knowledge)),
+    ]
+    if WARMUP:
+        tasks.append(_step("telegram", _warm_telegram()))
+    problems, *_ = await asyncio.gather(*tasks)
+    WARMUP_STATE["problems"] = problems
+    WARMUP_STATE["warmup_s"] = round(time.perf_counter() - started, 3)
+    WARMUP_STATE["ready"] = True
+    logger.info(f"🔥 Воркер прогрет за {WARMUP_STATE['warmup_s']}с "
+                f"(от старта {time.time() - BOOT_TS:.2f}с): {WARMUP_STATE['steps']}")
+    # предзаливка упирается в лимиты Telegram (в группе 20/мин) — готовность её не ждёт
+    if WARMUP and MEDIA_WARMUP_CHAT_ID:
+        WARMUP_STATE["uploaded"] = await _step("uploads", preupload_media())
+        logger.info(f"Прогрев: залито {WARMUP_STATE['uploaded']} фото в служебный чат")
+
+# ========= ASGI (экспортируем 'web_app') =========
+# Один event loop на процесс: и веб-сервер, и PTB-Application.
+# Запуск: gunicorn bot:web_app (worker_class берётся из gunicorn.conf.py)
+# или python bot.py (uvicorn).
+SET_WEBHOOK_ON_STARTUP = False
+
+TRACER = Tracer(
+    slow_ms=TRACE_SLOW_MS,
+    sample=TRACE_SAMPLE,
+    exporter=OtlpExporter(OTLP_ENDPOINT) if OTLP_ENDPOINT else None,
+    export_sample=OTLP_SAMPLE,
+)
+
+async def _process(item) -> None:
+    trace, queued, update = item
+    queued.close()
+    tokens = activate(trace)
+    try:
+        with span("dispatch"):
+            await application.process_update(update)
+    finally:
+        deactivate(tokens)
+        TRACER.finish(trace)
+    if WARMUP_STATE["first_reply_s"] is None:
+        WARMUP_STATE["first_reply_s"] = round(time.time() - BOOT_TS, 3)
+        logger.info(f"⏱ Холодный старт → первый ответ: {WARMUP_STATE['first_reply_s']}с")
+
+# Апдейты одного чата — по очереди, разных чатов — параллельно
+SCHEDULER = ChatScheduler(_process, workers=UPDATE_WORKERS, max_pending=UPDATE_QUEUE_MAX)
+
+# Повторно доставленные апдейты отсекаем до разбора
+DEDUP = make_dedup(DEDUP_BACKEND, path=DEDUP_DB, ttl=DEDUP_TTL, max_size=DEDUP_MAX)
+RECORDER = UpdateRecorder(RECORD_UPDATES, salt=RECORD_SALT) if RECORD_UPDATES else None
+
+def _chat_key(update: Update):
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return f"user:{update.effective_user.id}"
+    return f"update:{update.update_id}"
+
+@asynccontextmanager
+async def lifespan(app):
+    global _init_done
+    # Event привязывается к циклу событий — на каждый запуск свой
+    _init_done = asyncio.Event()
+    if _initialized:
+        _init_done.set()
+    if SET_WEBHOOK_ON_STARTUP and BASE_URL:
+        await ensure_initialized()
+        await application.bot.set_webhook(f"{BASE_URL}/webhook")
+    SCHEDULER.start()
+    watcher = asyncio.create_task(watch_catalog()) if CATALOG_POLL > 0 else None
+    # прогрев в фоне: / отвечает сразу, /ready — когда воркер готов
+    warming = asyncio.create_task(warm_up())
+    # пакетная запись user_data и выгрузка неактивных из памяти
+    keeper = asyncio.create_task(STATE.run(application)) if STATE else None
+    exporter = asyncio.create_task(TRACER.exporter.run()) if TRACER.exporter else None
+    broadcasts = asyncio.create_task(run_broadcasts())
+    leads = asyncio.create_task(run_leads())
+    yield
+    # рассылка записывает курсор и уходит в очередь — её продолжит другой воркер
+    broadcasts.cancel()
+    await asyncio.gather(broadcasts, return_exceptions=True)
+    # недоставленные заявки остаются в базе — их дошлёт следующий запуск
+    leads.cancel()
+    await asyncio.gather(leads, return_exceptions=True)
+    if CRM:
+        await CRM.close()
+    if keeper:
+        keeper.cancel()
+    if exporter:
+        exporter.cancel()
+    if watcher:
+        watcher.cancel()
+    warming.cancel()
+    # Дорабатываем то, что уже приняли, и закрываем HTTP-клиент PTB
+    await SCHEDULER.stop(timeout=25)
+    if _initialized:
+        await application.shutdown()  # заодно дописывает user_data в хранилище
+    elif STATE:
+        await STATE.flush()
+    if TRACER.exporter:
+        await TRACER.exporter.close()
+
+async def index(request: Request):
+    return JSONResponse({"ok": True, "service": "MR.House bot"})
+
+async def ready(request: Request):
+    return JSONResponse(WARMUP_STATE, status_code=200 if WARMUP_STATE["ready"] else 503)
+
+async def set_webhook_route(request: Request):
     if not BASE_URL:
-        return "BASE_URL не задан", 400
-    ensure_initialized()
+        return PlainTextResponse("BASE_URL не задан", status_code=400)
     url = f"{BASE_URL}/webhook"
     try:
-        LOOP.run_until_complete(application.bot.set_webhook(url))
-        return f"Webhook установлен на {url}"
+        await ensure_initialized()
+        await application.bot.set_webhook(url)
+        return PlainTextResponse(f"Webhook установлен на {url}")
     except Exception as e:
         logger.exception("Ошибка при установке вебхука")
-        return f"Ошибка при установке вебхука: {e}", 500
+        return PlainTextResponse(f"Ошибка при установке вебхука: {e}", status_code=500)
+
+async def webhook(request: Request):
+    started = time.perf_counter()
+    trace = TRACER.start("update")
+    tokens = activate(trace)
+    try:
+        response, outcome = await _accept_update(request, trace)
+    finally:
+        deactivate(tokens)
+    WEBHOOK_SECONDS.observe(time.perf_counter() - started)
+    WEBHOOK_TOTAL.inc(outcome)
+    if outcome != "accepted":
+        trace.root.attrs["outcome"] = outcome
+        TRACER.finish(trace)
+    return response
+
+def _describe(update: Update) -> dict:
+    """Кто и что прислал — чтобы по медленному трейсу найти чат и действие."""
+    attrs = {"update_id": update.update_id}
+    if update.effective_chat:
+        attrs["chat_id"] = update.effective_chat.id
+    if update.callback_query:
+        attrs["callback"] = update.callback_query.data or ""
+    elif update.message:
+        # в логи и OTLP — только кнопки и команды; свободный текст (телефоны,
+        # вопросы) не пишем, только его длину
+        text = update.message.text or ""
+        if text in MENU_BUTTONS or text == "⬅️ В меню":
+            attrs["text"] = text
+        elif text.startswith("/"):
+            attrs["text"] = text.split()[0][:32]
+        elif update.message.contact:
+            attrs["text"] = "<contact>"
+        else:
+            attrs["text_len"] = len(text)
+    return attrs
 
-@web_app.post("/webhook")
-def webhook():
-    ensure_initialized()
-    data = flask_request.get_json(force=True, silent=False)
-    update = Update.de_json(data, application.bot)
+async def _accept_update(request: Request, trace):
+    await ensure_initialized()
     try:
-        LOOP.run_until_complete(application.process_update(update))
-        return jsonify({"ok": True})
+        with span("parse_json"):
+            data = await request.json()
     except Exception as e:
-        logger.exception("Ошибка обработки апдейта")
-        return jsonify({"ok": False, "error": str(e)}), 500
+        logger.warning(f"Битый апдейт: {e}")
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=400), "bad"
+    update_id = data.get("update_id") if isinstance(data, dict) else None
+    with span("dedup"):
+        duplicate = isinstance(update_id, int) and await DEDUP.seen(update_id)
+    if duplicate:
+        return JSONResponse({"ok": True, "duplicate": True}), "duplicate"
+    if RECORDER is not None and isinstance(data, dict):
+        RECORDER.record(data)  # повторы Telegram не пишем — прогон сам перенумерует update_id
+    try:
+        with span("de_json"):
+            update = Update.de_json(data, application.bot)
+    except Exception as e:
+        logger.warning(f"Битый апдейт: {e}")
+        return JSONResponse({"ok": False, "error": str(e)}, status_code=400), "bad"
+    trace.root.attrs.update(_describe(update))
+    # Отвечаем Telegram сразу, апдейт обрабатываем в фоне
+    if not SCHEDULER.submit(_chat_key(update), (trace, trace.begin("queue"), update)):
+        # очередь переполнена — Telegram повторит доставку позже, и повтор не должен считаться дублем
+        await DEDUP.forget(update.update_id)
+        return JSONResponse({"ok": False, "error": "busy"}, status_code=503), "busy"
+    return JSONResponse({"ok": True}), "accepted"
+
+def _authorized(request: Request) -> bool:
+    given = request.headers.get("authorization", "")
+    return bool(STATS_TOKEN) and hmac.compare_digest(given.encode(), f"Bearer {STATS_TOKEN}".encode())
+
+def _unauthorized() -> Response:
+    return PlainTextResponse("unauthorized", status_code=401, headers={"WWW-Authenticate": "Bearer"})
+
+async def stats_route(request: Request):
+    if not _authorized(request):
+        return _unauthorized()
+    return JSONResponse({
+        "scheduler": SCHEDULER.stats(),
+        "dedup": DEDUP.stats(),
+        "outbound": LIMITER.stats(),
+        "http": tg_request.stats(),
+        "trace": TRACER.stats(),
+        "state": STATE.stats() if STATE else {"backend": "memory"},
+        "broadcast": BROADCASTER.stats(),
+        "knowledge": KNOWLEDGE.stats(),
+        "inline": SEARCH.stats(),
+        "leads": LEADS.stats(),
+    })
+
+# ========= МЕТРИКИ =========
+WEBHOOK_SECONDS = REGISTRY.histogram("bot_webhook_seconds", "Ответ на POST /webhook (до постановки в очередь)")
+WEBHOOK_TOTAL = REGISTRY.counter("bot_webhook_total", "Апдейты на вебхуке по исходу", ("outcome",))
+# Текущие значения читаем из stats() компонентов в момент сбора — на горячем пути ничего не стоит
+REGISTRY.gauge("bot_updates_pending", "Апдейты в очереди и в работе",
+               fn=lambda: [((), SCHEDULER.pending)])
+REGISTRY.gauge("bot_updates_busy", "Воркеры, занятые апдейтом",
+               fn=lambda: [((), SCHEDULER.busy)])
+REGISTRY.gauge("bot_outbound_waiting", "Запросы, ждущие лимитера исходящих", ("priority",),
+               fn=lambda: [(("interactive",), LIMITER.waiting[0]), (("bulk",), LIMITER.waiting[1])])
+REGISTRY.gauge("bot_http_pool_in_use", "Занятые соединения с Bot API", ("pool",),
+               fn=lambda: [(("json",), tg_request.json.in_use), (("media",), tg_request.media.in_use)])
+REGISTRY.gauge("bot_http_pool_waiting", "Запросы, ждущие свободного соединения", ("pool",),
+               fn=lambda: [(("json",), tg_request.json.waiting), (("media",), tg_request.media.waiting)])
+REGISTRY.gauge("bot_users_in_memory", "Пользователи с user_data в памяти процесса",
+               fn=lambda: [((), len(application.user_data))])
+REGISTRY.gauge("bot_ready", "Воркер прогрет (1) или ещё нет (0)",
+               fn=lambda: [((), int(WARMUP_STATE["ready"]))])
+
+async def metrics_route(request: Request):
+    if not _authorized(request):
+        return _unauthorized()
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+web_app = Starlette(
+    routes=[
+        Route("/", index, methods=["GET"]),
+        Route("/ready", ready, methods=["GET"]),
+        Route("/set_webhook", set_webhook_route, methods=["GET"]),
+        Route("/webhook", webhook, methods=["POST"]),
+        Route("/stats", stats_route, methods=["GET"]),
+        Route("/metrics", metrics_route, methods=["GET"]),
+        # сильный ETag по содержимому, Range для видео, .gz-копии (см. static_server.py)
+        Mount("/static", app=StaticApp(StaticResolver(STATIC_DIR, ASSETS)), name="static"),
+        Mount("/derived", app=ImmutableStaticFiles(directory=DERIVED_DIR, check_dir=False), name="derived"),
+    ],
+    lifespan=lifespan,
+)
 
 if __name__ == "__main__":
-    if BASE_URL:
-        ensure_initialized()
-        LOOP.run_until_complete(application.bot.set_webhook(f"{BASE_URL}/webhook"))
+    import uvicorn
+    SET_WEBHOOK_ON_STARTUP = True
     port = int(os.environ.get("PORT", 10000))
-    web_app.run(host="0.0.0.0", port=port)
\ No newline at end of file
+    uvicorn.run(web_app, host="0.0.0.0", port=port)
@@ -0,0 +1,487 @@
+# broadcast.py
+# ------------------------------------------------------------------------------
+# Рассылка всем, кто нажимал /start: открыли новый посёлок, вышел проект.
+#
+#   • аудитория — таблица SQLite: /start добавляет чат, «бот заблокирован» /
+#     «аккаунт удалён» помечают его, и следующие рассылки его пропускают
+#     (вернулся и снова нажал /start — пометка снимается);
+#   • получатели читаются пачками по возрастанию chat_id (keyset, без OFFSET):
+#     память не растёт вместе с аудиторией;
+#   • отправка — ограниченное число параллельных запросов и свой темп
+#     (BROADCAST_RATE, чуть ниже 30/с у Telegram), запросы идут в
+#     OutboundLimiter с приоритетом bulk — живые ответы пользователям
+#     обгоняют рассылку;
+#   • прогресс (курсор chat_id + счётчики) пишется в базу раз в пару секунд.
+#     Рассылку ведёт один воркер по аренде; упал — после истечения аренды её
+#     подхватит другой и продолжит с курсора. Курсор — «все до него отправлены»,
+#     поэтому повторно могут уйти только сообщения, бывшие в полёте
+#     (не больше concurrency);
+#   • фото уходит по file_id: локальный файл заливается один раз, file_id
+#     кладётся в MediaCache, остальным — уже он.
+#
+# Запуск: /broadcast у админа (см. bot.py) или из консоли —
+#   python broadcast.py send --text "..." [--photo static/...]   # в очередь
+#   python broadcast.py status | stop <id> | backfill --state-db .state.sqlite3
+# ------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+
+from telegram import InputFile
+from telegram.error import BadRequest, Forbidden
+
+from metrics import REGISTRY
+from ratelimit import TokenBucket
+
+logger = logging.getLogger("bot.broadcast")
+
+SENT, BLOCKED, FAILED = "sent", "blocked", "failed"
+BULK = {"priority": "bulk"}
+_START = -(1 << 63)  # курсор до первого chat_id
+
+DELIVERED_TOTAL = REGISTRY.counter("bot_broadcast_messages_total", "Сообщения рассылок по исходу", ("outcome",))
+
+# BadRequest, после которого писать в чат бессмысленно — как блокировка
+_GONE_MARKERS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+
+class Run:
+    """Рассылка, которую ведёт этот процесс."""
+    __slots__ = ("run_id", "payload", "cursor", "total", "sent", "blocked", "failed",
+                 "started", "base")
+
+    def __init__(self, run_id: int, payload: dict, cursor: int, total: int,
+                 sent: int = 0, blocked: int = 0, failed: int = 0):
+        self.run_id = run_id
+        self.payload = payload
+        self.cursor = cursor
+        self.total = total
+        self.sent = sent
+        self.blocked = blocked
+        self.failed = failed
+        self.started = time.monotonic()
+        self.base = self.done  # сколько было сделано до этого запуска (для темпа)
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.blocked + self.failed
+
+    def progress(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        rate = (self.done - self.base) / elapsed if elapsed > 0 else 0.0
+        left = max(0, self.total - self.done)
+        return {
+            "run_id": self.run_id,
+            "total": self.total,
+            "done": self.done,
+            "sent": self.sent,
+            "blocked": self.blocked,
+            "failed": self.failed,
+            "rate": round(rate, 1),
+            "eta_s": round(left / rate) if rate > 0 else None,
+        }
+
+
+def describe(progress: dict) -> str:
+    """Строка для лога и для админа в чате."""
+    total = progress["total"] or 1
+    text = (f"Рассылка #{progress['run_id']}: {progress['done']}/{progress['total']} "
+            f"({100 * progress['done'] // total}%), {progress['rate']:g} сообщ/с")
+    if progress.get("eta_s") is not None and progress["done"] < progress["total"]:
+        text += f", осталось ~{max(1, round(progress['eta_s'] / 60))} мин"
+    return (f"{text}\nдоставлено {progress['sent']}, заблокировали {progress['blocked']}, "
+            f"ошибки {progress['failed']}")
+
+
+# ========= ХРАНИЛИЩЕ =========
+class AudienceStore:
+    """Аудитория и рассылки в одном файле SQLite (WAL — общий для воркеров)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS audience ("
+                           "chat_id INTEGER PRIMARY KEY, joined REAL NOT NULL, seen REAL NOT NULL, "
+                           "blocked REAL, reason TEXT)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS broadcasts ("
+                           "run_id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, "
+                           "status TEXT NOT NULL, cursor INTEGER NOT NULL, total INTEGER NOT NULL, "
+                           "sent INTEGER NOT NULL DEFAULT 0, blocked INTEGER NOT NULL DEFAULT 0, "
+                           "failed INTEGER NOT NULL DEFAULT 0, owner TEXT, heartbeat REAL, "
+                           "created REAL NOT NULL, finished REAL)")
+
+    # --- аудитория ---
+    def add(self, chat_id: int) -> None:
+        """Нажал /start: новый получатель или вернувшийся (снимаем блокировку)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO audience(chat_id, joined, seen) VALUES (?, ?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET seen = excluded.seen, blocked = NULL, reason = NULL",
+                (chat_id, now, now),
+            )
+
+    def add_many(self, chat_ids: Iterable[int]) -> int:
+        """Импорт уже известных пользователей; существующих не трогаем."""
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany("INSERT OR IGNORE INTO audience(chat_id, joined, seen) VALUES (?, ?, ?)",
+                                   [(cid, now, now) for cid in chat_ids])
+            self._conn.execute("COMMIT")
+            return self._conn.total_changes - before
+
+    def recipients(self, after: int, limit: int) -> List[int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chat_id FROM audience WHERE chat_id > ? AND blocked IS NULL "
+                "ORDER BY chat_id LIMIT ?", (after, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self) -> dict:
+        with self._lock:
+            active, blocked = self._conn.execute(
+                "SELECT COUNT(*) - COUNT(blocked), COUNT(blocked) FROM audience").fetchone()
+        return {"active": active, "blocked": blocked}
+
+    # --- рассылки ---
+    def create(self, payload: dict) -> Tuple[int, int]:
+        """Поставить рассылку в очередь → (run_id, получателей сейчас)."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                total = self._conn.execute("SELECT COUNT(*) FROM audience WHERE blocked IS NULL").fetchone()[0]
+                cur = self._conn.execute(
+                    "INSERT INTO broadcasts(payload, status, cursor, total, created) VALUES (?, 'queued', ?, ?, ?)",
+                    (json.dumps(payload, ensure_ascii=False), _START, total, time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cur.lastrowid, total
+
+    def claim(self, owner: str, lease: float) -> Optional[Run]:
+        """Взять рассылку из очереди или брошенную (аренда истекла)."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT run_id, payload, cursor, total, sent, blocked, failed FROM broadcasts "
+                    "WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?) "
+                    "ORDER BY run_id LIMIT 1", (now - lease,),
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE broadcasts SET status = 'running', owner = ?, heartbeat = ? WHERE run_id = ?",
+                        (owner, now, row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        return Run(row[0], json.loads(row[1]), row[2], row[3], row[4], row[5], row[6])
+
+    def checkpoint(self, run_id: int, owner: str, cursor: int, counts: Tuple[int, int, int],
+                   gone: List[Tuple[int, str]], status: str = "running") -> bool:
+        """
+        Записать прогресс и заблокировавших одной транзакцией. False — рассылку
+        отменили или её перехватил другой воркер: продолжать нельзя.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cur = self._conn.execute(
+                    "UPDATE broadcasts SET cursor = ?, sent = ?, blocked = ?, failed = ?, status = ?, "
+                    "heartbeat = ?, owner = CASE WHEN ? = 'queued' THEN NULL ELSE owner END, "
+                    "finished = CASE WHEN ? = 'done' THEN ? ELSE finished END "
+                    "WHERE run_id = ? AND owner = ? AND status = 'running'",
+                    (cursor, *counts, status, now, status, status, now, run_id, owner),
+                )
+                if gone:
+                    self._conn.executemany("UPDATE audience SET blocked = ?, reason = ? WHERE chat_id = ?",
+                                           [(now, reason[:200], cid) for cid, reason in gone])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return cur.rowcount == 1
+
+    def cancel(self, run_id: int) -> bool:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE broadcasts SET status = 'cancelled', finished = ? "
+                "WHERE run_id = ? AND status IN ('queued', 'running')", (time.time(), run_id))
+        return cur.rowcount == 1
+
+    def runs(self, limit: int = 5) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT run_id, status, total, sent, blocked, failed, created, finished "
+                "FROM broadcasts ORDER BY run_id DESC LIMIT ?", (limit,),
+            ).fetchall()
+        keys = ("run_id", "status", "total", "sent", "blocked", "failed", "created", "finished")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# ========= ОТПРАВКА =========
+class Broadcaster:
+    def __init__(self, store: AudienceStore, bot, *, media_cache=None, rate: float = 28.0,
+                 concurrency: int = 16, chunk: int = 500, lease: float = 60.0,
+                 checkpoint_every: float = 2.0, report_every: float = 10.0,
+                 on_progress: Optional[Callable[[Run, dict], Awaitable]] = None):
+        self.store = store
+        self.bot = bot
+        self.media_cache = media_cache
+        self.rate = rate
+        self.concurrency = concurrency
+        self.chunk = chunk
+        self.lease = lease
+        self.checkpoint_every = checkpoint_every
+        self.report_every = report_every
+        self.on_progress = on_progress
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.current: Optional[Run] = None
+        self._file_ids: dict = {}
+        self._upload_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+
+    # --- очередь ---
+    async def enqueue(self, payload: dict) -> Tuple[int, int]:
+        run_id, total = await asyncio.to_thread(self.store.create, payload)
+        logger.info(f"Рассылка #{run_id} в очереди: {total} получателей")
+        self._wake.set()
+        return run_id, total
+
+    async def watch(self, interval: Optional[float] = None) -> None:
+        """Фоновый цикл воркера: берёт рассылки из очереди и брошенные после падения."""
+        interval = interval or self.lease / 2
+        while True:
+            self._wake.clear()
+            try:
+                run = await asyncio.to_thread(self.store.claim, self.owner, self.lease)
+                if run is not None:
+                    await self.execute(run)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка цикла рассылок")
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- ход рассылки ---
+    async def execute(self, run: Run) -> str:
+        """Довести рассылку до конца → итоговый статус (done / stopped / queued / failed)."""
+        self.current = run
+        window: deque = deque()             # (chat_id, task) по возрастанию chat_id
+        gone: List[Tuple[int, str]] = []
+        resumed = " (продолжение)" if run.cursor != _START else ""
+        logger.info(f"Рассылка #{run.run_id}: старт{resumed}, {run.total} получателей")
+        dispatch = asyncio.create_task(self._dispatch(run, window, gone))
+        last_report = time.monotonic()
+        try:
+            while True:
+                await asyncio.wait({dispatch}, timeout=self.checkpoint_every)
+                if dispatch.done():
+                    break
+                if not await self._save(run, window, gone):
+                    dispatch.cancel()
+                    await asyncio.gather(dispatch, return_exceptions=True)
+                    logger.info(f"Рассылка #{run.run_id} остановлена: отменена или перехвачена")
+                    return "stopped"
+                if time.monotonic() - last_report >= self.report_every:
+                    last_report = time.monotonic()
+                    await self._report(run)
+            error = dispatch.exception()
+            status = "done" if error is None else "failed"
+            if error is not None:
+                logger.error(f"Рассылка #{run.run_id} прервана ошибкой: {error!r}")
+            await self._save(run, window, gone, status)
+            await self._report(run)
+            return status
+        except asyncio.CancelledError:
+            # воркер останавливается: отдаём рассылку другому сразу, не дожидаясь аренды
+            dispatch.cancel()
+            await asyncio.gather(dispatch, return_exceptions=True)
+            await self._save(run, window, gone, "queued")
+            logger.info(f"Рассылка #{run.run_id} возвращена в очередь на {run.done}/{run.total}")
+            raise
+        finally:
+            self.current = None
+            self._file_ids.clear()
+
+    async def _dispatch(self, run: Run, window: deque, gone: list) -> None:
+        slots = asyncio.Semaphore(self.concurrency)
+        pace = TokenBucket(self.rate, max(1.0, self.rate))
+        after = run.cursor
+        try:
+            while True:
+                chunk = await asyncio.to_thread(self.store.recipients, after, self.chunk)
+                if not chunk:
+                    break
+                for chat_id in chunk:
+                    await slots.acquire()
+                    while (delay := pace.delay(time.monotonic())) > 0:
+                        await asyncio.sleep(delay)
+                    pace.take()
+                    task = asyncio.create_task(self._deliver(run, chat_id, gone))
+                    task.add_done_callback(lambda _t: slots.release())
+                    window.append((chat_id, task))
+                after = chunk[-1]
+            await asyncio.gather(*(task for _, task in window))
+        except BaseException:
+            for _, task in window:
+                task.cancel()
+            await asyncio.gather(*(task for _, task in window), return_exceptions=True)
+            raise
+
+    async def _deliver(self, run: Run, chat_id: int, gone: list) -> None:
+        outcome = await self._send(run.payload, chat_id, gone)
+        if outcome == SENT:
+            run.sent += 1
+        elif outcome == BLOCKED:
+            run.blocked += 1
+        else:
+            run.failed += 1
+        DELIVERED_TOTAL.inc(outcome)
+
+    async def _save(self, run: Run, window: deque, gone: list, status: str = "running") -> bool:
+        while window and window[0][1].done():
+            run.cursor = window.popleft()[0]
+        batch, gone[:] = list(gone), []
+        try:
+            return await asyncio.to_thread(self.store.checkpoint, run.run_id, self.owner, run.cursor,
+                                           (run.sent, run.blocked, run.failed), batch, status)
+        except Exception as e:
+            gone.extend(batch)
+            logger.warning(f"Рассылка #{run.run_id}: не смог записать прогресс: {e}")
+            return True  # база мигнула — шлём дальше, запишем в следующий раз
+
+    async def _report(self, run: Run) -> None:
+        progress = run.progress()
+        logger.info(describe(progress).replace("\n", "; "))
+        if self.on_progress is not None:
+            try:
+                await self.on_progress(run, progress)
+            except Exception as e:
+                logger.debug(f"Рассылка #{run.run_id}: отчёт не ушёл: {e}")
+
+    # --- одно сообщение ---
+    async def _send(self, payload: dict, chat_id: int, gone: list) -> str:
+        try:
+            await self._post(payload, chat_id)
+            return SENT
+        except Forbidden as e:            # заблокировал бота, удалил аккаунт
+            gone.append((chat_id, str(e)))
+            return BLOCKED
+        except BadRequest as e:
+            if any(marker in str(e).lower() for marker in _GONE_MARKERS):
+                gone.append((chat_id, str(e)))
+                return BLOCKED
+            logger.warning(f"Рассылка → {chat_id}: {e}")
+            return FAILED
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:            # в т.ч. RetryAfter, если лимитер исчерпал повторы
+            logger.warning(f"Рассылка → {chat_id}: {e!r}")
+            return FAILED
+
+    def _cached_photo(self, photo: str) -> Optional[str]:
+        if not os.path.isfile(photo):
+            return photo  # уже file_id
+        file_id = self._file_ids.get(photo)
+        if file_id is None and self.media_cache is not None:
+            file_id = self.media_cache.get(photo)
+        return file_id
+
+    async def _post(self, payload: dict, chat_id: int):
+        kwargs = {"chat_id": chat_id, "parse_mode": payload.get("parse_mode"),
+                  "disable_notification": payload.get("silent", False), "rate_limit_args": BULK}
+        photo = payload.get("photo")
+        if not photo:
+            return await self.bot.send_message(text=payload["text"], **kwargs)
+        file_id = self._cached_photo(photo)
+        if file_id is None:
+            async with self._upload_lock:  # заливает один, остальные ждут его file_id
+                file_id = self._cached_photo(photo)
+                if file_id is None:
+                    with open(photo, "rb") as f:
+                        upload = InputFile(f, filename=os.path.basename(photo))
+                    msg = await self.bot.send_photo(photo=upload, caption=payload.get("text"), **kwargs)
+                    self._file_ids[photo] = msg.photo[-1].file_id
+                    if self.media_cache is not None:
+                        self.media_cache.put(photo, msg.photo[-1].file_id)
+                    return msg
+        return await self.bot.send_photo(photo=file_id, caption=payload.get("text"), **kwargs)
+
+    def stats(self) -> dict:
+        if self.current is None:
+            return {"running": False}
+        return {"running": True, **self.current.progress()}
+
+
+# ========= КОНСОЛЬ =========
+def _backfill(store: AudienceStore, state_db: str) -> int:
+    """Пользователи из user_state (state_store.py) — те, кто писал боту до появления аудитории."""
+    conn = sqlite3.connect(state_db)
+    try:
+        ids = [row[0] for row in conn.execute("SELECT user_id FROM user_state WHERE user_id > 0")]
+    finally:
+        conn.close()
+    return store.add_many(ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Рассылки по аудитории бота")
+    parser.add_argument("--db", default=os.environ.get("BROADCAST_DB", ".broadcast.sqlite3"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    send = commands.add_parser("send", help="поставить рассылку в очередь (отправит бот)")
+    send.add_argument("--text", required=True)
+    send.add_argument("--photo", default=None, help="локальный файл (static/...) или file_id")
+    send.add_argument("--html", action="store_true", help="parse_mode=HTML")
+    send.add_argument("--silent", action="store_true", help="без звука")
+    commands.add_parser("status", help="последние рассылки и аудитория")
+    stop = commands.add_parser("stop", help="отменить рассылку")
+    stop.add_argument("run_id", type=int)
+    backfill = commands.add_parser("backfill", help="добавить в аудиторию пользователей из STATE_DB")
+    backfill.add_argument("--state-db", default=os.environ.get("STATE_DB", ".state.sqlite3"))
+    opts = parser.parse_args(sys.argv[1:])
+
+    audience = AudienceStore(opts.db)
+    if opts.command == "send":
+        payload = {"text": opts.text, "photo": opts.photo, "parse_mode": "HTML" if opts.html else None,
+                   "silent": opts.silent}
+        run_id, total = audience.create(payload)
+        print(f"Рассылка #{run_id} в очереди: {total} получателей")
+    elif opts.command == "status":
+        print(json.dumps({"audience": audience.stats(), "runs": audience.runs()}, ensure_ascii=False, indent=1))
+    elif opts.command == "stop":
+        print("отменена" if audience.cancel(opts.run_id) else "уже завершена или не найдена")
+    else:
+        print(f"добавлено {_backfill(audience, opts.state_db)}")
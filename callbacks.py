@@ -0,0 +1,84 @@
+# callbacks.py
+# ------------------------------------------------------------------------------
+# Компактный callback_data с версией схемы и таблица маршрутов.
+#
+# Формат: "<версия><тег>[:<аргумент>]" — "1l:shopino" (локация), "1L" (к списку
+# локаций). Тег — один символ, аргумент — slug из каталога, так что кнопка
+# занимает десяток байт из 64 допустимых, сколько бы ни росли названия.
+#
+# Разбор — срез строки и поиск в dict, без цепочки startswith: стоимость не
+# зависит от числа маршрутов. Кнопки старого формата ("loc:Шопино",
+# "back_to_locs"), оставшиеся в чатах, продолжают работать; всё прочее
+# (чужая версия, неизвестный тег) — «устаревшая кнопка», а не тихий провал.
+# ------------------------------------------------------------------------------
+
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional
+
+VERSION = "1"
+_SCHEMA = "v" + VERSION
+LIMIT = 64  # байт callback_data у Telegram
+
+# Теги маршрутов
+LOC = "l"          # карточка локации, аргумент — slug
+PROJ = "p"         # карточка проекта, аргумент — slug
+LOCS = "L"         # к списку локаций
+PROJS = "P"        # к списку проектов
+MENU = "m"         # в главное меню
+
+# Кнопки до введения схемы: точные значения и префиксы с названием вместо slug
+LEGACY_EXACT = {"back_to_locs": LOCS, "back_to_projects": PROJS, "back_to_menu": MENU}
+LEGACY_PREFIX = {"loc": LOC, "proj": PROJ}
+
+
+def encode(tag: str, arg: str = "") -> str:
+    data = f"{VERSION}{tag}:{arg}" if arg else f"{VERSION}{tag}"
+    if len(data.encode()) > LIMIT:
+        raise ValueError(f"callback_data {data!r} длиннее {LIMIT} байт")
+    return data
+
+
+class Route(NamedTuple):
+    tag: str
+    arg: str
+    schema: str        # "v1" | "legacy"
+
+
+def decode(data: str) -> Optional[Route]:
+    """Route или None, если кнопка не из известной схемы (устарела)."""
+    if data[:1] == VERSION and len(data) >= 2 and (len(data) == 2 or data[2] == ":"):
+        return Route(data[1], data[3:], _SCHEMA)
+    tag = LEGACY_EXACT.get(data)
+    if tag is not None:
+        return Route(tag, "", "legacy")
+    prefix, sep, arg = data.partition(":")
+    tag = LEGACY_PREFIX.get(prefix) if sep else None
+    if tag is not None:
+        return Route(tag, arg, "legacy")
+    return None
+
+
+Handler = Callable[..., Awaitable]
+
+
+class CallbackRouter:
+    """Таблица тег → обработчик(update, context, arg)."""
+
+    def __init__(self):
+        self._routes: Dict[str, Handler] = {}
+
+    def route(self, tag: str):
+        if len(tag) != 1:
+            raise ValueError(f"тег маршрута — один символ, а не {tag!r}")
+
+        def register(fn: Handler) -> Handler:
+            if tag in self._routes:
+                raise ValueError(f"маршрут {tag!r} уже занят {self._routes[tag].__name__}")
+            self._routes[tag] = fn
+            return fn
+        return register
+
+    def resolve(self, data: str):
+        """(обработчик, Route) или (None, None) для устаревшей/чужой кнопки."""
+        route = decode(data)
+        handler = self._routes.get(route.tag) if route else None
+        return (handler, route) if handler else (None, None)
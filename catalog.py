@@ -0,0 +1,297 @@
+# catalog.py
+# ------------------------------------------------------------------------------
+# Скомпилированный каталог локаций и проектов. Данные лежат в
+# static/catalog.json; из них один раз собираются подписи, готовые
+# InlineKeyboardMarkup, локальные пути к фото и их размеры. На горячем пути
+# остаётся поиск в dict. Объекты неизменяемые — при правке файла каталог
+# пересобирается и подменяется целиком, без рестарта.
+# ------------------------------------------------------------------------------
+
+import os
+import re
+import json
+import hashlib
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional, Sequence, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import LIMIT, LOC, LOCS, MENU, PROJ, PROJS, encode
+
+logger = logging.getLogger("bot.catalog")
+
+BACK_TO_MENU = InlineKeyboardButton("🏠 Вернуться в меню", callback_data=encode(MENU))
+
+
+@dataclass(frozen=True, slots=True)
+class Entry:
+    """Карточка локации или проекта (поля совместимы с bot.Card)."""
+    kind: str                      # "loc" | "proj"
+    name: str
+    slug: str                      # ключ в callback_data
+    caption: str
+    photo_url: Optional[str]
+    local_path: Optional[str]      # static/... или None, если файла нет
+    file_size: int
+    presentation: Optional[str]
+    video: Optional[str]
+    markup: InlineKeyboardMarkup
+
+    @property
+    def label(self) -> str:
+        return self.name
+
+
+@dataclass(frozen=True, slots=True)
+class Catalog:
+    locations: Mapping[str, Entry]
+    projects: Mapping[str, Entry]
+    location_names: Tuple[str, ...]
+    project_names: Tuple[str, ...]
+    locations_markup: InlineKeyboardMarkup
+    projects_markup: InlineKeyboardMarkup
+    location_slugs: Mapping[str, Entry]
+    project_slugs: Mapping[str, Entry]
+
+    def location(self, key: str) -> Optional[Entry]:
+        """По названию (старые кнопки, тексты) или по slug (новые кнопки)."""
+        return self.locations.get(key) or self.location_slugs.get(key)
+
+    def project(self, key: str) -> Optional[Entry]:
+        return self.projects.get(key) or self.project_slugs.get(key)
+
+
+def _resolve(photo_url: Optional[str], local_path_of: Callable[[Optional[str]], Optional[str]]):
+    path = local_path_of(photo_url)
+    try:
+        size = os.path.getsize(path) if path else 0
+    except OSError:
+        size = 0
+    # пустой или отсутствующий файл — грузить нечего, пойдём по URL
+    return (path, size) if size > 0 else (None, 0)
+
+
+def _location_entry(name: str, data: dict, local_path_of) -> Entry:
+    # Кнопки без дублей: сначала презентация, потом видео
+    buttons = []
+    if data.get("presentation"):
+        buttons.append([InlineKeyboardButton("📘 Смотреть презентацию", url=data["presentation"])])
+    if data.get("video"):
+        buttons.append([InlineKeyboardButton("🎬 Смотреть видео", url=data["video"])])
+    buttons.append([InlineKeyboardButton("📋 К списку локаций", callback_data=encode(LOCS))])
+    buttons.append([BACK_TO_MENU])
+    path, size = _resolve(data.get("photo"), local_path_of)
+    return Entry("loc", name, data["slug"], data["caption"], data.get("photo"), path, size,
+                 data.get("presentation"), data.get("video"), InlineKeyboardMarkup(buttons))
+
+
+def _project_entry(name: str, data: dict, local_path_of) -> Entry:
+    buttons = []
+    if data.get("presentation"):
+        buttons.append([InlineKeyboardButton("📘 Смотреть презентацию", url=data["presentation"])])
+    buttons.append([InlineKeyboardButton("📋 К списку проектов", callback_data=encode(PROJS))])
+    buttons.append([BACK_TO_MENU])
+    path, size = _resolve(data.get("photo"), local_path_of)
+    return Entry("proj", name, data["slug"], data["caption"], data.get("photo"), path, size,
+                 data.get("presentation"), None, InlineKeyboardMarkup(buttons))
+
+
+def compile_catalog(locations: Sequence[str], locations_data: Mapping[str, dict],
+                    projects: Sequence[str], projects_data: Mapping[str, dict],
+                    *, local_path_of: Callable[[Optional[str]], Optional[str]]) -> Catalog:
+    locs = {name: _location_entry(name, locations_data[name], local_path_of)
+            for name in locations if name in locations_data}
+    projs = {name: _project_entry(name, projects_data[name], local_path_of)
+             for name in projects if name in projects_data}
+
+    loc_rows = [[InlineKeyboardButton(name, callback_data=encode(LOC, locs[name].slug))]
+                for name in locations if name in locs]
+    loc_rows.append([BACK_TO_MENU])
+    proj_rows = [[InlineKeyboardButton(f"🏡 {name}", callback_data=encode(PROJ, projs[name].slug))]
+                 for name in projects if name in projs]
+    proj_rows.append([BACK_TO_MENU])
+
+    return Catalog(
+        locations=MappingProxyType(locs),
+        projects=MappingProxyType(projs),
+        location_names=tuple(locations),
+        project_names=tuple(projects),
+        locations_markup=InlineKeyboardMarkup(loc_rows),
+        projects_markup=InlineKeyboardMarkup(proj_rows),
+        location_slugs=MappingProxyType({e.slug: e for e in locs.values()}),
+        project_slugs=MappingProxyType({e.slug: e for e in projs.values()}),
+    )
+
+
+# ========= ФАЙЛ КАТАЛОГА =========
+class CatalogError(ValueError):
+    """Файл каталога не прошёл проверку."""
+
+
+_SLUG_RE = re.compile(r"^[a-z0-9_]+$")
+_CALLBACK_TAG = {"locations": LOC, "projects": PROJ}
+
+
+def _check_entry(kind: str, i: int, item, seen: set, slugs: set) -> None:
+    where = f"{kind}[{i}]"
+    if not isinstance(item, dict):
+        raise CatalogError(f"{where}: ожидался объект")
+    name = item.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise CatalogError(f"{where}: нет name")
+    if name in seen:
+        raise CatalogError(f"{where}: повтор name {name!r}")
+    seen.add(name)
+    slug = item.get("slug")
+    if not isinstance(slug, str) or not _SLUG_RE.match(slug):
+        raise CatalogError(f"{where}: slug должен быть [a-z0-9_]+")
+    if slug in slugs:
+        raise CatalogError(f"{where}: повтор slug {slug!r}")
+    slugs.add(slug)
+    try:
+        encode(_CALLBACK_TAG[kind], slug)
+    except ValueError:
+        raise CatalogError(f"{where}: slug {slug!r} не влезает в callback_data ({LIMIT} байт)")
+    if not isinstance(item.get("description"), str):
+        raise CatalogError(f"{where}: нет description")
+
+
+def validate(raw) -> dict:
+    if not isinstance(raw, dict):
+        raise CatalogError("каталог должен быть объектом")
+    for kind in ("locations", "projects"):
+        items = raw.get(kind)
+        if not isinstance(items, list) or not items:
+            raise CatalogError(f"{kind}: нужен непустой список")
+        seen: set = set()
+        slugs: set = set()
+        for i, item in enumerate(items):
+            _check_entry(kind, i, item, seen, slugs)
+    for i, proj in enumerate(raw["projects"]):
+        rooms = proj.get("rooms", [])
+        ok = isinstance(rooms, list) and all(
+            isinstance(r, list) and len(r) == 2 and isinstance(r[0], str)
+            and isinstance(r[1], (int, float)) and r[1] > 0 for r in rooms)
+        if not ok:
+            raise CatalogError(f"projects[{i}]: rooms — список пар [название, площадь]")
+    return raw
+
+
+def _area(value: float) -> str:
+    return f"{value:g}".replace(".", ",")
+
+
+def project_caption(proj: dict) -> str:
+    caption = f"<b>{proj['name']}</b>\n{proj['description']}"
+    rooms = proj.get("rooms") or []
+    if rooms:
+        caption += "\n\n" + "\n".join(f"• {room}: {_area(area)} м²" for room, area in rooms)
+    return caption
+
+
+def build_catalog(raw: dict, *, asset_url: Callable[[str], Optional[str]],
+                  local_path_of: Callable[[Optional[str]], Optional[str]]) -> Catalog:
+    """
+    Проверенный JSON → Catalog. asset_url("locations/x/x.jpg") даёт публичный
+    URL файла из static/ (с версией по содержимому) или None без BASE_URL.
+    """
+    locations, locations_data = [], {}
+    for loc in raw["locations"]:
+        name, slug = loc["name"], loc["slug"]
+        locations.append(name)
+        locations_data[name] = {
+            "slug": slug,
+            "photo": asset_url(f"locations/{slug}/{slug}.jpg"),
+            "presentation": asset_url(f"locations/{slug}/{slug}.pdf"),
+            "video": asset_url(f"locations/{slug}/video.mp4") if loc.get("video") else None,
+            "caption": f"<b>{name}</b>\n{loc['description']}",
+        }
+    projects, projects_data = [], {}
+    for proj in raw["projects"]:
+        name, slug = proj["name"], proj["slug"]
+        projects.append(name)
+        projects_data[name] = {
+            "slug": slug,
+            "photo": asset_url(f"projects/{slug}/{slug}.jpg"),
+            "presentation": asset_url(f"projects/{slug}/{slug}.pdf"),
+            "caption": project_caption(proj),
+        }
+    return compile_catalog(locations, locations_data, projects, projects_data, local_path_of=local_path_of)
+
+
+class CatalogSource:
+    """
+    Файл каталога с отслеживанием изменений: сначала дешёвая проверка
+    mtime/размера, затем sha256. Битый файл не ломает бота — остаётся
+    предыдущая версия, ошибка пишется в лог.
+    """
+
+    what = "Каталог"
+
+    def __init__(self, path: str, build: Callable[[dict], Catalog]):
+        self.path = path
+        self._build = build
+        self._stamp: Tuple[int, int] = (0, 0)
+        self._raw: Optional[dict] = None
+        self.digest = ""
+
+    @property
+    def raw(self) -> Optional[dict]:
+        """Последние принятые (проверенные) данные файла."""
+        return self._raw
+
+    def _check(self, raw) -> dict:
+        return validate(raw)
+
+    def _summary(self, catalog: Catalog) -> str:
+        return f"{len(catalog.locations)} локаций, {len(catalog.projects)} проектов"
+
+    def _read(self) -> Tuple[Tuple[int, int], str, bytes]:
+        st = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            blob = f.read()
+        return (st.st_mtime_ns, st.st_size), hashlib.sha256(blob).hexdigest(), blob
+
+    def _compile(self, blob: bytes) -> Catalog:
+        try:
+            raw = json.loads(blob.decode("utf-8"))
+        except ValueError as e:
+            raise CatalogError(f"не JSON: {e}") from e
+        catalog = self._build(self._check(raw))
+        self._raw = raw
+        return catalog
+
+    def rebuild(self) -> Catalog:
+        """Пересобрать из уже принятых данных (например, сменились версии статики)."""
+        return self._build(self._raw)
+
+    def load(self) -> Catalog:
+        stamp, digest, blob = self._read()
+        catalog = self._compile(blob)
+        self._stamp, self.digest = stamp, digest
+        logger.info(f"{self.what} {self.path}: {self._summary(catalog)}")
+        return catalog
+
+    def poll(self) -> Optional[Catalog]:
+        """Новый Catalog, если файл изменился и валиден; иначе None."""
+        try:
+            st = os.stat(self.path)
+            if (st.st_mtime_ns, st.st_size) == self._stamp:
+                return None
+            stamp, digest, blob = self._read()
+        except OSError as e:
+            logger.warning(f"{self.what} {self.path} недоступен: {e}")
+            return None
+        self._stamp = stamp
+        if digest == self.digest:
+            return None  # файл «тронули», но содержимое то же
+        try:
+            catalog = self._compile(blob)
+        except CatalogError as e:
+            logger.error(f"{self.what} {self.path} не принят, работаем на старом: {e}")
+            return None
+        self.digest = digest
+        logger.info(f"{self.what} перечитан: {self._summary(catalog)}")
+        return catalog
@@ -0,0 +1,114 @@
+# dedup.py
+# ------------------------------------------------------------------------------
+# Защита от повторной доставки апдейтов. Если вебхук ответил медленно или
+# с ошибкой, Telegram присылает тот же update_id ещё раз — второй раз его
+# обрабатывать не нужно (иначе двойная карточка и двойная заливка фото).
+#
+# Два режима:
+#   memory — окно последних update_id в памяти процесса (LRU + TTL);
+#   sqlite — общий файл, чтобы несколько воркеров gunicorn видели одно и то же.
+# ------------------------------------------------------------------------------
+
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("bot.dedup")
+
+
+class _Counters:
+    def __init__(self):
+        self.checked = 0
+        self.duplicates = 0
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "checked": self.checked, "duplicates": self.duplicates}
+
+
+class MemoryDedup(_Counters):
+    backend = "memory"
+
+    def __init__(self, ttl: float = 3600.0, max_size: int = 10000):
+        super().__init__()
+        self.ttl = ttl
+        self.max_size = max_size
+        self._seen: "OrderedDict[int, float]" = OrderedDict()
+
+    async def seen(self, update_id: int) -> bool:
+        """True — этот update_id уже был в окне; иначе запоминаем его."""
+        self.checked += 1
+        now = time.monotonic()
+        ts = self._seen.get(update_id)
+        if ts is not None and now - ts < self.ttl:
+            self.duplicates += 1
+            return True
+        self._seen[update_id] = now
+        self._seen.move_to_end(update_id)
+        # выкидываем самые старые: по размеру и по возрасту
+        while self._seen and (len(self._seen) > self.max_size
+                              or now - next(iter(self._seen.values())) >= self.ttl):
+            self._seen.popitem(last=False)
+        return False
+
+    async def forget(self, update_id: int) -> None:
+        """Апдейт не приняли в обработку — пусть повтор пройдёт."""
+        self._seen.pop(update_id, None)
+
+    def stats(self) -> dict:
+        return {**super().stats(), "size": len(self._seen)}
+
+
+class SqliteDedup(_Counters):
+    backend = "sqlite"
+    PRUNE_EVERY = 500
+
+    def __init__(self, path: str, ttl: float = 3600.0):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self._inserts = 0
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen_updates ("
+                           "update_id INTEGER PRIMARY KEY, ts REAL NOT NULL)")
+        self._lock = asyncio.Lock()
+
+    def _check_and_mark(self, update_id: int) -> bool:
+        now = time.time()
+        cur = self._conn.execute(
+            "INSERT INTO seen_updates(update_id, ts) VALUES (?, ?) "
+            "ON CONFLICT(update_id) DO UPDATE SET ts = excluded.ts WHERE seen_updates.ts < ?",
+            (update_id, now, now - self.ttl),
+        )
+        fresh = cur.rowcount == 1
+        if fresh:
+            self._inserts += 1
+            if self._inserts % self.PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM seen_updates WHERE ts < ?", (now - self.ttl,))
+        return not fresh
+
+    async def seen(self, update_id: int) -> bool:
+        self.checked += 1
+        # sqlite может ждать блокировку другого воркера — не держим event loop
+        async with self._lock:
+            dup = await asyncio.to_thread(self._check_and_mark, update_id)
+        if dup:
+            self.duplicates += 1
+        return dup
+
+    async def forget(self, update_id: int) -> None:
+        async with self._lock:
+            await asyncio.to_thread(self._conn.execute,
+                                    "DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+
+
+def make_dedup(backend: str, *, path: str, ttl: float, max_size: int):
+    if backend == "sqlite":
+        logger.info(f"Дедупликация апдейтов: sqlite {path}, окно {ttl:.0f}с")
+        return SqliteDedup(path, ttl=ttl)
+    if backend != "memory":
+        logger.warning(f"Неизвестный DEDUP_BACKEND={backend!r} — использую memory")
+    return MemoryDedup(ttl=ttl, max_size=max_size)
@@ -0,0 +1,395 @@
+# estimate.py
+# ------------------------------------------------------------------------------
+# Расчёт стоимости за кнопкой «🧮 Расчёт стоимости».
+#
+# Цена — функция пяти выборов: проект × локация × отделка × сети × участок.
+# Вариантов сотни, поэтому при загрузке прайса (PRICES_FILE) они
+# считаются все сразу одним тензором NumPy:
+#
+#   price[p, l, f, u, k] = площадь[p] · (м²[p] + отделка[f]) · коэф[l]
+#                          + сети[u] + доля_участка[k] · участок[l]
+#
+# Площадь проекта — сумма комнат из catalog.json. Запросы — срезы и поиск
+# по готовым массивам:
+#   • table() — таблица сравнения по любым двум осям;
+#   • best_fit(budget) — «лучшее, что влезает в бюджет»: варианты заранее
+#     упорядочены от лучшего (больше дом, полнее сети, потом отделка, затем
+#     дешевле), по этому порядку хранится бегущий минимум цены — ответ
+#     на бюджет это один searchsorted, микросекунды;
+#   • best_fit_many(budgets) — то же пачкой (отчёты, рассылки).
+#
+# Estimator неизменяемый: правка прайса или каталога собирает новый в
+# фоновом потоке и подменяет ссылку — запросы не ждут пересборки.
+#
+# Прайс присылает отдел продаж; в репозитории только tests/prices_sample.json
+# с условными цифрами для тестов — клиентам его не отдаём.
+#
+#   python estimate.py --prices prices.json --budget 8e6 9e6 12e6 [--location shopino]
+# ------------------------------------------------------------------------------
+
+import re
+import sys
+import json
+import logging
+import argparse
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from catalog import CatalogError, CatalogSource
+
+logger = logging.getLogger("bot.estimate")
+
+AXES = ("project", "location", "finishing", "utilities", "lot")
+_LADDERS_MAX = 256  # сколько наборов фильтров держать готовыми
+
+
+# ========= ПРАЙС =========
+def _number(value, where: str, *, positive: bool = False) -> float:
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0 or (positive and value == 0):
+        raise CatalogError(f"{where}: нужно {'положительное' if positive else 'неотрицательное'} число")
+    return float(value)
+
+
+def _options(raw: dict, kind: str, field: str) -> None:
+    items = raw.get(kind)
+    if not isinstance(items, list) or not items:
+        raise CatalogError(f"{kind}: нужен непустой список")
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get("name"), str):
+            raise CatalogError(f"{kind}[{i}]: нет name")
+        _number(item.get(field), f"{kind}[{i}].{field}")
+
+
+def validate_prices(raw) -> dict:
+    if not isinstance(raw, dict):
+        raise CatalogError("прайс должен быть объектом")
+    for kind in ("projects", "locations"):
+        if not isinstance(raw.get(kind), dict) or not raw[kind]:
+            raise CatalogError(f"{kind}: нужен объект slug → цены")
+    for slug, item in raw["projects"].items():
+        _number(item.get("m2") if isinstance(item, dict) else None, f"projects.{slug}.m2", positive=True)
+    for slug, item in raw["locations"].items():
+        if not isinstance(item, dict):
+            raise CatalogError(f"locations.{slug}: ожидался объект")
+        _number(item.get("lot"), f"locations.{slug}.lot")
+        _number(item.get("coef", 1.0), f"locations.{slug}.coef", positive=True)
+    _options(raw, "finishing", "m2")
+    _options(raw, "utilities", "price")
+    _options(raw, "lot", "share")
+    own = [k for k in raw["lot"] if k.get("own", False) is not False]
+    if any(k["own"] is not True for k in own) or len(own) > 1:
+        raise CatalogError("lot: own: true — только у одного варианта («на своём участке»)")
+    return raw
+
+
+# ========= РАСЧЁТ =========
+class Quote(NamedTuple):
+    project: str
+    location: str
+    finishing: str
+    utilities: str
+    lot: str
+    area: float
+    price: int
+
+
+class Estimator:
+    """Все варианты цены, посчитанные заранее. Неизменяемый после сборки."""
+
+    def __init__(self, projects: Sequence[Tuple[str, str, float, float]],
+                 locations: Sequence[Tuple[str, str, float, float]],
+                 finishing: Sequence[Tuple[str, float]], utilities: Sequence[Tuple[str, float]],
+                 lots: Sequence[Tuple[str, float]], *, currency: str = "₽", step: int = 10000,
+                 note: str = "", own_lot: Optional[str] = None):
+        # projects: (slug, name, площадь, ₽/м²); locations: (slug, name, участок, коэф.)
+        # own_lot — имя варианта «на своём участке» (own: true в прайсе), если он есть
+        self.currency = currency
+        self.note = note
+        self.own_lot = own_lot
+        self.project_slugs = tuple(p[0] for p in projects)
+        self.project_names = tuple(p[1] for p in projects)
+        self.location_slugs = tuple(l[0] for l in locations)
+        self.location_names = tuple(l[1] for l in locations)
+        self.finishing_names = tuple(f[0] for f in finishing)
+        self.utilities_names = tuple(u[0] for u in utilities)
+        self.lot_names = tuple(k[0] for k in lots)
+        self.area = np.array([p[2] for p in projects], dtype=np.float64)
+
+        m2 = np.array([p[3] for p in projects])[:, None, None, None, None]
+        area = self.area[:, None, None, None, None]
+        coef = np.array([l[3] for l in locations])[None, :, None, None, None]
+        lot_price = np.array([l[2] for l in locations])[None, :, None, None, None]
+        finish = np.array([f[1] for f in finishing])[None, None, :, None, None]
+        nets = np.array([u[1] for u in utilities])[None, None, None, :, None]
+        share = np.array([k[1] for k in lots])[None, None, None, None, :]
+        price = area * (m2 + finish) * coef + nets + share * lot_price
+        step = max(1, int(step))
+        self.prices = (np.rint(price / step) * step).astype(np.int64)
+        self.prices.flags.writeable = False
+        self.shape = self.prices.shape
+
+        # порядок «от лучшего»: площадь, сети (без них не въехать), отделка,
+        # участок (первый в прайсе — полный комплект), при равенстве — дешевле
+        p_rank = np.argsort(np.argsort(self.area, kind="stable"), kind="stable")
+        grid = np.indices(self.shape)
+        flat_price = self.prices.ravel()
+        self._order = np.lexsort((
+            flat_price,
+            grid[4].ravel(),
+            -grid[2].ravel(),
+            -grid[3].ravel(),
+            -p_rank[grid[0]].ravel(),
+        ))
+        self._ladders: Dict[tuple, Tuple[np.ndarray, np.ndarray]] = {}
+        self.min_by_project = self.prices.reshape(len(projects), -1).min(axis=1)
+        self.max_by_project = self.prices.reshape(len(projects), -1).max(axis=1)
+
+    def __len__(self) -> int:
+        return self.prices.size
+
+    # --- фильтры ---
+    def index(self, axis: str, key) -> Optional[int]:
+        """Номер варианта по slug / названию / номеру; None — нет такого."""
+        if key is None:
+            return None
+        if isinstance(key, (int, np.integer)):
+            return int(key) if 0 <= key < self.shape[AXES.index(axis)] else None
+        names = {
+            "project": (self.project_slugs, self.project_names),
+            "location": (self.location_slugs, self.location_names),
+            "finishing": (self.finishing_names,),
+            "utilities": (self.utilities_names,),
+            "lot": (self.lot_names,),
+        }[axis]
+        for variants in names:
+            if key in variants:
+                return variants.index(key)
+        return None
+
+    def _key(self, filters: dict, area_min: Optional[float]) -> tuple:
+        key = []
+        for axis in AXES:
+            value = filters.get(axis)
+            i = self.index(axis, value)
+            if value is not None and i is None:
+                raise KeyError(f"{axis}: нет варианта {value!r}")
+            key.append(i)
+        projects = None
+        if area_min:
+            projects = tuple(np.flatnonzero(self.area >= area_min - 1e-9))
+        return (*key, projects)
+
+    def _ladder(self, key: tuple) -> Tuple[np.ndarray, np.ndarray]:
+        """Варианты под фильтром в порядке «от лучшего» и −бегущий минимум их цен."""
+        ladder = self._ladders.get(key)
+        if ladder is not None:
+            return ladder
+        mask = np.ones(self.shape, dtype=bool)
+        for axis, i in enumerate(key[:-1]):
+            if i is not None:
+                keep = np.zeros(self.shape[axis], dtype=bool)
+                keep[i] = True
+                mask &= keep.reshape([-1 if a == axis else 1 for a in range(5)])
+        if key[-1] is not None:
+            keep = np.zeros(self.shape[0], dtype=bool)
+            keep[list(key[-1])] = True
+            mask &= keep[:, None, None, None, None]
+        order = self._order[mask.ravel()[self._order]]
+        # бегущий минимум не растёт → −минимум не убывает, по нему работает searchsorted
+        ladder = (order, -np.minimum.accumulate(self.prices.ravel()[order]))
+        if len(self._ladders) >= _LADDERS_MAX:
+            self._ladders.clear()
+        self._ladders[key] = ladder
+        return ladder
+
+    # --- запросы ---
+    def quote(self, flat: int) -> Quote:
+        p, l, f, u, k = np.unravel_index(flat, self.shape)
+        return Quote(self.project_names[p], self.location_names[l], self.finishing_names[f],
+                     self.utilities_names[u], self.lot_names[k], float(self.area[p]),
+                     int(self.prices.ravel()[flat]))
+
+    def best_fit_many(self, budgets, *, area_min: Optional[float] = None, **filters) -> np.ndarray:
+        """Для каждого бюджета — номер лучшего варианта в prices.ravel() или −1."""
+        order, ladder = self._ladder(self._key(filters, area_min))
+        budgets = np.asarray(budgets, dtype=np.float64)
+        pos = np.searchsorted(ladder, -budgets, side="left")
+        found = pos < len(order)
+        return np.where(found, order[np.minimum(pos, len(order) - 1)], -1) if len(order) else \
+            np.full(budgets.shape, -1)
+
+    def best_fit(self, budget: float, *, area_min: Optional[float] = None, **filters) -> Optional[Quote]:
+        flat = int(self.best_fit_many(budget, area_min=area_min, **filters))
+        return self.quote(flat) if flat >= 0 else None
+
+    def best_by_project(self, budget: float, **filters) -> List[Quote]:
+        """Лучший вариант каждого проекта в пределах бюджета (от большего дома)."""
+        quotes = [self.best_fit(budget, project=p, **filters) for p in range(self.shape[0])]
+        return sorted((q for q in quotes if q), key=lambda q: -q.area)
+
+    def table(self, rows: str = "project", cols: str = "finishing", **filters) -> np.ndarray:
+        """
+        Таблица сравнения rows × cols. Оси, не вошедшие в таблицу, берутся
+        из filters или по первому варианту прайса (для локации — самая дешёвая).
+        """
+        index = []
+        for axis in AXES:
+            if axis in (rows, cols):
+                index.append(slice(None))
+            elif filters.get(axis) is not None:
+                index.append(self.index(axis, filters[axis]))
+            else:
+                index.append(None if axis == "location" else 0)
+        cube = self.prices
+        if index[1] is None:
+            cube = cube.min(axis=1, keepdims=True)
+            index[1] = 0
+        table = cube[tuple(index)]
+        return table if AXES.index(rows) < AXES.index(cols) else table.T
+
+
+def build_estimator(catalog_raw: dict, prices: dict) -> Estimator:
+    """Каталог (проекты с комнатами, локации) + прайс → Estimator."""
+    projects, skipped = [], []
+    for proj in catalog_raw["projects"]:
+        price = prices["projects"].get(proj["slug"])
+        area = sum(area for _, area in proj.get("rooms") or [])
+        if price and area:
+            projects.append((proj["slug"], proj["name"], round(area, 1), float(price["m2"])))
+        else:
+            skipped.append(proj["slug"])
+    locations = []
+    for loc in catalog_raw["locations"]:
+        price = prices["locations"].get(loc["slug"])
+        if price:
+            locations.append((loc["slug"], loc["name"], float(price["lot"]), float(price.get("coef", 1.0))))
+        else:
+            skipped.append(loc["slug"])
+    if skipped:
+        logger.warning(f"Без цены (в расчёт не попадут): {', '.join(skipped)}")
+    if not projects or not locations:
+        raise CatalogError("в прайсе нет ни одного проекта или локации из каталога")
+    return Estimator(
+        projects, locations,
+        [(f["name"], float(f["m2"])) for f in prices["finishing"]],
+        [(u["name"], float(u["price"])) for u in prices["utilities"]],
+        [(k["name"], float(k["share"])) for k in prices["lot"]],
+        currency=prices.get("currency", "₽"),
+        step=prices.get("round", 10000),
+        note=prices.get("note", ""),
+        own_lot=next((k["name"] for k in prices["lot"] if k.get("own")), None),
+    )
+
+
+class PriceSource(CatalogSource):
+    """Файл прайса с тем же отслеживанием изменений, что и у каталога."""
+    what = "Прайс"
+
+    def _check(self, raw) -> dict:
+        return validate_prices(raw)
+
+    def _summary(self, estimator: Estimator) -> str:
+        shape = " × ".join(str(n) for n in estimator.shape)
+        return f"{len(estimator)} вариантов ({shape})"
+
+
+# ========= ТЕКСТ =========
+_AREA_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(?:м2|м²|кв\.?\s*м|квадрат|метр)", re.I)
+_MONEY_RE = re.compile(r"(\d[\d\s]*(?:[.,]\d+)?)\s*(млн|миллион\w*|м\b|тыс\w*|т\b|к\b)?", re.I)
+_OWN_LOT = ("свой участок", "своём участке", "своем участке", "без участка", "есть участок")
+
+
+def parse_request(text: str) -> Optional[dict]:
+    """«9 млн», «от 100 м² до 12 млн на своём участке» → {"budget", "area_min", "own_lot"}."""
+    low = text.lower().replace(" ", " ")
+    area = None
+    match = _AREA_RE.search(low)
+    if match:
+        area = float(match.group(1).replace(",", "."))
+        low = low[:match.start()] + " " + low[match.end():]
+    budget, prev = None, None  # prev — (конец, множитель) последней суммы
+    for match in _MONEY_RE.finditer(low):
+        value = float(re.sub(r"\s", "", match.group(1)).replace(",", "."))
+        unit = (match.group(2) or "")[:1]
+        scale = 1_000_000 if unit == "м" else 1_000 if unit in ("т", "к") else 1
+        value *= scale
+        if not unit and value < 100_000:
+            prev = None
+            continue
+        # «9 млн 500 тыс» — одна сумма из соседних частей с убывающими единицами
+        if prev and scale < prev[1] and low[prev[0]:match.start()].strip() in ("", "и"):
+            budget += value
+        else:
+            budget = value
+        prev = (match.end(), scale)
+    if budget is None:
+        return None
+    return {"budget": budget, "area_min": area, "own_lot": any(s in low for s in _OWN_LOT)}
+
+
+def money(value: float, currency: str = "₽") -> str:
+    if value >= 1_000_000:
+        return f"{value / 1_000_000:.2f}".rstrip("0").rstrip(".").replace(".", ",") + f" млн {currency}"
+    return f"{round(value / 1000):d} тыс {currency}"
+
+
+def _area(value: float) -> str:
+    return f"{value:g}".replace(".", ",")
+
+
+def overview(est: Estimator) -> str:
+    """Вилка цен по проектам — первый ответ на кнопку."""
+    lines = ["🧮 <b>Стоимость домов</b> — от тёплого контура на своём участке "
+             "до «под ключ» с участком и всеми сетями:"]
+    for p, name in enumerate(est.project_names):
+        lines.append(f"🏡 {name} ({_area(est.area[p])} м²) — "
+                     f"{money(est.min_by_project[p], est.currency)} … {money(est.max_by_project[p], est.currency)}")
+    lines.append("\nНапишите бюджет — например, «9 млн» или «от 100 м² до 12 млн на своём участке», "
+                 "и я подберу лучший вариант.")
+    return "\n".join(lines)
+
+
+def _describe(q: Quote, currency: str) -> str:
+    return (f"🏡 <b>{q.project}</b>, {_area(q.area)} м² — {q.location}, {q.finishing}, "
+            f"{q.utilities}, {q.lot}: <b>{money(q.price, currency)}</b>")
+
+
+def answer(est: Estimator, request: dict) -> str:
+    with_lot = next((name for name in est.lot_names if name != est.own_lot), est.lot_names[0])
+    lot = est.own_lot if request.get("own_lot") and est.own_lot else with_lot
+    budget, area_min = request["budget"], request.get("area_min")
+    best = est.best_fit(budget, area_min=area_min, lot=lot)
+    head = f"Бюджет {money(budget, est.currency)}" + (f", от {_area(area_min)} м²" if area_min else "")
+    if best is None:
+        cheapest = int(est.prices[..., est.index("lot", lot)].min())
+        return (f"{head}: пока не хватает — самый доступный вариант {lot} "
+                f"стоит {money(cheapest, est.currency)}. Менеджер подскажет рассрочку и ипотеку.")
+    lines = [f"{head} — лучший вариант:", _describe(best, est.currency)]
+    others = [q for q in est.best_by_project(budget, lot=lot) if q.project != best.project]
+    if others:
+        lines.append("\nДругие проекты в этом бюджете:")
+        lines.extend(_describe(q, est.currency) for q in others)
+    if est.note:
+        lines.append(f"\n<i>{est.note}</i>")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Расчёт стоимости по прайсу")
+    parser.add_argument("--catalog", default="static/catalog.json")
+    parser.add_argument("--prices", required=True, help="прайс от отдела продаж (JSON)")
+    parser.add_argument("--budget", type=float, nargs="*", default=[], help="бюджеты, ₽")
+    parser.add_argument("--location", default=None, help="slug локации для таблицы")
+    opts = parser.parse_args(sys.argv[1:])
+    with open(opts.catalog, encoding="utf-8") as f:
+        catalog_raw = json.load(f)
+    with open(opts.prices, encoding="utf-8") as f:
+        est = build_estimator(catalog_raw, validate_prices(json.load(f)))
+    print(f"{len(est)} вариантов, оси {dict(zip(AXES, est.shape))}")
+    table = est.table("project", "finishing", location=opts.location)
+    print("\t" + "\t".join(est.finishing_names))
+    for name, row in zip(est.project_names, table):
+        print(name + "\t" + "\t".join(money(v, est.currency) for v in row))
+    for budget, flat in zip(opts.budget, est.best_fit_many(opts.budget, location=opts.location)):
+        print(money(budget, est.currency), "→", est.quote(flat) if flat >= 0 else "нет вариантов")
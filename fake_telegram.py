@@ -0,0 +1,163 @@
+# fake_telegram.py
+# ------------------------------------------------------------------------------
+# Локальная замена Bot API для нагрузочных прогонов: бот ходит сюда вместо
+# api.telegram.org (TG_API_BASE=http://127.0.0.1:8081/bot). Сервер отвечает
+# правдоподобными объектами и имитирует реальность:
+#   • задержку каждого вызова (база + случайный разброс);
+#   • 429 Too Many Requests с retry_after с заданной вероятностью;
+#   • время заливки файла пропорционально его размеру;
+#   • пользователей, заблокировавших бота (403 на отправку, постоянно для chat_id).
+# POST /crm — заодно замена CRM для заявок (CRM_WEBHOOK_URL=http://127.0.0.1:8081/crm):
+# своя задержка и доля 503, повтор с тем же Idempotency-Key не дублирует сделку.
+# GET /stats — сколько вызовов какого метода пришло и сколько получили 429.
+#
+#   python fake_telegram.py --port 8081 --latency 0.05 --p429 0.01 --upload-mbps 20 --blocked 0.05 \
+#       --crm-latency 2 --crm-fail 0.3
+# ------------------------------------------------------------------------------
+
+import re
+import sys
+import zlib
+import json
+import random
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+_PHOTO = [{"file_id": "FAKE_PHOTO", "file_unique_id": "FU1", "width": 1280, "height": 720}]
+# текстовые поля multipart (у файловых частей после name идёт ; filename=...)
+_FORM_FIELD = re.compile(rb'name="([^"]+)"\r\n\r\n([^\r]*)\r\n')
+_SEND_METHODS = {"sendMessage", "sendPhoto", "sendDocument"}
+_MESSAGE_METHODS = {"sendMessage", "sendPhoto", "editMessageText", "editMessageCaption",
+                    "editMessageMedia", "editMessageReplyMarkup", "sendDocument"}
+
+
+class FakeBotApi:
+    def __init__(self, *, latency: float = 0.05, jitter: float = 0.03, p429: float = 0.0,
+                 retry_after: int = 1, upload_mbps: float = 20.0, blocked: float = 0.0,
+                 crm_latency: float = 0.2, crm_fail: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.p429 = p429
+        self.retry_after = retry_after
+        self.upload_bps = upload_mbps * 1_000_000 / 8
+        self.blocked = blocked
+        self.crm_latency = crm_latency
+        self.crm_fail = crm_fail
+        self.crm_leads: dict = {}       # Idempotency-Key → заявка
+        self.crm_calls: Counter = Counter()
+        self._rnd = random.Random(seed)
+        self._ids = itertools.count(100000)
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.forbidden = 0
+        self.uploaded_bytes = 0
+
+    def _message(self, method: str, params: dict) -> dict:
+        chat_id = params.get("chat_id", 1)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        msg = {"message_id": int(params.get("message_id") or next(self._ids)), "date": 0,
+               "chat": {"id": chat_id, "type": "private" if isinstance(chat_id, int) and chat_id > 0 else "group"}}
+        if method in ("sendPhoto", "editMessageMedia") or "caption" in params:
+            msg["photo"] = _PHOTO
+            msg["caption"] = params.get("caption", "")
+        else:
+            msg["text"] = params.get("text", "")
+        return msg
+
+    def result(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "MR.House", "username": "fake_mrhouse_bot"}
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method in _MESSAGE_METHODS:
+            return self._message(method, params)
+        return True
+
+    async def handle(self, request: Request):
+        method = request.path_params["method"]
+        body = await request.body()
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/"):
+            params = {k.decode(): v.decode("utf-8", "replace") for k, v in _FORM_FIELD.findall(body)}
+            self.uploaded_bytes += len(body)
+            delay = len(body) / self.upload_bps  # заливка
+        elif content_type.startswith("application/json"):
+            params = json.loads(body) if body else {}
+            delay = 0.0
+        else:  # так шлёт PTB: form-urlencoded
+            params = dict(parse_qsl(body.decode()))
+            delay = 0.0
+        self.calls[method] += 1
+        delay += max(0.0, self.latency + self._rnd.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(delay)
+        if method != "getMe" and self._rnd.random() < self.p429:
+            self.throttled[method] += 1
+            return JSONResponse({"ok": False, "error_code": 429,
+                                 "description": f"Too Many Requests: retry after {self.retry_after}",
+                                 "parameters": {"retry_after": self.retry_after}}, status_code=429)
+        if method in _SEND_METHODS and self._is_blocked(params.get("chat_id")):
+            self.forbidden += 1
+            return JSONResponse({"ok": False, "error_code": 403,
+                                 "description": "Forbidden: bot was blocked by the user"}, status_code=403)
+        return JSONResponse({"ok": True, "result": self.result(method, params)})
+
+    def _is_blocked(self, chat_id) -> bool:
+        # один и тот же chat_id заблокирован всегда — как настоящий пользователь
+        return bool(self.blocked) and zlib.crc32(str(chat_id).encode()) % 10000 < self.blocked * 10000
+
+    async def crm(self, request: Request):
+        lead = await request.json()
+        await asyncio.sleep(self.crm_latency * self._rnd.uniform(0.5, 1.5))
+        if self._rnd.random() < self.crm_fail:
+            self.crm_calls["failed"] += 1
+            return JSONResponse({"ok": False, "error": "CRM is down"}, status_code=503)
+        key = request.headers.get("idempotency-key") or f"lead-{lead.get('id')}"
+        self.crm_calls["duplicate" if key in self.crm_leads else "created"] += 1
+        self.crm_leads.setdefault(key, lead)
+        return JSONResponse({"ok": True, "deal": key})
+
+    async def stats(self, request: Request):
+        return JSONResponse({"calls": dict(self.calls), "throttled": dict(self.throttled),
+                             "total": sum(self.calls.values()), "uploaded_bytes": self.uploaded_bytes,
+                             "forbidden": self.forbidden, "crm": dict(self.crm_calls, leads=len(self.crm_leads))})
+
+    def app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/bot{token}/{method}", self.handle, methods=["POST", "GET"]),
+            Route("/crm", self.crm, methods=["POST"]),
+            Route("/stats", self.stats, methods=["GET"]),
+        ])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Фейковый Bot API для нагрузочных прогонов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="средняя задержка вызова, сек")
+    parser.add_argument("--jitter", type=float, default=0.03, help="разброс задержки, сек")
+    parser.add_argument("--p429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--upload-mbps", type=float, default=20.0, help="скорость заливки файлов")
+    parser.add_argument("--blocked", type=float, default=0.0, help="доля chat_id, заблокировавших бота")
+    parser.add_argument("--crm-latency", type=float, default=0.2, help="средний ответ /crm, сек")
+    parser.add_argument("--crm-fail", type=float, default=0.0, help="доля ответов 503 от /crm")
+    parser.add_argument("--seed", type=int, default=None)
+    opts = parser.parse_args(sys.argv[1:])
+    api = FakeBotApi(latency=opts.latency, jitter=opts.jitter, p429=opts.p429,
+                     retry_after=opts.retry_after, upload_mbps=opts.upload_mbps, blocked=opts.blocked,
+                     crm_latency=opts.crm_latency, crm_fail=opts.crm_fail, seed=opts.seed)
+    uvicorn.run(api.app(), host=opts.host, port=opts.port, log_level="warning")
@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+# ------------------------------------------------------------------------------
+# gunicorn подхватывает этот файл сам: `gunicorn bot:web_app` запускает
+# ASGI-приложение через uvicorn-воркеры (один event loop на воркер).
+# ------------------------------------------------------------------------------
+
+import os
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+# Апдейты обрабатываются в фоне — даём им доработать при рестарте
+graceful_timeout = 30
+timeout = 60
+
+
+def post_fork(server, worker):
+    # Точка отсчёта холодного старта воркера: bot.py читает её при импорте
+    # и пишет в лог «прогрет за …» и «первый ответ через …»
+    os.environ["WORKER_FORKED_AT"] = str(time.time())
@@ -0,0 +1,100 @@
+# images.py
+# ------------------------------------------------------------------------------
+# Облегчённые копии картинок из static/ для отправки в Telegram.
+# Telegram всё равно пережимает фото до ~1280 px, поэтому заливать
+# оригиналы по 1–1.7 МБ незачем. Для каждого исходника делаем:
+#   tg    — до 1280 px по длинной стороне, progressive JPEG, без EXIF/ICC;
+#   thumb — до 320 px, превью (инлайн-режим и т.п.).
+# Копии лежат на диске под именем «хэш исходника + вариант», поэтому
+# изменённый исходник автоматически получает новую копию.
+#
+# Pillow — необязательная зависимость: без него отдаём оригиналы.
+# ------------------------------------------------------------------------------
+
+import os
+import logging
+import tempfile
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover — без Pillow просто шлём оригиналы
+    Image = None
+
+logger = logging.getLogger("bot.images")
+
+# вариант → (макс. сторона, качество JPEG)
+VARIANTS: Dict[str, Tuple[int, int]] = {
+    "tg": (1280, 75),
+    "thumb": (320, 70),
+}
+
+
+class Derivatives:
+    def __init__(self, cache_dir: str, digest_of: Callable[[str], Optional[str]]):
+        self.cache_dir = cache_dir
+        self._digest_of = digest_of
+        self.enabled = Image is not None
+        if not self.enabled:
+            logger.warning("Pillow не установлен — картинки уходят оригиналами")
+
+    def name(self, src: str, variant: str) -> Optional[str]:
+        digest = self._digest_of(src)
+        return f"{digest[:16]}-{variant}.jpg" if digest else None
+
+    def _render(self, src: str, dst: str, variant: str) -> None:
+        max_side, quality = VARIANTS[variant]
+        with Image.open(src) as im:
+            im = ImageOps.exif_transpose(im)  # поворот из EXIF, дальше EXIF не нужен
+            if im.mode != "RGB":
+                im = im.convert("RGB")
+            im.thumbnail((max_side, max_side), Image.LANCZOS)
+            # свой временный файл на каждый рендер: прогрев и for_upload идут
+            # в разных потоках, а готовый dst get() отдаёт не проверяя
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=os.path.basename(dst) + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    # без exif/icc_profile в save() метаданные не пишутся
+                    im.save(f, "JPEG", quality=quality, optimize=True, progressive=True)
+                os.replace(tmp, dst)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+
+    def get(self, src: str, variant: str = "tg") -> Optional[str]:
+        """Путь к готовой копии (создаёт при первом обращении) или None."""
+        if not self.enabled or not src:
+            return None
+        name = self.name(src, variant)
+        if not name:
+            return None
+        dst = os.path.join(self.cache_dir, name)
+        if os.path.isfile(dst):
+            return dst
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._render(src, dst, variant)
+            logger.info(f"{src} → {name}: {os.path.getsize(src)} → {os.path.getsize(dst)} байт")
+            return dst
+        except Exception as e:
+            logger.warning(f"Не смог сделать {variant}-копию {src}: {e}")
+            return None
+
+    def for_upload(self, src: str) -> str:
+        """Что заливать в Telegram: облегчённая копия, если она меньше оригинала."""
+        dst = self.get(src, "tg")
+        if dst and os.path.getsize(dst) < os.path.getsize(src):
+            return dst
+        return src
+
+    def warm(self, sources: Iterable[str]) -> int:
+        """Заранее готовим все варианты (вызывать в потоке). Возвращает число копий."""
+        done = 0
+        for src in sources:
+            for variant in VARIANTS:
+                if self.get(src, variant):
+                    done += 1
+        return done
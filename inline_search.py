@@ -0,0 +1,138 @@
+# inline_search.py
+# ------------------------------------------------------------------------------
+# Поиск по каталогу для inline-режима (@бот шопино в любом чате).
+#
+# Индекс строится один раз на каталог (catalog.Entry) и живёт, пока каталог
+# не подменили:
+#   • префиксы — отсортированный список слов названий и подписей; запрос
+#     «вес 9» находит «Весна 90/98» бинарным поиском по каждому слову;
+#   • триграммы названий — на опечатки («шапино» → «Шопино»): доля триграмм
+#     слова запроса, найденных в названии.
+# Ранжированный список на нормализованный запрос кэшируется (LRU), страницы
+# по offset режутся из него — Telegram шлёт тот же запрос при прокрутке.
+# ------------------------------------------------------------------------------
+
+import re
+import bisect
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from catalog import Entry
+
+_TAG_RE = re.compile(r"<[^>]+>")
+_WORD_RE = re.compile(r"[а-яa-z0-9]+")
+
+NAME_PREFIX = 3.0     # слово запроса — начало слова в названии
+TEXT_PREFIX = 1.0     # … в подписи
+NAME_FUZZY = 2.0      # × доля совпавших триграмм названия
+FUZZY_MIN = 0.4       # меньше — не считаем опечаткой
+
+
+def normalize(query: str) -> str:
+    """Регистр, «ё», пунктуация и лишние пробелы не влияют ни на поиск, ни на кэш."""
+    return " ".join(_WORD_RE.findall(query.lower().replace("ё", "е")))
+
+
+def _trigrams(word: str) -> Set[str]:
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class CatalogSearch:
+    def __init__(self, entries: Sequence[Entry], *, page_size: int = 20, cache_size: int = 512):
+        self.entries = tuple(entries)
+        self.page_size = page_size
+        self.cache_size = cache_size
+        words: Dict[Tuple[str, bool], Set[int]] = {}
+        self._grams: Dict[str, Set[int]] = {}
+        for i, entry in enumerate(self.entries):
+            name_words = normalize(entry.name).split()
+            for word in name_words:
+                words.setdefault((word, True), set()).add(i)
+            for word in normalize(_TAG_RE.sub(" ", entry.caption)).split():
+                words.setdefault((word, False), set()).add(i)
+            for word in name_words:
+                for gram in _trigrams(word):
+                    self._grams.setdefault(gram, set()).add(i)
+        self._words = sorted(words)                       # [(слово, из названия?)]
+        self._keys = [w for w, _ in self._words]
+        self._word_docs = [frozenset(words[w]) for w in self._words]
+        self._cache: "OrderedDict[str, Tuple[Entry, ...]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _score_word(self, word: str, scores: List[float]) -> None:
+        best = [0.0] * len(self.entries)
+        lo = bisect.bisect_left(self._keys, word)
+        hi = bisect.bisect_left(self._keys, word + "\uffff", lo)
+        for k in range(lo, hi):
+            weight = NAME_PREFIX if self._words[k][1] else TEXT_PREFIX
+            for i in self._word_docs[k]:
+                best[i] = max(best[i], weight)
+        if len(word) >= 3:
+            grams = _trigrams(word)
+            shared = [0] * len(self.entries)
+            for gram in grams:
+                for i in self._grams.get(gram, ()):
+                    shared[i] += 1
+            for i, n in enumerate(shared):
+                ratio = n / len(grams)
+                if ratio >= FUZZY_MIN:
+                    best[i] = max(best[i], NAME_FUZZY * ratio)
+        for i, value in enumerate(best):
+            scores[i] = scores[i] + value if value and scores[i] >= 0 else -1.0
+
+    def search(self, query: str) -> Tuple[Entry, ...]:
+        """Все подходящие карточки, лучшие первыми; пустой запрос — весь каталог."""
+        key = normalize(query)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        if not key:
+            found = self.entries
+        else:
+            # каждое слово запроса должно за что-то зацепиться
+            scores = [0.0] * len(self.entries)
+            for word in key.split():
+                self._score_word(word, scores)
+            ranked = sorted((i for i, s in enumerate(scores) if s > 0), key=lambda i: -scores[i])
+            found = tuple(self.entries[i] for i in ranked)
+        self._cache[key] = found
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return found
+
+    def page(self, query: str, offset: str = "") -> Tuple[Tuple[Entry, ...], str]:
+        """Страница результатов и next_offset ("" — страниц больше нет)."""
+        start = int(offset) if offset.isdigit() else 0
+        found = self.search(query)
+        end = start + self.page_size
+        return found[start:end], (str(end) if end < len(found) else "")
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "words": len(self._words), "cache": len(self._cache),
+                "hits": self.hits, "misses": self.misses}
+
+
+def build_search(catalog, **kwargs) -> CatalogSearch:
+    """Сначала локации, потом проекты — в порядке каталога."""
+    entries = [catalog.locations[n] for n in catalog.location_names if n in catalog.locations]
+    entries += [catalog.projects[n] for n in catalog.project_names if n in catalog.projects]
+    return CatalogSearch(entries, **kwargs)
+
+
+def deep_link(username: Optional[str], entry: Entry) -> Optional[str]:
+    """Ссылка «открыть карточку в боте»: /start l-<slug> или p-<slug>."""
+    if not username:
+        return None
+    return f"https://t.me/{username}?start={'l' if entry.kind == 'loc' else 'p'}-{entry.slug}"
+
+
+def parse_start(arg: str) -> Optional[Tuple[str, str]]:
+    """Аргумент /start из deep_link → (kind, slug) или None."""
+    tag, _, slug = arg.partition("-")
+    kind = {"l": "loc", "p": "proj"}.get(tag)
+    return (kind, slug) if kind and slug else None
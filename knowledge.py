@@ -0,0 +1,440 @@
+# knowledge.py
+# ------------------------------------------------------------------------------
+# Ответы на вопросы «🤖 Задать вопрос ИИ» из собственных материалов, без
+# внешних сервисов: описания посёлков и проектов (catalog.json) и текст
+# презентаций (static/projects/*/*.pdf).
+#
+# Индексация — отдельный шаг (python knowledge.py build, либо прогрев воркера,
+# если индекса нет или он старше источников): тексты режутся на фрагменты,
+# слова приводятся к основе (стеммер Snowball для русского), строится
+# обратный индекс BM25 и пишется одним бинарным файлом:
+#
+#   заголовок │ смещения терминов │ термины (отсортированы) │ границы постингов
+#   │ постинги: doc (uint32) │ tf (uint16) │ длины фрагментов │ фрагменты (JSON)
+#
+# Файл открывается через mmap при первом вопросе; массивы — np.frombuffer
+# поверх mmap, термин ищется бинарным поиском прямо в файле, текст фрагмента
+# читается только для попавших в ответ. Повторные вопросы (с точностью до
+# основ слов) отвечаются из кэша.
+#
+# pypdf — необязательная зависимость: без него индексируем только каталог.
+# ------------------------------------------------------------------------------
+
+import os
+import re
+import sys
+import json
+import mmap
+import math
+import time
+import struct
+import logging
+import tempfile
+import argparse
+import threading
+from collections import Counter, OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import REGISTRY
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pragma: no cover — без pypdf индексируем только каталог
+    PdfReader = None
+
+logger = logging.getLogger("bot.knowledge")
+
+QUERIES_TOTAL = REGISTRY.counter("bot_knowledge_queries_total", "Вопросы к базе знаний", ("cache",))
+
+
+# ========= СТЕММЕР (Snowball, русский) =========
+_VOWELS = frozenset("аеиоуыэюя")
+_GERUND = (("в", "вши", "вшись"), ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись"))
+_REFLEXIVE = ((), ("ся", "сь"))
+_ADJECTIVE = ((), ("ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+                   "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею"))
+_PARTICIPLE = (("ем", "нн", "вш", "ющ", "щ"), ("ивш", "ывш", "ующ"))
+_VERB = (("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны", "ть", "ешь",
+          "нно"),
+         ("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл", "им", "ым", "ен",
+          "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить", "ыть", "ишь", "ую", "ю"))
+_NOUN = ((), ("а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей", "ой",
+              "ий", "й", "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы", "ь", "ию",
+              "ью", "ю", "ия", "ья", "я"))
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _region(word: str, start: int) -> int:
+    """Позиция после первой пары «гласная + согласная», начиная со start."""
+    for i in range(start + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _cut(word: str, rv: int, groups) -> Optional[str]:
+    """
+    Самое длинное окончание из двух групп внутри RV. Окончания первой группы
+    должны идти после «а»/«я» (они остаются). None — окончания нет.
+    """
+    best, first = "", False
+    for group, endings in enumerate(groups):
+        for end in endings:
+            if len(end) > len(best) and word.endswith(end) and len(word) - len(end) >= rv:
+                best, first = end, group == 0
+    if not best:
+        return None
+    stem = word[:-len(best)]
+    if first and not (len(stem) > rv and stem[-1] in "ая"):
+        return None
+    return stem
+
+
+def stem(word: str) -> str:
+    word = word.lower().replace("ё", "е")
+    rv = next((i + 1 for i, ch in enumerate(word) if ch in _VOWELS), len(word))
+    r2 = _region(word, _region(word, 0))
+    if rv >= len(word):
+        return word
+    # шаг 1
+    w = _cut(word, rv, _GERUND)
+    if w is None:
+        w = _cut(word, rv, _REFLEXIVE) or word
+        adjective = _cut(w, rv, _ADJECTIVE)
+        if adjective is not None:
+            w = _cut(adjective, rv, _PARTICIPLE) or adjective
+        else:
+            w = _cut(w, rv, _VERB) or _cut(w, rv, _NOUN) or w
+    # шаг 2
+    if w.endswith("и") and len(w) - 1 >= rv:
+        w = w[:-1]
+    # шаг 3
+    for end in _DERIVATIONAL:
+        if w.endswith(end) and len(w) - len(end) >= r2:
+            w = w[:-len(end)]
+            break
+    # шаг 4
+    if w.endswith("нн") and len(w) - 2 >= rv:
+        return w[:-1]
+    for end in _SUPERLATIVE:
+        if w.endswith(end) and len(w) - len(end) >= rv:
+            w = w[:-len(end)]
+            return w[:-1] if w.endswith("нн") else w
+    if w.endswith("ь") and len(w) - 1 >= rv:
+        w = w[:-1]
+    return w
+
+
+_WORD_RE = re.compile(r"[а-яёa-z0-9]+")
+STOPWORDS = frozenset("""
+а без более бы был была были было быть в вам вас ведь весь во вот все всего всех вы где да даже для до
+его ее ей ему если есть еще же за здесь и из или им их к как какая какие какой когда кто ли либо между
+меня мне можно мы на над нас не него нее нет ни них но ну о об однако он она они оно от по под при про
+с со сколько так также там те тем то того тоже той только том ты у уже хочу чем что чтобы эта эти это
+этот я расскажите скажите подскажите какое каков какова какие
+""".split())
+
+
+def terms(text: str) -> List[str]:
+    """Текст → основы слов без стоп-слов (и для индекса, и для вопроса)."""
+    out = []
+    for word in _WORD_RE.findall(text.lower().replace("ё", "е")):
+        if word in STOPWORDS:
+            continue
+        out.append(word if word.isdigit() else stem(word))
+    return out
+
+
+# ========= ФРАГМЕНТЫ =========
+def _area(value: float) -> str:
+    return f"{value:g}".replace(".", ",")
+
+
+def catalog_passages(catalog_raw: dict) -> List[dict]:
+    """Посёлки и проекты из catalog.json — по фрагменту на карточку."""
+    docs = []
+    for loc in catalog_raw["locations"]:
+        text = loc["description"]
+        if loc.get("video"):
+            text += " Есть видеообзор посёлка."
+        docs.append({"kind": "loc", "slug": loc["slug"], "title": loc["name"], "text": text, "page": None})
+    for proj in catalog_raw["projects"]:
+        rooms = proj.get("rooms") or []
+        text = proj["description"]
+        if rooms:
+            total = sum(area for _, area in rooms)
+            text += (f" Общая площадь {_area(round(total, 1))} м². Помещения: "
+                     + ", ".join(f"{room.lower()} {_area(area)} м²" for room, area in rooms) + ".")
+        docs.append({"kind": "proj", "slug": proj["slug"], "title": proj["name"], "text": text, "page": None})
+    return docs
+
+
+def pdf_passages(static_dir: str, catalog_raw: dict, min_chars: int = 40) -> List[dict]:
+    """Текст страниц презентаций проектов; страницы-картинки без текста пропускаем."""
+    if PdfReader is None:
+        logger.warning("pypdf не установлен — презентации в индекс не попадут")
+        return []
+    docs = []
+    for proj in catalog_raw["projects"]:
+        rel = f"projects/{proj['slug']}/{proj['slug']}.pdf"
+        path = os.path.join(static_dir, rel)
+        if not os.path.isfile(path):
+            continue
+        try:
+            pages = PdfReader(path).pages
+        except Exception as e:
+            logger.warning(f"Не смог прочитать {rel}: {e}")
+            continue
+        for number, page in enumerate(pages, 1):
+            text = " ".join((page.extract_text() or "").split())
+            if len(text) >= min_chars:
+                docs.append({"kind": "proj", "slug": proj["slug"], "title": f"{proj['name']}, презентация",
+                             "text": text, "page": number})
+    return docs
+
+
+# ========= ФАЙЛ ИНДЕКСА =========
+MAGIC = b"MRHKB\x00\x01\n"
+_HEADER = struct.Struct("<8sIIIfff8Q")   # magic, термины, фрагменты, постинги, avgdl, k1, b, 8 смещений
+
+
+def _align(buf: bytearray) -> int:
+    buf.extend(b"\x00" * (-len(buf) % 8))
+    return len(buf)
+
+
+def build_index(docs: List[dict], path: str, *, k1: float = 1.2, b: float = 0.75) -> dict:
+    """Фрагменты → файл индекса (атомарно, рядом с прежним). Возвращает сводку."""
+    postings = {}
+    lengths = []
+    for doc_id, doc in enumerate(docs):
+        tokens = terms(f"{doc['title']} {doc['text']}")
+        lengths.append(min(len(tokens), 0xFFFF))
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((doc_id, min(tf, 0xFFFF)))
+    vocab = sorted(postings, key=lambda t: t.encode())
+    term_blob = b"".join(t.encode() for t in vocab)
+    term_offs = np.zeros(len(vocab) + 1, dtype="<u4")
+    term_offs[1:] = np.cumsum([len(t.encode()) for t in vocab])
+    term_post = np.zeros(len(vocab) + 1, dtype="<u4")
+    term_post[1:] = np.cumsum([len(postings[t]) for t in vocab])
+    post_doc = np.array([d for t in vocab for d, _ in postings[t]], dtype="<u4")
+    post_tf = np.array([f for t in vocab for _, f in postings[t]], dtype="<u2")
+    doc_blobs = [json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode() for doc in docs]
+    doc_offs = np.zeros(len(docs) + 1, dtype="<u4")
+    doc_offs[1:] = np.cumsum([len(blob) for blob in doc_blobs])
+    avgdl = float(np.mean(lengths)) if lengths else 0.0
+
+    body = bytearray(b"\x00" * _HEADER.size)
+    offsets = []
+    for section in (term_offs.tobytes(), term_blob, term_post.tobytes(), post_doc.tobytes(),
+                    post_tf.tobytes(), np.array(lengths, dtype="<u2").tobytes(), doc_offs.tobytes(),
+                    b"".join(doc_blobs)):
+        offsets.append(_align(body))
+        body.extend(section)
+    body[:_HEADER.size] = _HEADER.pack(MAGIC, len(vocab), len(docs), len(post_doc), avgdl, k1, b, *offsets)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    # своё имя на каждую сборку: прогрев и watch_catalog могут строить одновременно
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    summary = {"docs": len(docs), "terms": len(vocab), "postings": len(post_doc), "bytes": len(body)}
+    logger.info(f"Индекс {path}: {summary}")
+    return summary
+
+
+class _Index:
+    """Открытый файл индекса: всё читается прямо из mmap."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.n_terms, self.n_docs, n_post, self.avgdl, self.k1, self.b,
+         *offs) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: не файл индекса")
+        buf = self._mm
+        self._term_offs = np.frombuffer(buf, "<u4", self.n_terms + 1, offs[0])
+        self._term_blob = offs[1]
+        self._term_post = np.frombuffer(buf, "<u4", self.n_terms + 1, offs[2])
+        self._post_doc = np.frombuffer(buf, "<u4", n_post, offs[3])
+        self._post_tf = np.frombuffer(buf, "<u2", n_post, offs[4])
+        self._doc_len = np.frombuffer(buf, "<u2", self.n_docs, offs[5])
+        self._doc_offs = np.frombuffer(buf, "<u4", self.n_docs + 1, offs[6])
+        self._doc_blob = offs[7]
+        # нормировка длины BM25 — одна на фрагмент, считаем один раз
+        self._norm = self.k1 * (1 - self.b + self.b * self._doc_len / (self.avgdl or 1.0))
+
+    def _term(self, i: int) -> bytes:
+        start = self._term_blob
+        return self._mm[start + int(self._term_offs[i]):start + int(self._term_offs[i + 1])]
+
+    def lookup(self, term: str) -> Optional[int]:
+        key = term.encode()
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.n_terms and self._term(lo) == key else None
+
+    def search(self, query_terms: Iterable[str], k: int) -> List[Tuple[int, float]]:
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        for term in set(query_terms):
+            i = self.lookup(term)
+            if i is None:
+                continue
+            lo, hi = int(self._term_post[i]), int(self._term_post[i + 1])
+            docs, tf = self._post_doc[lo:hi], self._post_tf[lo:hi].astype(np.float64)
+            idf = math.log(1 + (self.n_docs - (hi - lo) + 0.5) / ((hi - lo) + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self._norm[docs])
+        hits = np.flatnonzero(scores)
+        if not len(hits):
+            return []
+        top = hits[np.argsort(-scores[hits], kind="stable")[:k]]
+        return [(int(d), float(scores[d])) for d in top]
+
+    def doc(self, doc_id: int) -> dict:
+        start = self._doc_blob
+        lo, hi = int(self._doc_offs[doc_id]), int(self._doc_offs[doc_id + 1])
+        return json.loads(self._mm[start + lo:start + hi])
+
+
+class KnowledgeBase:
+    """
+    Ленивая обёртка над файлом индекса: открывает при первом вопросе,
+    переоткрывает, когда файл заменили (переиндексация), кэширует ответы.
+    """
+    RECHECK = 5.0  # сек между проверками, не появился ли новый файл
+
+    def __init__(self, path: str, *, cache_size: int = 1024):
+        self.path = path
+        self.cache_size = cache_size
+        self._index: Optional[_Index] = None
+        self._stamp: Tuple[int, int] = (0, 0)
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._answers: "OrderedDict[tuple, List[Tuple[dict, float]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _current(self) -> Optional[_Index]:
+        now = time.monotonic()
+        if self._index is not None and now - self._checked < self.RECHECK:
+            return self._index
+        with self._lock:
+            self._checked = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return self._index
+            stamp = (st.st_mtime_ns, st.st_size)
+            if stamp != self._stamp:
+                # старый индекс не закрываем: по нему может идти поиск в другом
+                # потоке; mmap освободит сборщик мусора вместе с последней ссылкой
+                self._index = _Index(self.path)
+                self._stamp = stamp
+                self._answers.clear()
+                logger.info(f"База знаний {self.path}: {self._index.n_docs} фрагментов, "
+                            f"{self._index.n_terms} терминов")
+            return self._index
+
+    @property
+    def ready(self) -> bool:
+        return self._current() is not None
+
+    def ask(self, question: str, k: int = 3) -> List[Tuple[dict, float]]:
+        """Лучшие фрагменты [(фрагмент, балл)] — пусто, если ничего не нашлось."""
+        index = self._current()
+        query = tuple(sorted(set(terms(question))))
+        if index is None or not query:
+            return []
+        key = (query, k)
+        with self._lock:  # ask зовут из asyncio.to_thread — LRU общий на потоки
+            cached = self._answers.get(key)
+            if cached is not None:
+                self._answers.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is not None:
+            QUERIES_TOTAL.inc("hit")
+            return cached
+        QUERIES_TOTAL.inc("miss")
+        found = [(index.doc(doc_id), score) for doc_id, score in index.search(query, k)]
+        with self._lock:
+            if index is self._index:  # индекс подменили, пока искали, — в кэш не кладём
+                self._answers[key] = found
+                if len(self._answers) > self.cache_size:
+                    self._answers.popitem(last=False)
+        return found
+
+    def stats(self) -> dict:
+        index = self._index
+        return {"loaded": index is not None, "docs": index.n_docs if index else 0,
+                "cache": len(self._answers), "hits": self.hits, "misses": self.misses}
+
+
+# ========= ИНДЕКСАЦИЯ =========
+def sources(static_dir: str, catalog_file: str) -> List[str]:
+    found = [catalog_file]
+    projects = os.path.join(static_dir, "projects")
+    if os.path.isdir(projects):
+        for slug in sorted(os.listdir(projects)):
+            pdf = os.path.join(projects, slug, f"{slug}.pdf")
+            if os.path.isfile(pdf):
+                found.append(pdf)
+    return found
+
+
+def is_stale(path: str, static_dir: str, catalog_file: str) -> bool:
+    """Индекса нет или какой-то источник новее него."""
+    try:
+        built = os.stat(path).st_mtime_ns
+    except OSError:
+        return True
+    return any(os.stat(src).st_mtime_ns > built for src in sources(static_dir, catalog_file))
+
+
+def reindex(path: str, static_dir: str, catalog_file: str) -> dict:
+    with open(catalog_file, encoding="utf-8") as f:
+        catalog_raw = json.load(f)
+    docs = catalog_passages(catalog_raw) + pdf_passages(static_dir, catalog_raw)
+    return build_index(docs, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="База знаний для «🤖 Задать вопрос ИИ»")
+    parser.add_argument("--index", default=os.environ.get("KNOWLEDGE_INDEX", ".cache/knowledge.idx"))
+    parser.add_argument("--static", default="static")
+    parser.add_argument("--catalog", default=None, help="по умолчанию <static>/catalog.json")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("build", help="проиндексировать каталог и презентации")
+    ask = commands.add_parser("ask", help="задать вопрос индексу")
+    ask.add_argument("question", nargs="+")
+    opts = parser.parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO)
+    catalog = opts.catalog or os.path.join(opts.static, "catalog.json")
+    if opts.command == "build":
+        print(reindex(opts.index, opts.static, catalog))
+    else:
+        started = time.perf_counter()
+        found = KnowledgeBase(opts.index).ask(" ".join(opts.question))
+        print(f"{1000 * (time.perf_counter() - started):.2f} мс")
+        for doc, score in found:
+            print(f"{score:.2f}  {doc['title']}: {doc['text'][:160]}")
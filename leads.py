@@ -0,0 +1,317 @@
+# leads.py
+# ------------------------------------------------------------------------------
+# Заявки «👨‍💼 Связаться с менеджером»: пользователь делится номером, бот сразу
+# отвечает «спасибо», а заявка уходит в фоновую очередь.
+#
+#   • хендлер только кладёт заявку в asyncio.Queue — ответ пользователю не
+#     ждёт ни базу, ни менеджеров, ни CRM;
+#   • писатель собирает заявки пачками (до batch штук или linger сек) и пишет
+#     их в SQLite одной транзакцией — там они переживают рестарт;
+#   • доставщик берёт из базы созревшие заявки под аренду (несколько воркеров
+#     gunicorn не отправят одну заявку дважды) и шлёт их во все получатели
+#     параллельно: чат менеджеров, CRM-вебхук, что ещё подключат. Получатель —
+#     просто async-функция (lead_id, lead); у каждой заявки свой список
+#     недоставленных, успешные повторно не шлются;
+#   • не вышло — повтор с экспоненциальной паузой (retry_base … retry_cap),
+#     после max_attempts заявка остаётся в базе с ошибкой: python leads.py list.
+#
+# В CRM уходит JSON с заголовком Idempotency-Key: lead-<id> — повтор после
+# таймаута не заведёт вторую сделку. Локальная замена CRM — /crm у
+# fake_telegram.py.
+# ------------------------------------------------------------------------------
+
+import sys
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+
+from metrics import REGISTRY
+
+logger = logging.getLogger("bot.leads")
+
+LEADS_TOTAL = REGISTRY.counter("bot_leads_total", "Доставка заявок по получателю и исходу", ("target", "outcome"))
+
+Target = Callable[[int, dict], Awaitable[None]]
+
+
+class LeadStore:
+    """Заявки и что по каждой осталось доставить (SQLite, WAL — общий для воркеров)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # todo — недоставленные получатели через запятую; '' — заявка разослана
+        self._conn.execute("CREATE TABLE IF NOT EXISTS leads ("
+                           "lead_id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, "
+                           "chat_id INTEGER, payload TEXT NOT NULL, todo TEXT NOT NULL, "
+                           "attempts INTEGER NOT NULL DEFAULT 0, next_try REAL NOT NULL, error TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS leads_due ON leads(next_try) WHERE todo != ''")
+
+    def add_many(self, leads: Iterable[dict], targets: Iterable[str]) -> List[int]:
+        todo = ",".join(targets)
+        now = time.time()
+        ids = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for lead in leads:
+                    cur = self._conn.execute(
+                        "INSERT INTO leads(created, chat_id, payload, todo, next_try) VALUES (?, ?, ?, ?, ?)",
+                        (lead.get("created", now), lead.get("chat_id"), json.dumps(lead, ensure_ascii=False),
+                         todo, now),
+                    )
+                    ids.append(cur.lastrowid)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def claim(self, limit: int, lease: float, max_attempts: int) -> List[Tuple[int, dict, List[str], int]]:
+        """Созревшие заявки → [(lead_id, заявка, кому осталось, попыток)]; на lease сек они наши."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT lead_id, payload, todo, attempts FROM leads "
+                    "WHERE todo != '' AND next_try <= ? AND attempts < ? ORDER BY next_try LIMIT ?",
+                    (now, max_attempts, limit),
+                ).fetchall()
+                self._conn.executemany("UPDATE leads SET next_try = ? WHERE lead_id = ?",
+                                       [(now + lease, row[0]) for row in rows])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [(lead_id, json.loads(payload), todo.split(","), attempts)
+                for lead_id, payload, todo, attempts in rows]
+
+    def settle(self, lead_id: int, left: List[str], error: Optional[str], retry_at: float) -> None:
+        """Итог попытки: кому ещё не доставлено (пусто — готово) и когда повторить."""
+        with self._lock:
+            if left:
+                self._conn.execute("UPDATE leads SET todo = ?, attempts = attempts + 1, next_try = ?, error = ? "
+                                   "WHERE lead_id = ?", (",".join(left), retry_at, error, lead_id))
+            else:
+                self._conn.execute("UPDATE leads SET todo = '', error = NULL WHERE lead_id = ?", (lead_id,))
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT lead_id, created, payload, todo, attempts, error FROM leads ORDER BY lead_id DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [{"lead_id": r[0], "created": r[1], **json.loads(r[2]), "todo": r[3], "attempts": r[4],
+                 "error": r[5]} for r in rows]
+
+    def stats(self, max_attempts: int) -> dict:
+        with self._lock:
+            total, pending, failed = self._conn.execute(
+                "SELECT COUNT(*), COUNT(*) FILTER (WHERE todo != '' AND attempts < ?), "
+                "COUNT(*) FILTER (WHERE todo != '' AND attempts >= ?) FROM leads",
+                (max_attempts, max_attempts),
+            ).fetchone()
+        return {"total": total, "pending": pending, "failed": failed}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class LeadQueue:
+    def __init__(self, store: LeadStore, targets: Dict[str, Target], *, batch: int = 50, linger: float = 0.2,
+                 concurrency: int = 8, timeout: float = 15.0, lease: float = 60.0, poll: float = 10.0,
+                 retry_base: float = 5.0, retry_cap: float = 600.0, max_attempts: int = 10):
+        self.store = store
+        self.targets = targets
+        self.batch = batch
+        self.concurrency = concurrency
+        self.linger = linger
+        self.timeout = timeout
+        self.lease = max(lease, timeout * 2)
+        self.poll = poll
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.max_attempts = max_attempts
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._wake = asyncio.Event()
+        self._batch: List[dict] = []
+        self._writing: Optional[Tuple[List[dict], asyncio.Future]] = None
+        self.accepted = 0
+        self.written = 0
+
+    def submit(self, lead: dict) -> None:
+        """Из хендлера: мгновенно, без ввода-вывода."""
+        lead.setdefault("created", time.time())
+        self._queue.put_nowait(lead)
+        self.accepted += 1
+
+    async def run(self) -> None:
+        writer = asyncio.create_task(self._write_loop())
+        try:
+            await self._deliver_loop()
+        finally:
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+            await self._save_rest()
+
+    async def _save_rest(self) -> None:
+        """Остановка воркера: всё принятое — в базу, доставит следующий запуск."""
+        pending, self._batch = self._batch, []
+        if self._writing is not None:
+            batch, write = self._writing
+            self._writing = None
+            try:
+                await write  # пачка уже пишется — дожидаемся, а не пишем второй раз
+            except Exception:
+                pending = batch + pending
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        if pending:
+            await asyncio.to_thread(self.store.add_many, pending, self.targets)
+            self.written += len(pending)
+            logger.info(f"Заявки: {len(pending)} сохранены при остановке")
+
+    async def _write(self, batch: List[dict]) -> None:
+        await asyncio.to_thread(self.store.add_many, batch, self.targets)
+        self.written += len(batch)
+        self._wake.set()
+
+    async def _write_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            # копим в self._batch, а не в локальной переменной: при остановке её сохранит _save_rest
+            self._batch = [await self._queue.get()]
+            deadline = loop.time() + self.linger
+            while len(self._batch) < self.batch:
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            batch, self._batch = self._batch, []
+            self._writing = (batch, asyncio.ensure_future(self._write(batch)))
+            try:
+                await asyncio.shield(self._writing[1])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Заявки: не записал пачку из {len(batch)}, повторю")
+                for lead in batch:
+                    self._queue.put_nowait(lead)
+                self._writing = None
+                await asyncio.sleep(1.0)
+                continue
+            self._writing = None
+
+    async def _deliver_loop(self) -> None:
+        # не больше concurrency доставок в полёте; освободился слот — сразу берём следующую
+        inflight = set()
+
+        def done(task: asyncio.Task) -> None:
+            inflight.discard(task)
+            self._wake.set()
+        try:
+            while True:
+                self._wake.clear()
+                free = self.concurrency - len(inflight)
+                try:
+                    claimed = await asyncio.to_thread(self.store.claim, free, self.lease, self.max_attempts) \
+                        if free else []
+                except Exception:
+                    logger.exception("Заявки: не прочитал очередь доставки")
+                    claimed = []
+                for item in claimed:
+                    task = asyncio.create_task(self._deliver(*item))
+                    inflight.add(task)
+                    task.add_done_callback(done)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # брошенные доставки вернутся по истечении аренды; CRM отсеет повтор по Idempotency-Key
+            for task in inflight:
+                task.cancel()
+            await asyncio.gather(*inflight, return_exceptions=True)
+
+    async def _send(self, name: str, lead_id: int, lead: dict) -> Optional[str]:
+        target = self.targets.get(name)
+        if target is None:
+            return None  # получателя отключили — не держим заявку ради него
+        try:
+            await asyncio.wait_for(target(lead_id, lead), self.timeout)
+        except Exception as e:
+            LEADS_TOTAL.inc(name, "error")
+            detail = str(e).splitlines()[0] if str(e) else ""
+            return f"{name}: {type(e).__name__} {detail}".strip()[:500]
+        LEADS_TOTAL.inc(name, "ok")
+        return None
+
+    async def _deliver(self, lead_id: int, lead: dict, todo: List[str], attempts: int) -> None:
+        errors = await asyncio.gather(*(self._send(name, lead_id, lead) for name in todo))
+        left = [name for name, error in zip(todo, errors) if error]
+        error = "; ".join(e for e in errors if e) or None
+        # пауза растёт с каждой попыткой; разброс — чтобы воркеры не били в CRM хором
+        delay = min(self.retry_cap, self.retry_base * 2 ** attempts) * random.uniform(0.8, 1.2)
+        await asyncio.to_thread(self.store.settle, lead_id, left, error, time.time() + delay)
+        if left and attempts + 1 >= self.max_attempts:
+            logger.error(f"Заявка #{lead_id} не доставлена ({', '.join(left)}) после {attempts + 1} попыток: {error}")
+        elif left:
+            logger.warning(f"Заявка #{lead_id}: повтор через {delay:.0f}с — {error}")
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "accepted": self.accepted, "written": self.written,
+                "targets": sorted(self.targets), **self.store.stats(self.max_attempts)}
+
+
+class CrmWebhook:
+    """Получатель-CRM: POST JSON заявки на url; не 2xx — ошибка (будет повтор)."""
+
+    def __init__(self, url: str, *, token: str = "", timeout: float = 10.0,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+        self._client = client
+
+    async def __call__(self, lead_id: int, lead: dict) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        headers = {"Idempotency-Key": f"lead-{lead_id}"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        resp = await self._client.post(self.url, json={"id": lead_id, **lead}, headers=headers)
+        resp.raise_for_status()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заявки «Связаться с менеджером»")
+    parser.add_argument("--db", default=".leads.sqlite3")
+    parser.add_argument("--max-attempts", type=int, default=10)
+    commands = parser.add_subparsers(dest="command", required=True)
+    listing = commands.add_parser("list", help="последние заявки и что по ним не доставлено")
+    listing.add_argument("--limit", type=int, default=20)
+    opts = parser.parse_args(sys.argv[1:])
+    store = LeadStore(opts.db)
+    print(store.stats(opts.max_attempts))
+    for lead in store.recent(opts.limit):
+        state = "✅" if not lead["todo"] else f"⏳ {lead['todo']} ({lead['attempts']}): {lead['error'] or ''}"
+        print(f"#{lead['lead_id']} {time.strftime('%d.%m %H:%M', time.localtime(lead['created']))} "
+              f"{lead.get('name', '')} {lead.get('phone', '')} — {state}")
@@ -0,0 +1,337 @@
+# loadtest.py
+# ------------------------------------------------------------------------------
+# Запись и воспроизведение вебхуков для нагрузочных прогонов.
+#
+# Запись: RECORD_UPDATES=recordings/updates.jsonl — бот дописывает каждый
+# принятый апдейт одной строкой JSON, обезличенным: id пользователей и чатов
+# заменены стабильными псевдо-id, имена/username/телефоны убраны, свободный
+# текст замаскирован (кнопки меню и команды оставлены как есть).
+#
+# Прогон (бот смотрит в fake_telegram.py через TG_API_BASE):
+#   python fake_telegram.py --port 8081 --p429 0.01 &
+#   TG_API_BASE=http://127.0.0.1:8081/bot python bot.py &
+#   python loadtest.py replay recordings/updates.jsonl --url http://127.0.0.1:10000 \
+#       --rate 50 --concurrency 20 --users 200
+# Нет записи — сгенерировать типовые сессии по каталогу:
+#   python loadtest.py synth --users 100 > recordings/synthetic.jsonl
+#
+# Отчёт: пропускная способность, p50/p95/p99 ответа вебхука, доля ошибок
+# по кодам, время «дожать» очередь и статистика бота/фейкового API.
+# ------------------------------------------------------------------------------
+
+import os
+import sys
+import copy
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import itertools
+from collections import Counter
+from typing import Iterable, List, Optional
+
+import httpx
+
+from callbacks import LOC, LOCS, MENU, PROJ, encode
+
+# Что оставляем в тексте как есть: команды и кнопки главного меню
+KNOWN_TEXTS = frozenset({
+    "📍 Локации домов", "🏗️ Проекты", "🧮 Расчёт стоимости",
+    "🤖 Задать вопрос ИИ", "👨‍💼 Связаться с менеджером",
+})
+_PERSONAL = ("first_name", "last_name", "username", "phone_number", "language_code")
+# фото и entities оставляем: без bot_command /start не дойдёт до cmd_start,
+# без photo у карточки не будет правки на месте
+_DROP = ("contact", "location", "venue", "document", "voice", "video")
+
+
+# ========= ЗАПИСЬ =========
+def _pseudo_id(value: int, salt: str) -> int:
+    digest = hashlib.sha256(f"{salt}:{value}".encode()).digest()
+    pseudo = int.from_bytes(digest[:4], "big") % 900_000_000 + 100_000_000
+    return -pseudo if value < 0 else pseudo
+
+
+def _mask_text(text: str) -> str:
+    if text in KNOWN_TEXTS or text.startswith("/"):
+        return text
+    return "x" * len(text)
+
+
+def anonymize(update: dict, salt: str = "") -> dict:
+    """Копия апдейта без персональных данных; одинаковые id → одинаковые псевдо-id."""
+    data = copy.deepcopy(update)
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key in _DROP:
+                node.pop(key, None)
+            if node.get("type") == "text_mention":
+                node.pop("user", None)
+            for key in _PERSONAL:
+                if key in node:
+                    node[key] = "User" if key == "first_name" else None
+            for key in [k for k, v in node.items() if v is None]:
+                del node[key]
+            if isinstance(node.get("id"), int) and ("is_bot" in node or "type" in node):
+                node["id"] = _pseudo_id(node["id"], salt)  # User или Chat
+            for key in ("text", "caption"):
+                if isinstance(node.get(key), str):
+                    node[key] = _mask_text(node[key])
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(data)
+    return data
+
+
+class UpdateRecorder:
+    def __init__(self, path: str, salt: str = ""):
+        self.path = path
+        self.salt = salt
+        self.recorded = 0
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def record(self, update: dict) -> None:
+        line = json.dumps(anonymize(update, self.salt), ensure_ascii=False, separators=(",", ":"))
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        self.recorded += 1
+
+
+def load_updates(path: str) -> List[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ========= СИНТЕТИКА =========
+def synthetic_sessions(users: int, locations: Iterable[str], projects: Iterable[str],
+                       seed: int = 1) -> List[dict]:
+    """
+    Типовой путь пользователя: /start → локации → карточка → назад → проекты →
+    карточка. locations/projects — slug из каталога, кнопки как у настоящих.
+    """
+    rnd = random.Random(seed)
+    locations, projects = list(locations), list(projects)
+    message_ids = itertools.count(1)
+    out = []
+
+    def user(uid):
+        return {"id": uid, "is_bot": False, "first_name": "User"}
+
+    def chat(uid):
+        return {"id": uid, "type": "private"}
+
+    def text(uid, value):
+        message = {"message_id": next(message_ids), "date": 0, "text": value,
+                   "chat": chat(uid), "from": user(uid)}
+        if value.startswith("/"):
+            command = value.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"message": message}
+
+    def click(uid, value, message_id, photo=False):
+        message = {"message_id": message_id, "date": 0, "chat": chat(uid)}
+        if photo:   # клик по карточке — её правят на месте
+            message.update(caption="Локации:", photo=[{"file_id": "PHOTO", "file_unique_id": "PHOTO",
+                                                       "width": 1280, "height": 853}])
+        else:       # клик по текстовому списку — приходит новая карточка
+            message["text"] = "Локации:"
+        return {"callback_query": {"id": str(next(message_ids)), "chat_instance": str(uid), "data": value,
+                                   "from": user(uid), "message": message}}
+
+    for n in range(users):
+        uid = 100_000_000 + n
+        listing, card = next(message_ids), next(message_ids)
+        steps = [text(uid, "/start"), text(uid, "📍 Локации домов")]
+        for i, slug in enumerate(rnd.sample(locations, k=min(3, len(locations)))):
+            steps += [click(uid, encode(LOC, slug), listing if i == 0 else card, photo=i > 0),
+                      click(uid, encode(LOCS), card, photo=True)]
+        steps.append(text(uid, "🏗️ Проекты"))
+        steps += [click(uid, encode(PROJ, rnd.choice(projects)), listing),
+                  click(uid, encode(MENU), card, photo=True)]
+        out.extend(steps)
+    return [{"update_id": i + 1, **u} for i, u in enumerate(out)]
+
+
+# ========= ВОСПРОИЗВЕДЕНИЕ =========
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(q / 100 * len(ordered)) - 1  # nearest-rank
+    return ordered[max(0, min(len(ordered) - 1, rank))]
+
+
+def _remap(update: dict, offset: int) -> dict:
+    """Сдвинуть id пользователя/чата — из одной записи получаем «других» людей."""
+    if not offset:
+        return update
+    data = copy.deepcopy(update)
+
+    def walk(node):
+        if isinstance(node, dict):
+            if isinstance(node.get("id"), int) and ("is_bot" in node or "type" in node):
+                node["id"] += offset if node["id"] > 0 else -offset
+            for value in node.values():
+                walk(value)
+        elif isinstance(node, list):
+            for value in node:
+                walk(value)
+
+    walk(data)
+    return data
+
+
+def report(latencies: List[float], statuses: Counter, elapsed: float) -> dict:
+    sent = sum(statuses.values())
+    errors = sum(n for code, n in statuses.items() if code != 200)
+    return {
+        "sent": sent,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(sent / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+        "max_ms": round(1000 * max(latencies), 2) if latencies else 0.0,
+        "error_rate": round(errors / sent, 4) if sent else 0.0,
+        "statuses": {str(code): n for code, n in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+    }
+
+
+async def replay(updates: List[dict], url: str, *, rate: float = 0.0, concurrency: int = 10,
+                 loops: int = 1, users: int = 0, client: Optional[httpx.AsyncClient] = None,
+                 stats_token: str = "") -> dict:
+    """
+    Отправить апдейты на {url}/webhook с темпом rate/с (0 — без ограничения)
+    и не больше concurrency одновременно. update_id переписываются подряд,
+    чтобы защита от повторов не отбросила прогон; loops>1 с users>0 каждый
+    круг приходит от новых пользователей. stats_token — для /stats бота.
+    """
+    own_client = client is None
+    client = client or httpx.AsyncClient(timeout=30.0)
+    base_id = random.randint(10**8, 10**9)
+    slots = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    tasks = []
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        seq = 0
+        for round_no in range(loops):
+            offset = round_no * users
+            for update in updates:
+                if rate > 0:
+                    delay = started + seq / rate - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                body = dict(_remap(update, offset), update_id=base_id + seq)
+                seq += 1
+                await slots.acquire()
+                tasks.append(asyncio.create_task(_post(client, f"{url}/webhook", body, slots,
+                                                       latencies, statuses)))
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - started
+        result = report(latencies, statuses, elapsed)
+        result["drain_s"] = await _drain(client, url, stats_token)
+        return result
+    finally:
+        if own_client:
+            await client.aclose()
+
+
+async def _post(client, url, body, slots, latencies, statuses) -> None:
+    started = time.perf_counter()
+    try:
+        resp = await client.post(url, json=body)
+        statuses[resp.status_code] += 1
+    except httpx.HTTPError as e:
+        statuses[type(e).__name__] += 1
+    finally:
+        latencies.append(time.perf_counter() - started)
+        slots.release()
+
+
+def _auth(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+async def _drain(client, url, token: str = "", timeout: float = 120.0) -> Optional[float]:
+    """Сколько бот ещё дорабатывал принятые апдейты (по /stats), сек."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            stats = (await client.get(f"{url}/stats", headers=_auth(token))).json()
+        except (httpx.HTTPError, ValueError):
+            return None
+        if stats.get("scheduler", {}).get("pending", 0) == 0:
+            return round(time.perf_counter() - started, 3)
+        await asyncio.sleep(0.05)
+    return None
+
+
+async def _collect(url: str, fake_api: Optional[str], result: dict, token: str = "") -> dict:
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        try:
+            result["bot"] = (await client.get(f"{url}/stats", headers=_auth(token))).json()
+        except (httpx.HTTPError, ValueError):
+            pass
+        if fake_api:
+            try:
+                result["fake_api"] = (await client.get(f"{fake_api}/stats")).json()
+            except (httpx.HTTPError, ValueError):
+                pass
+    return result
+
+
+def _main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Запись/воспроизведение вебхуков MR.House бота")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    rp = sub.add_parser("replay", help="прогнать JSONL на /webhook")
+    rp.add_argument("file")
+    rp.add_argument("--url", default="http://127.0.0.1:10000", help="адрес бота (без /webhook)")
+    rp.add_argument("--rate", type=float, default=0.0, help="апдейтов в секунду, 0 — без ограничения")
+    rp.add_argument("--concurrency", type=int, default=10)
+    rp.add_argument("--loops", type=int, default=1)
+    rp.add_argument("--users", type=int, default=0, help="сдвиг id на круг: loops × новых пользователей")
+    rp.add_argument("--fake-api", default="http://127.0.0.1:8081", help="fake_telegram.py для статистики")
+    rp.add_argument("--stats-token", default=os.environ.get("STATS_TOKEN", os.environ.get("WEBHOOK_SECRET", "")),
+                    help="токен /stats бота (по умолчанию STATS_TOKEN или WEBHOOK_SECRET)")
+
+    sp = sub.add_parser("synth", help="сгенерировать типовые сессии по каталогу")
+    sp.add_argument("--users", type=int, default=50)
+    sp.add_argument("--catalog", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                      "static", "catalog.json"))
+    sp.add_argument("--seed", type=int, default=1)
+
+    opts = parser.parse_args(argv)
+    if opts.cmd == "synth":
+        with open(opts.catalog, encoding="utf-8") as f:
+            raw = json.load(f)
+        for update in synthetic_sessions(opts.users, [x["slug"] for x in raw["locations"]],
+                                         [x["slug"] for x in raw["projects"]], seed=opts.seed):
+            print(json.dumps(update, ensure_ascii=False, separators=(",", ":")))
+        return 0
+
+    updates = load_updates(opts.file)
+    url = opts.url.rstrip("/")
+    result = asyncio.run(replay(updates, url, rate=opts.rate, concurrency=opts.concurrency,
+                                loops=opts.loops, users=opts.users, stats_token=opts.stats_token))
+    result = asyncio.run(_collect(url, opts.fake_api, result, opts.stats_token))
+    json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+    return 0 if result["error_rate"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
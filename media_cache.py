@@ -0,0 +1,141 @@
+# media_cache.py
+# ------------------------------------------------------------------------------
+# Кэш Telegram file_id для локальных картинок (локации, проекты, баннер).
+#
+# После первой загрузки файла Telegram возвращает file_id — дальше отправляем
+# его вместо повторной заливки мегабайтов. Ключ = путь к файлу + sha256
+# содержимого: поменяли картинку → новый ключ → файл загрузится заново.
+# Кэш хранится в JSON-файле и переживает рестарт.
+# ------------------------------------------------------------------------------
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger("bot.media_cache")
+
+
+def file_digest(path: str) -> str:
+    """sha256 содержимого файла (hex)."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MediaCache:
+    """Хранилище file_id: «путь#хэш» → file_id."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._ids: Dict[str, str] = {}
+        # path → (mtime_ns, size, digest), чтобы не хэшировать файл на каждый показ
+        self._digests: Dict[str, Tuple[int, int, str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    # ---------- ключи ----------
+    def digest(self, local_path: str) -> Optional[str]:
+        """sha256 файла; пересчитывается, только если поменялись mtime/размер."""
+        try:
+            st = os.stat(local_path)
+        except OSError:
+            return None
+        memo = self._digests.get(local_path)
+        if memo and memo[0] == st.st_mtime_ns and memo[1] == st.st_size:
+            return memo[2]
+        digest = file_digest(local_path)
+        self._digests[local_path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def known(self, local_path: str) -> bool:
+        """Хэш уже посчитан и файл с тех пор не менялся — digest() ответит без чтения файла."""
+        try:
+            st = os.stat(local_path)
+        except OSError:
+            return True  # файла нет — digest() и так вернёт None сразу
+        memo = self._digests.get(local_path)
+        return bool(memo) and memo[0] == st.st_mtime_ns and memo[1] == st.st_size
+
+    def prime(self, paths: Iterable[str]) -> int:
+        """Хэши всех файлов заранее (вызывать в потоке): первый показ не читает файл в цикле событий."""
+        return sum(self.digest(p) is not None for p in paths)
+
+    def key(self, local_path: str) -> Optional[str]:
+        digest = self.digest(local_path)
+        return f"{local_path}#{digest}" if digest else None
+
+    # ---------- API ----------
+    def get(self, local_path: str) -> Optional[str]:
+        key = self.key(local_path)
+        file_id = self._ids.get(key) if key else None
+        if file_id:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return file_id
+
+    def put(self, local_path: str, file_id: str) -> None:
+        key = self.key(local_path)
+        if not key or self._ids.get(key) == file_id:
+            return
+        with self._lock:
+            self._merge_disk()
+            # старые версии того же файла больше не нужны
+            prefix = f"{local_path}#"
+            for k in [k for k in self._ids if k.startswith(prefix) and k != key]:
+                del self._ids[k]
+            self._ids[key] = file_id
+            self._write()
+
+    def forget(self, local_path: str) -> None:
+        """Убираем file_id, который Telegram отверг."""
+        prefix = f"{local_path}#"
+        with self._lock:
+            stale = [k for k in self._ids if k.startswith(prefix)]
+            if not stale:
+                return
+            for k in stale:
+                del self._ids[k]
+            self._write()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # ---------- диск ----------
+    def _read_disk(self) -> Dict[str, str]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {str(k): str(v) for k, v in data.items()} if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Не смог прочитать кэш медиа {self.path}: {e}")
+            return {}
+
+    def _load(self) -> None:
+        self._ids = self._read_disk()
+        logger.info(f"Кэш медиа: {len(self._ids)} file_id из {self.path}")
+
+    def _merge_disk(self) -> None:
+        # Несколько воркеров пишут в один файл: подмешиваем чужие записи.
+        # Потеря записи = лишняя загрузка, не ошибка.
+        for k, v in self._read_disk().items():
+            self._ids.setdefault(k, v)
+
+    def _write(self) -> None:
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._ids, f, ensure_ascii=False, indent=0)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.warning(f"Не смог сохранить кэш медиа {self.path}: {e}")
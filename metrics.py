@@ -0,0 +1,195 @@
+# metrics.py
+# ------------------------------------------------------------------------------
+# Метрики в текстовом формате Prometheus (/metrics) без внешних зависимостей.
+# Счётчики (counter), текущие значения (gauge) и гистограммы с метками; запись — это поиск
+# в dict и bisect, без блокировок (всё живёт в одном event loop).
+#
+# Что меряем (имена метрик см. ниже):
+#   • хендлеры бота — время, исход, сколько выполняется прямо сейчас;
+#   • каждый вызов Bot API — время по методу и пулу, статус;
+#   • ожидание лимитера исходящих и очереди апдейтов;
+#   • откуда ушло фото: file_id / локальная заливка / URL / текст без фото.
+# ------------------------------------------------------------------------------
+
+import time
+import functools
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from tracing import span
+
+# Границы корзин по умолчанию (сек): от 5 мс до 30 с
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}"
+                                 for k, v in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    """Значение задаётся вручную (set/inc/dec) или функцией при каждом сборе."""
+    kind = "gauge"
+
+    def __init__(self, *args, fn: Callable[[], Iterable[Tuple[Tuple, float]]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, *labels) -> None:
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        values = dict(self._values)
+        if self._fn is not None:
+            values.update(self._fn())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}"
+                                 for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # метки → [счётчики по корзинам..., сумма, количество]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0] * (len(self.buckets) + 2)
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    def count(self, *labels) -> int:
+        row = self._values.get(labels)
+        return row[-1] if row else 0
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for key, row in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                le = 'le="%s"' % _num(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {row[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(row[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {row[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric) -> _Metric:
+        # повторный импорт модуля (тесты, перезагрузка) получает ту же метрику
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (), fn=None) -> Gauge:
+        return self._add(Gauge(name, help, labelnames, fn=fn))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets=buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ========= ХЕНДЛЕРЫ =========
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Время работы хендлера", ("handler",))
+HANDLER_TOTAL = REGISTRY.counter("bot_handler_total", "Вызовы хендлеров по исходу", ("handler", "outcome"))
+HANDLER_IN_FLIGHT = REGISTRY.gauge("bot_handler_in_flight", "Хендлеры, выполняющиеся сейчас", ("handler",))
+
+
+def instrument(name: str):
+    """Декоратор async-хендлера: время, исход (ok/error), in-flight и шаг трейса."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            HANDLER_IN_FLIGHT.inc(name)
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                with span(name):
+                    result = await fn(*args, **kwargs)
+                outcome = "ok"
+                return result
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+                HANDLER_TOTAL.inc(name, outcome)
+                HANDLER_IN_FLIGHT.dec(name)
+        return wrapper
+    return wrap
@@ -0,0 +1,190 @@
+# ratelimit.py
+# ------------------------------------------------------------------------------
+# Ограничитель исходящих вызовов Bot API. Подключается в Application через
+# .rate_limiter(...) и прозрачно оборачивает каждый запрос бота — хендлеры
+# менять не нужно.
+#
+#   • token bucket на весь бот (~30 сообщений/с) и на каждый чат
+#     (~1/с с небольшим запасом на «фото + сообщение»; в группах 20/мин);
+#   • RetryAfter (429): ждём retry_after + джиттер и повторяем тот же запрос,
+#     а не уходим в fallback с новым запросом;
+#   • приоритет: интерактивные ответы идут раньше массовых рассылок
+#     (рассылка передаёт rate_limit_args={"priority": "bulk"}).
+# ------------------------------------------------------------------------------
+
+import time
+import random
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Coroutine, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import REGISTRY
+from tracing import span
+
+logger = logging.getLogger("bot.ratelimit")
+
+INTERACTIVE, BULK = 0, 1
+_PRIORITY_NAMES = ("interactive", "bulk")
+
+WAIT_SECONDS = REGISTRY.histogram("bot_outbound_wait_seconds", "Ожидание лимитера исходящих", ("priority",))
+RETRIES_TOTAL = REGISTRY.counter("bot_outbound_retries_total", "Повторы после 429", ("method",))
+
+# Служебные методы — не сообщения, лимиты на них не тратим
+EXEMPT_ENDPOINTS = frozenset({
+    "getMe", "getWebhookInfo", "setWebhook", "deleteWebhook", "getFile",
+    "answerCallbackQuery", "answerInlineQuery", "getUpdates", "close", "logOut",
+})
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до ближайшего жетона (0 — можно сейчас)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class OutboundLimiter(BaseRateLimiter[Dict[str, Any]]):
+    def __init__(self, *, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, max_retries: int = 3, max_chats: int = 10000):
+        self.max_retries = max_retries
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_chats = max_chats
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        # метрики
+        self.waiting = [0, 0]          # сколько запросов сейчас ждут: [interactive, bulk]
+        self._contending = 0           # интерактивные, ждущие именно общего лимита
+        self.sent = 0
+        self.retries = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            bucket = TokenBucket(self.group_rate, 1) if is_group \
+                else TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat: Optional[TokenBucket], priority: int) -> None:
+        self.waiting[priority] += 1
+        try:
+            while True:
+                now = time.monotonic()
+                if chat is not None:
+                    d = chat.delay(now)
+                    if d > 0:
+                        await asyncio.sleep(d)
+                        continue
+                # массовые пропускают вперёд интерактивные, ждущие общего лимита
+                if priority == BULK and self._contending:
+                    await asyncio.sleep(1 / self._global.rate)
+                    continue
+                d = self._global.delay(now)
+                if d > 0:
+                    if priority == INTERACTIVE:
+                        self._contending += 1
+                    try:
+                        await asyncio.sleep(d)
+                    finally:
+                        if priority == INTERACTIVE:
+                            self._contending -= 1
+                    continue
+                self._global.take()
+                if chat is not None:
+                    chat.take()
+                return
+        finally:
+            self.waiting[priority] -= 1
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ):
+        if endpoint in EXEMPT_ENDPOINTS:
+            return await callback(*args, **kwargs)
+
+        opts = rate_limit_args or {}
+        priority = BULK if opts.get("priority") == "bulk" else INTERACTIVE
+        max_retries = opts.get("max_retries", self.max_retries)
+        chat_id = data.get("chat_id")
+        chat = self._chat_bucket(chat_id) if chat_id is not None else None
+
+        for attempt in range(max_retries + 1):
+            started = time.monotonic()
+            with span("ratelimit", attempt=attempt):
+                await self._acquire(chat, priority)
+            waited = time.monotonic() - started
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            WAIT_SECONDS.observe(waited, _PRIORITY_NAMES[priority])
+            try:
+                result = await callback(*args, **kwargs)
+                self.sent += 1
+                return result
+            except RetryAfter as exc:
+                if attempt == max_retries:
+                    logger.warning(f"{endpoint}: 429 после {max_retries} повторов, сдаёмся")
+                    raise
+                self.retries += 1
+                RETRIES_TOTAL.inc(endpoint)
+                pause = float(exc.retry_after) + random.uniform(0.1, 0.5) * (attempt + 1)
+                logger.info(f"{endpoint}: 429, повтор через {pause:.1f}с (chat={chat_id})")
+                # блокируем тот уровень, который упёрся в лимит
+                (chat or self._global).block(pause)
+        return None
+
+    def stats(self) -> dict:
+        total = self.sent + self.retries
+        return {
+            "waiting_interactive": self.waiting[INTERACTIVE],
+            "waiting_bulk": self.waiting[BULK],
+            "sent": self.sent,
+            "retries": self.retries,
+            "tracked_chats": len(self._chats),
+            "wait_avg_ms": round(1000 * self.wait_total / total, 2) if total else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max, 2),
+        }
@@ -0,0 +1,136 @@
+# scheduler.py
+# ------------------------------------------------------------------------------
+# Планировщик апдейтов: внутри одного чата — строго по очереди (машина
+# состояний в user_data не ломается при двойном клике), разные чаты —
+# параллельно на ограниченном пуле воркеров. Очередь ограничена: при
+# переполнении submit() возвращает False, и вебхук отвечает 503 — Telegram
+# пришлёт апдейт позже.
+# ------------------------------------------------------------------------------
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from metrics import REGISTRY
+
+logger = logging.getLogger("bot.scheduler")
+
+QUEUE_SECONDS = REGISTRY.histogram("bot_update_queue_seconds", "Апдейт ждал свободного воркера")
+
+
+class ChatScheduler:
+    def __init__(self, handler: Callable[[Any], Awaitable[None]], *,
+                 workers: int = 16, max_pending: int = 1000):
+        self._handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        # чат → очередь его апдейтов; чат есть в словаре, пока он в работе или ждёт
+        self._queues: Dict[Hashable, Deque[Tuple[float, Any]]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._idle: Optional[asyncio.Event] = None
+        # метрики
+        self.pending = 0
+        self.busy = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # ---------- жизненный цикл ----------
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        for k in list(self._queues):
+            self._ready.put_nowait(k)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"chat-worker-{i}")
+                       for i in range(self.workers)]
+        logger.info(f"Планировщик апдейтов: {self.workers} воркеров, очередь до {self.max_pending}")
+
+    async def stop(self, timeout: float = 25.0) -> None:
+        """Дорабатываем принятые апдейты (не дольше timeout) и гасим воркеры."""
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Планировщик: не дождались {self.pending} апдейтов")
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ---------- приём ----------
+    def submit(self, key: Hashable, item: Any) -> bool:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            return False
+        if not self._tasks:
+            self.start()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ready.put_nowait(key)
+        queue.append((time.monotonic(), item))
+        self.pending += 1
+        self.accepted += 1
+        self._idle.clear()
+        return True
+
+    # ---------- обработка ----------
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            enqueued_at, item = queue.popleft()
+            waited = time.monotonic() - enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            QUEUE_SECONDS.observe(waited)
+            self.busy += 1
+            try:
+                await self._handler(item)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logger.exception("Ошибка обработки апдейта")
+            finally:
+                self.busy -= 1
+                self.pending -= 1
+                # по одному апдейту за раз: следующий из этого чата — в конец очереди,
+                # чтобы активный чат не занимал воркер в ущерб остальным
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._queues[key]
+                if self.pending == 0:
+                    self._idle.set()
+
+    def stats(self) -> dict:
+        done = self.processed + self.failed
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "active_chats": len(self._queues),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "queue_wait_avg_ms": round(1000 * self.wait_total / done, 2) if done else 0.0,
+            "queue_wait_max_ms": round(1000 * self.wait_max, 2),
+        }
@@ -0,0 +1,490 @@
+# state_store.py
+# ------------------------------------------------------------------------------
+# Хранилище context.user_data (state, _last_welcome_ts, card_msg_id) вне
+# процесса: переживает рестарт и общее для всех воркеров gunicorn.
+#
+#   • подключается как persistence PTB-Application — хендлеры не меняются;
+#   • при старте ничего не грузим: пользователь подтягивается из хранилища
+#     перед своим апдейтом (refresh_user_data);
+#   • запись отложенная: изменения копятся и раз в interval уходят одной
+#     транзакцией / одним пайплайном. Закончился апдейт — user_data сразу
+#     ставится в очередь записи (install), и пока она не записана, из
+#     хранилища пользователя не перечитываем: память свежее;
+#   • кто молчит дольше ttl, выгружается из памяти — память не растёт
+#     вместе с аудиторией; в хранилище запись живёт store_ttl.
+#
+# Бэкенды:
+#   sqlite — файл в режиме WAL (один сервер, несколько воркеров);
+#   redis  — любой сервер с протоколом Redis (RESP). Для локального запуска
+#            есть встроенная замена: python state_store.py --port 6380
+# ------------------------------------------------------------------------------
+
+import sys
+import json
+import time
+import socket
+import asyncio
+import sqlite3
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+from telegram import Update
+from telegram.ext import BasePersistence, PersistenceInput, TypeHandler
+
+logger = logging.getLogger("bot.state")
+
+DAY = 24 * 3600
+
+
+# ========= SQLITE =========
+class SqliteStateBackend:
+    name = "sqlite"
+    PRUNE_EVERY = 200  # пачек записи между чистками просроченного
+
+    def __init__(self, path: str, store_ttl: float = 30 * DAY):
+        self.path = path
+        self.store_ttl = store_ttl
+        self._saves = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS user_state ("
+                           "user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, ts REAL NOT NULL)")
+
+    def load(self, user_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM user_state WHERE user_id = ? AND ts >= ?",
+                (user_id, time.time() - self.store_ttl),
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_many(self, batch: Dict[int, str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO user_state(user_id, data, ts) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, ts = excluded.ts",
+                    [(uid, blob, now) for uid, blob in batch.items()],
+                )
+                self._saves += 1
+                if self._saves % self.PRUNE_EVERY == 0:
+                    self._conn.execute("DELETE FROM user_state WHERE ts < ?", (now - self.store_ttl,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_many(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM user_state WHERE user_id = ?", [(uid,) for uid in user_ids])
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# ========= REDIS (RESP) =========
+class RespError(Exception):
+    """Сервер ответил ошибкой (-ERR ...)."""
+
+
+def _encode(*args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(out)
+
+
+def _read_reply(f):
+    line = f.readline()
+    if not line:
+        raise ConnectionError("соединение с redis закрыто")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RespError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = f.read(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        size = int(rest)
+        return None if size < 0 else [_read_reply(f) for _ in range(size)]
+    raise ConnectionError(f"непонятный ответ redis: {line!r}")
+
+
+class RedisStateBackend:
+    """Минимальный синхронный клиент: GET / SET EX / DEL с пайплайном."""
+    name = "redis"
+
+    def __init__(self, url: str, store_ttl: float = 30 * DAY, prefix: str = "mrhouse:user:"):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.store_ttl = int(store_ttl)
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+
+    def _connect(self) -> None:
+        self._sock = socket.create_connection((self.host, self.port), timeout=5.0)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._pipeline(setup)
+
+    def _pipeline(self, commands: List[tuple]) -> list:
+        self._sock.sendall(b"".join(_encode(*cmd) for cmd in commands))
+        replies = [_read_reply(self._file) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def execute(self, commands: List[tuple]) -> list:
+        """Пачка команд за один круг; при обрыве — одно переподключение."""
+        with self._lock:
+            for attempt in (0, 1):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._pipeline(commands)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._file = None
+
+    def load(self, user_id: int) -> Optional[str]:
+        value = self.execute([("GET", f"{self.prefix}{user_id}")])[0]
+        return value.decode() if value is not None else None
+
+    def save_many(self, batch: Dict[int, str]) -> None:
+        self.execute([("SET", f"{self.prefix}{uid}", blob, "EX", self.store_ttl)
+                      for uid, blob in batch.items()])
+
+    def delete_many(self, user_ids: Iterable[int]) -> None:
+        keys = [f"{self.prefix}{uid}" for uid in user_ids]
+        if keys:
+            self.execute([("DEL", *keys)])
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+# ========= PERSISTENCE ДЛЯ PTB =========
+class UserStatePersistence(BasePersistence):
+    """
+    Только user_data. shared=True — перед каждым апдейтом перечитываем
+    пользователя (его мог обслужить другой воркер); shared=False — читаем
+    один раз, дальше память процесса главная.
+    """
+
+    def __init__(self, backend, *, ttl: float = 1800.0, interval: float = 1.0, shared: bool = True):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False,
+                                                     user_data=True, callback_data=False),
+                         update_interval=interval)
+        self.backend = backend
+        self.ttl = ttl
+        self.interval = interval
+        self.shared = shared
+        self._seen: "OrderedDict[int, float]" = OrderedDict()  # кто в памяти и когда был активен
+        self._pending: Dict[int, str] = {}
+        self._inflight: Dict[int, str] = {}
+        self._evicting: set = set()
+        self._flush_lock = asyncio.Lock()
+        # метрики
+        self.reads = 0
+        self.hydrated = 0
+        self.writes = 0
+        self.batches = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def install(self, application, group: int = 1000) -> None:
+        """Последний обработчик каждого апдейта: итог user_data — сразу в очередь записи."""
+        application.add_handler(TypeHandler(Update, self._settle), group=group)
+
+    async def _settle(self, update: Update, context) -> None:
+        if update.effective_user is not None and context.user_data is not None:
+            await self.update_user_data(update.effective_user.id, context.user_data)
+
+    # --- чтение ---
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}  # никого не грузим заранее — только по мере прихода апдейтов
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        known = user_id in self._seen
+        self._seen[user_id] = time.monotonic()
+        self._seen.move_to_end(user_id)
+        if user_id in self._pending or user_id in self._inflight:
+            return  # в памяти свежее, чем в хранилище
+        if known and not self.shared:
+            return
+        self.reads += 1
+        try:
+            blob = await asyncio.to_thread(self.backend.load, user_id)
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Не смог прочитать состояние {user_id}: {e}")
+            return
+        if blob is None:
+            return
+        try:
+            data = json.loads(blob)
+        except ValueError:
+            logger.warning(f"Битое состояние {user_id} в хранилище — игнорирую")
+            return
+        user_data.clear()
+        user_data.update(data)
+        self.hydrated += 1
+
+    # --- запись ---
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        try:
+            self._pending[user_id] = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Состояние {user_id} не сериализуется в JSON: {e}")
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if user_id in self._evicting:
+            self._evicting.discard(user_id)  # выгрузили из памяти, в хранилище оставляем
+            return
+        self._pending.pop(user_id, None)
+        self._seen.pop(user_id, None)
+        await asyncio.to_thread(self.backend.delete_many, [user_id])
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            try:
+                await asyncio.to_thread(self.backend.save_many, batch)
+                self.writes += len(batch)
+                self.batches += 1
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Не смог записать {len(batch)} состояний, повторю: {e}")
+                for uid, blob in batch.items():
+                    self._pending.setdefault(uid, blob)
+            finally:
+                self._inflight = {}
+
+    # --- выгрузка из памяти ---
+    def evict_idle(self, application) -> int:
+        """Выгрузить из application.user_data тех, кто молчит дольше ttl."""
+        now = time.monotonic()
+        idle = []
+        for uid, ts in self._seen.items():
+            if now - ts < self.ttl:
+                break  # дальше только более свежие
+            if uid not in self._pending and uid not in self._inflight:
+                idle.append(uid)
+        for uid in idle:
+            del self._seen[uid]
+            self._evicting.add(uid)
+            application.drop_user_data(uid)
+        self.evicted += len(idle)
+        return len(idle)
+
+    async def run(self, application) -> None:
+        """Фоновый цикл: собрать изменения, записать пачкой, выгрузить неактивных."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await application.update_persistence()
+                await self.flush()
+                if self.evict_idle(application):
+                    await application.update_persistence()  # отработать drop_user_data
+            except Exception:
+                logger.exception("Ошибка цикла записи состояний")
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.name,
+            "shared": self.shared,
+            "in_memory": len(self._seen),
+            "pending": len(self._pending),
+            "reads": self.reads,
+            "hydrated": self.hydrated,
+            "writes": self.writes,
+            "batches": self.batches,
+            "evicted": self.evicted,
+            "errors": self.errors,
+        }
+
+    # --- остальное PTB требует, но мы это не храним ---
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+def make_state_store(backend: str, *, path: str, url: str, ttl: float, store_ttl: float,
+                     interval: float, shared: bool) -> Optional[UserStatePersistence]:
+    """None — состояние только в памяти процесса (как раньше)."""
+    if backend == "memory":
+        return None
+    if backend == "redis":
+        store = RedisStateBackend(url, store_ttl=store_ttl)
+        where = f"{store.host}:{store.port}/{store.db}"
+    else:
+        if backend != "sqlite":
+            logger.warning(f"Неизвестный STATE_BACKEND={backend!r} — использую sqlite")
+        store = SqliteStateBackend(path, store_ttl=store_ttl)
+        where = path
+    logger.info(f"Состояние пользователей: {store.name} {where}, "
+                f"в памяти {ttl:.0f}с, запись раз в {interval:g}с, shared={shared}")
+    return UserStatePersistence(store, ttl=ttl, interval=interval, shared=shared)
+
+
+# ========= ЛОКАЛЬНАЯ ЗАМЕНА REDIS =========
+class RespServer:
+    """
+    Крошечный сервер с протоколом Redis для разработки и тестов: ключи
+    в памяти, PING/GET/SET [EX]/DEL/EXISTS/TTL/SELECT/AUTH. Не для продакшена.
+    """
+
+    def __init__(self):
+        self._data: Dict[bytes, tuple] = {}  # key -> (value, expires_at | None)
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return item[0]
+
+    def command(self, args: List[bytes]) -> bytes:
+        name = args[0].upper() if args else b""
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name in (b"SELECT", b"AUTH"):
+            return b"+OK\r\n"
+        if name == b"GET" and len(args) == 2:
+            value = self._get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if name == b"SET" and len(args) in (3, 5):
+            expires = None
+            if len(args) == 5:
+                if args[3].upper() != b"EX":
+                    return b"-ERR syntax error\r\n"
+                expires = time.monotonic() + int(args[4])
+            self._data[args[1]] = (args[2], expires)
+            return b"+OK\r\n"
+        if name in (b"DEL", b"EXISTS") and len(args) > 1:
+            found = [key for key in args[1:] if self._get(key) is not None]
+            if name == b"DEL":
+                for key in found:
+                    del self._data[key]
+            return b":%d\r\n" % len(found)
+        if name == b"TTL" and len(args) == 2:
+            if self._get(args[1]) is None:
+                return b":-2\r\n"
+            expires = self._data[args[1]][1]
+            return b":%d\r\n" % (-1 if expires is None else int(expires - time.monotonic()))
+        return b"-ERR unknown command or wrong arguments\r\n"
+
+    async def _serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.startswith(b"*"):
+                    args = line.split()  # inline-команды (redis-cli, telnet)
+                else:
+                    args = []
+                    for _ in range(int(line[1:-2])):
+                        size = int((await reader.readline())[1:-2])
+                        args.append((await reader.readexactly(size + 2))[:-2])
+                writer.write(self.command(args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 6380) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._serve_client, host, port)
+
+
+async def _serve_forever(host: str, port: int) -> None:
+    server = await RespServer().serve(host, port)
+    logger.info(f"RESP-сервер на {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная замена Redis для STATE_BACKEND=redis")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    opts = parser.parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_serve_forever(opts.host, opts.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,334 @@
+# static_server.py
+# ------------------------------------------------------------------------------
+# Отдача статики (фото, PDF-презентации, видео) отдельно от обработки апдейтов.
+#
+# StaticResolver решает, что ответить на запрос файла:
+#   • сильный ETag = sha256 содержимого из манифеста — одинаковый на всех
+#     воркерах и после передеплоя (у Starlette он из mtime и размера);
+#   • If-None-Match → 304; Range: bytes=a-b → 206 (перемотка видео),
+#     If-Range с чужим ETag → весь файл; за пределами файла → 416;
+#   • ?v=<актуальная версия> → immutable на год, иначе короткий кэш;
+#   • file.gz / file.br рядом с файлом → отдаём сжатый вариант, если клиент
+#     его принимает (для Range — всегда исходный файл).
+#
+# Два способа подключить:
+#   • StaticApp — ASGI-приложение, монтируется в bot.py на /static (по умолчанию);
+#   • отдельный процесс без фреймворка: тело ответа уходит loop.sendfile()
+#     (os.sendfile, без копирования в user space), воркеры вебхука статику
+#     не видят вовсе:
+#       python static_server.py --port 8082 --precompress
+#     и STATIC_URL=https://static.example (или http://host:8082) у бота.
+# ------------------------------------------------------------------------------
+
+import os
+import sys
+import gzip
+import asyncio
+import argparse
+import logging
+import mimetypes
+from email.utils import formatdate
+from typing import List, Mapping, NamedTuple, Optional, Tuple
+from urllib.parse import parse_qsl, unquote
+
+from assets import IMMUTABLE, REVALIDATE, TOKEN_LEN, VARIANT_SUFFIXES, AssetManifest
+
+logger = logging.getLogger("bot.static")
+
+# Что имеет смысл сжимать заранее (jpg/mp4 уже сжаты)
+COMPRESSIBLE = frozenset({".json", ".svg", ".txt", ".css", ".js", ".html", ".xml", ".pdf"})
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # в порядке предпочтения
+CHUNK = 1 << 16
+
+
+class Reply(NamedTuple):
+    status: int
+    headers: List[Tuple[str, str]]
+    path: Optional[str] = None     # файл для тела ответа (None — тела нет)
+    offset: int = 0
+    length: int = 0
+
+
+def _accepts(header: str, coding: str) -> bool:
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        if name.strip().lower() == coding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Один диапазон bytes=a-b → (start, end) включительно. None — заголовок не
+    разобран или диапазонов несколько (отдаём весь файл, так можно по RFC 9110).
+    ValueError — диапазон целиком за пределами файла (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = (part.strip() for part in spec.partition("-"))
+    if not dash or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+    if first == "":                          # bytes=-500 — последние 500 байт
+        if not last:
+            return None
+        if int(last) == 0 or size == 0:
+            raise ValueError("пустой диапазон")
+        return max(0, size - int(last)), size - 1
+    start, end = int(first), int(last) if last else size - 1
+    if start >= size:
+        raise ValueError("за пределами файла")
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+class StaticResolver:
+    def __init__(self, root: str, manifest: Optional[AssetManifest] = None):
+        self.root = os.path.realpath(root)
+        self.manifest = manifest or AssetManifest(root).build()
+
+    def _file(self, rel: str) -> Optional[Tuple[str, os.stat_result]]:
+        parts = [p for p in rel.split("/") if p]
+        if not parts or any(p.startswith(".") for p in parts) or rel.endswith(VARIANT_SUFFIXES):
+            return None
+        full = os.path.realpath(os.path.join(self.root, *parts))
+        if not full.startswith(self.root + os.sep):
+            return None
+        try:
+            st = os.stat(full)
+        except OSError:
+            return None
+        return (full, st) if os.path.isfile(full) else None
+
+    def _variant(self, full: str, st: os.stat_result, accept: str):
+        """Сжатая копия рядом с файлом, если клиент её принимает и она не старее исходника."""
+        for coding, suffix in _ENCODINGS:
+            if not _accepts(accept, coding):
+                continue
+            try:
+                vst = os.stat(full + suffix)
+            except OSError:
+                continue
+            if vst.st_mtime_ns >= st.st_mtime_ns:
+                return coding, suffix, vst
+        return None
+
+    def hashed(self, rel: str) -> bool:
+        """False — resolve() придётся считать sha256 файла (поменялся после сборки манифеста)."""
+        found = self._file(rel)
+        if found is None:
+            return True
+        full, st = found
+        return self.manifest.fresh(os.path.relpath(full, self.root).replace(os.sep, "/"), st)
+
+    def resolve(self, method: str, rel: str, query: str, headers: Mapping[str, str]) -> Reply:
+        """headers — заголовки запроса с именами в нижнем регистре."""
+        if method not in ("GET", "HEAD"):
+            return Reply(405, [("Allow", "GET, HEAD"), ("Content-Length", "0")])
+        found = self._file(rel)
+        if found is None:
+            return Reply(404, [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", "0")])
+        full, st = found
+        rel = os.path.relpath(full, self.root).replace(os.sep, "/")
+        digest = self.manifest.current(rel, st)
+        requested = dict(parse_qsl(query)).get("v")
+
+        ctype, _ = mimetypes.guess_type(full)
+        ctype = ctype or "application/octet-stream"
+        if ctype.startswith("text/") or ctype in ("application/json", "image/svg+xml"):
+            ctype += "; charset=utf-8"
+        path, size, etag = full, st.st_size, f'"{digest[:32]}"'
+        out = [
+            ("Content-Type", ctype),
+            ("Cache-Control", IMMUTABLE if requested and requested == digest[:TOKEN_LEN] else REVALIDATE),
+            ("Last-Modified", formatdate(st.st_mtime, usegmt=True)),
+            ("Accept-Ranges", "bytes"),
+        ]
+        if os.path.splitext(full)[1].lower() in COMPRESSIBLE:
+            out.append(("Vary", "Accept-Encoding"))
+        http_range = headers.get("range")
+        variant = None if http_range else self._variant(full, st, headers.get("accept-encoding", ""))
+        if variant:
+            coding, suffix, vst = variant
+            path, size, etag = full + suffix, vst.st_size, f'"{digest[:32]}-{suffix[1:]}"'
+            out.append(("Content-Encoding", coding))
+        out.append(("ETag", etag))
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in
+                              (t.strip().removeprefix("W/") for t in if_none_match.split(","))):
+            return Reply(304, [h for h in out if h[0] in ("Cache-Control", "ETag", "Vary", "Last-Modified")])
+
+        if http_range and headers.get("if-range", etag) == etag:
+            try:
+                span = parse_range(http_range, size)
+            except ValueError:
+                return Reply(416, [("Content-Range", f"bytes */{size}"), ("Content-Length", "0")])
+            if span:
+                start, end = span
+                out += [("Content-Range", f"bytes {start}-{end}/{size}"), ("Content-Length", str(end - start + 1))]
+                return Reply(206, out, None if method == "HEAD" else path, start, end - start + 1)
+
+        out.append(("Content-Length", str(size)))
+        return Reply(200, out, None if method == "HEAD" else path, 0, size)
+
+
+# ========= ASGI (внутри бота) =========
+class StaticApp:
+    """Mount("/static", app=StaticApp(resolver)) — те же правила внутри ASGI-приложения."""
+
+    def __init__(self, resolver: StaticResolver):
+        self.resolver = resolver
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return
+        path, root = scope["path"], scope.get("root_path", "")
+        # scope["path"] в ASGI уже раскодирован — второй unquote превратил бы %25 в %
+        rel = path[len(root):] if root and path.startswith(root) else path  # путь внутри Mount
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        args = (scope["method"], rel, scope.get("query_string", b"").decode("latin-1"), headers)
+        if self.resolver.hashed(rel):
+            reply = self.resolver.resolve(*args)
+        else:  # файл поменяли после сборки манифеста — sha256 считаем не в цикле событий
+            reply = await asyncio.to_thread(self.resolver.resolve, *args)
+        await send({"type": "http.response.start", "status": reply.status,
+                    "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in reply.headers]})
+        if reply.path is None:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        if reply.status == 200 and "http.response.pathsend" in scope.get("extensions", {}):
+            await send({"type": "http.response.pathsend", "path": reply.path})
+            return
+        with open(reply.path, "rb") as f:
+            f.seek(reply.offset)
+            left = reply.length
+            while left > 0:
+                chunk = await asyncio.to_thread(f.read, min(CHUNK, left))
+                if not chunk:
+                    break
+                left -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": left > 0})
+        if left > 0 or not reply.length:  # пустой файл или укоротили на ходу — закрываем ответ
+            await send({"type": "http.response.body", "body": b""})
+
+
+# ========= ОТДЕЛЬНЫЙ ПРОЦЕСС =========
+_REASONS = {200: "OK", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request",
+            404: "Not Found", 405: "Method Not Allowed", 416: "Range Not Satisfiable"}
+MAX_HEAD = 16 * 1024
+IDLE_TIMEOUT = 15.0
+
+
+async def _handle(resolver: StaticResolver, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError):
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, version = lines[0].split(" ", 2)
+            except ValueError:
+                writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                return
+            headers = {}
+            for line in lines[1:]:
+                name, sep, value = line.partition(":")
+                if sep:
+                    headers[name.strip().lower()] = value.strip()
+            path, _, query = target.partition("?")
+            path = unquote(path)
+            if path == "/healthz":
+                reply = Reply(200, [("Content-Length", "0")])
+            else:
+                rel = path.removeprefix("/static")
+                if resolver.hashed(rel):
+                    reply = resolver.resolve(method, rel, query, headers)
+                else:  # как в StaticApp: sha256 поменявшегося файла — не в цикле событий
+                    reply = await asyncio.to_thread(resolver.resolve, method, rel, query, headers)
+            keep = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            lines = [f"HTTP/1.1 {reply.status} {_REASONS.get(reply.status, '')}"]
+            lines += [f"{k}: {v}" for k, v in reply.headers]
+            lines.append("Connection: keep-alive" if keep else "Connection: close")
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            if reply.path is not None and reply.length:
+                await writer.drain()
+                with open(reply.path, "rb") as f:
+                    await loop.sendfile(writer.transport, f, reply.offset, reply.length)
+            await writer.drain()
+            if not keep:
+                return
+    except (ConnectionError, OSError) as e:
+        logger.debug(f"Клиент статики отвалился: {e}")
+    finally:
+        writer.close()
+
+
+async def serve(host: str, port: int, resolver: StaticResolver) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(lambda r, w: _handle(resolver, r, w), host, port, limit=MAX_HEAD)
+    logger.info(f"Статика {resolver.root} на http://{host}:{port}")
+    return server
+
+
+# ========= ПРЕДСЖАТИЕ =========
+def precompress(root: str, min_gain: float = 0.1) -> Tuple[int, int]:
+    """Положить file.gz рядом с подходящими файлами, если сжатие экономит ≥ min_gain."""
+    written = skipped = 0
+    manifest = AssetManifest(root)
+    for rel, full in manifest.walk():
+        if os.path.splitext(full)[1].lower() not in COMPRESSIBLE:
+            continue
+        target = full + ".gz"
+        st = os.stat(full)
+        try:
+            if os.stat(target).st_mtime_ns >= st.st_mtime_ns:
+                continue  # уже свежий
+        except OSError:
+            pass
+        with open(full, "rb") as f:
+            data = f.read()
+        packed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(packed) > len(data) * (1 - min_gain):
+            skipped += 1
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        tmp = target + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(packed)
+        os.replace(tmp, target)
+        written += 1
+    return written, skipped
+
+
+def _main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Отдельный процесс для статики MR.House бота")
+    parser.add_argument("--root", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("STATIC_PORT", "8082")))
+    parser.add_argument("--precompress", action="store_true", help="сначала подготовить .gz-копии")
+    opts = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    if opts.precompress:
+        written, skipped = precompress(opts.root)
+        logger.info(f"Предсжатие: {written} .gz записано, {skipped} не стоит сжимать")
+    resolver = StaticResolver(opts.root)
+
+    async def main():
+        server = await serve(opts.host, opts.port, resolver)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
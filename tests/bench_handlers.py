@@ -0,0 +1,253 @@
+# tests/bench_handlers.py
+# Бенчмарк горячего пути: каждое действие пользователя (кнопка меню, клик
+# по локации/проекту/«назад», /start с баннером, отправка карточки) гоняется
+# через настоящие хендлеры поверх подменного транспорта. На действие меряем:
+#   cpu_us      — процессорное время (лучший из раундов, как timeit);
+#   peak_kib    — пик памяти за одно действие (tracemalloc);
+#   retained_b  — сколько байт остаётся после действия (утечки/рост user_data);
+#   api_calls   — сколько вызовов Bot API уходит на одно действие.
+# Базовые значения лежат в bench_baseline.json; test_bench.py падает, если
+# действие стало заметно дороже (по CPU — только с BENCH_CPU_TOLERANCE).
+# Перезаписать базу после осознанного изменения — отдельным коммитом, на
+# машине без другой нагрузки, лучший из нескольких прогонов:
+#   python tests/bench_handlers.py --update
+# Просто сравнить с базой: python tests/bench_handlers.py [--n 500] [--only loc]
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+import platform
+import tracemalloc
+from statistics import median
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import conftest  # noqa: F401  (фиктивные BOT_TOKEN/BASE_URL)
+
+import telegram
+from telegram.ext import CallbackContext
+
+import bot
+from callbacks import LOC, LOCS, MENU, PROJ, PROJS, encode
+from telegram_stub import callback_update, make_app, text_update
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# Допуски: вызовов API — ни одного сверх базы; CPU и память — с запасом на шум
+CPU_TOLERANCE = float(os.environ.get("BENCH_CPU_TOLERANCE", "1.5"))
+MEM_TOLERANCE = float(os.environ.get("BENCH_MEM_TOLERANCE", "1.5"))
+MEM_SLACK_KIB = 16.0
+RETAINED_SLACK_B = 1024
+
+
+class Scenario(NamedTuple):
+    name: str
+    nav: str                                       # NAV_MODE на время прогона
+    action: Callable                               # async (app, chat_id) -> None
+    prepare: Optional[Callable] = None             # (app, chat_id) -> None, состояние чата до действия
+
+
+# ========= ДЕЙСТВИЯ =========
+CARD_ID = 10  # message_id карточки, уже показанной в чате
+# Каждое действие — в новом чате (на все сценарии): ни user_data, ни антидубль
+# приветствия от предыдущих повторов не влияют на замер
+_chat_ids = itertools.count(10**6)
+
+
+def _text(value):
+    async def run(app, chat_id):
+        await app.process_update(text_update(app, value, chat_id=chat_id))
+    return run
+
+
+def _click(data, *, on_card):
+    async def run(app, chat_id):
+        await app.process_update(callback_update(app, data, chat_id=chat_id, message_id=CARD_ID, photo=on_card))
+    return run
+
+
+def _has_card(app, chat_id):
+    app.user_data[chat_id]["card_msg_id"] = CARD_ID
+
+
+def _sender(fn, name):
+    async def run(app, chat_id):
+        await fn(telegram.Chat(chat_id, "private"), name, CallbackContext(app, chat_id, chat_id))
+    return run
+
+
+async def _welcome(app, chat_id):
+    update = text_update(app, "/start", chat_id=chat_id)
+    await bot.send_welcome_with_photo(update, CallbackContext(app, chat_id, chat_id))
+
+
+def scenarios() -> List[Scenario]:
+    loc = bot.CATALOG.location(bot.CATALOG.location_names[0])
+    proj = next(iter(bot.CATALOG.projects.values()))
+    return [
+        Scenario("text:locations", "inplace", _text("📍 Локации домов")),
+        Scenario("text:projects", "inplace", _text("🏗️ Проекты")),
+        Scenario("text:calc", "inplace", _text("🧮 Расчёт стоимости")),
+        Scenario("text:unknown", "inplace", _text("привет")),
+        Scenario("cmd:start", "inplace", _text("/start")),
+        Scenario("send_welcome_with_photo", "inplace", _welcome),
+        Scenario("send_location_card", "inplace", _sender(bot.send_location_card, loc.name)),
+        Scenario("send_project_card", "inplace", _sender(bot.send_project_card, proj.name)),
+        # навигация в одном сообщении: первый клик из списка и клики по карточке
+        Scenario("click:loc(list)", "inplace", _click(encode(LOC, loc.slug), on_card=False)),
+        Scenario("click:loc(card)", "inplace", _click(encode(LOC, loc.slug), on_card=True), _has_card),
+        Scenario("click:proj(card)", "inplace", _click(encode(PROJ, proj.slug), on_card=True), _has_card),
+        Scenario("click:back_to_locs", "inplace", _click(encode(LOCS), on_card=True), _has_card),
+        Scenario("click:back_to_projects", "inplace", _click(encode(PROJS), on_card=True), _has_card),
+        Scenario("click:back_to_menu", "inplace", _click(encode(MENU), on_card=True), _has_card),
+        Scenario("click:unknown_loc", "inplace", _click(encode(LOC, "net_takoy"), on_card=True), _has_card),
+        # кнопки старого формата в уже отправленных сообщениях и совсем чужие
+        Scenario("click:legacy_loc(card)", "inplace", _click(f"loc:{loc.name}", on_card=True), _has_card),
+        Scenario("click:stale", "inplace", _click("9x:old", on_card=True), _has_card),
+        # классическая навигация: каждая карточка новым сообщением
+        Scenario("classic:loc", "classic", _click(encode(LOC, loc.slug), on_card=False)),
+        Scenario("classic:proj", "classic", _click(encode(PROJ, proj.slug), on_card=False)),
+        Scenario("classic:back_to_locs", "classic", _click(encode(LOCS), on_card=False)),
+        Scenario("classic:back_to_projects", "classic", _click(encode(PROJS), on_card=False)),
+        Scenario("classic:back_to_menu", "classic", _click(encode(MENU), on_card=False)),
+    ]
+
+
+# ========= ЗАМЕР =========
+async def measure(app, stub, scenario: Scenario, n: int, rounds: int = 5, warmup: int = 5) -> dict:
+    async def run_once():
+        chat_id = next(_chat_ids)
+        if scenario.prepare:
+            scenario.prepare(app, chat_id)
+        await scenario.action(app, chat_id)
+
+    bot.NAV_MODE = scenario.nav
+    for _ in range(warmup):
+        await run_once()
+
+    # вызовы API на одно действие (детерминированно)
+    stub.calls.clear()
+    await run_once()
+    api = list(stub.calls)
+
+    # CPU: лучший раунд — меньше всего зависит от соседей по машине
+    # (prepare — одна запись в dict, в замере не заметна)
+    per_round = []
+    for _ in range(rounds):
+        t0 = time.process_time()
+        for _ in range(n):
+            await run_once()
+        per_round.append((time.process_time() - t0) / n * 1e6)
+
+    # память: пик за одно действие и остаток после него. Медиана, а не среднее:
+    # каждое действие — новый чат, и редкое расширение application.user_data
+    # (сотни КиБ разом) на коротком прогоне давало бы случайный «рост»
+    tracemalloc.start()
+    peaks, kept = [], []
+    k = max(1, n // 5)
+    for _ in range(k):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        await run_once()
+        after, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        kept.append(after - before)
+    retained = median(kept)
+    tracemalloc.stop()
+    stub.calls.clear()
+
+    return {
+        "cpu_us": round(min(per_round), 1),
+        "peak_kib": round(median(peaks) / 1024, 1),
+        "retained_b": int(retained),
+        "api_calls": len(api),
+        "api": api,
+    }
+
+
+async def run_suite(n: int = 200, only: Optional[str] = None) -> Dict[str, dict]:
+    nav = bot.NAV_MODE
+    get = bot.MEDIA_CACHE.get
+    bot.MEDIA_CACHE.get = lambda path: "PHOTO_ID"  # тёплый кэш file_id — обычный режим работы
+    app, stub = await make_app()
+    try:
+        return {s.name: await measure(app, stub, s, n)
+                for s in scenarios() if not only or only in s.name}
+    finally:
+        await app.shutdown()
+        bot.MEDIA_CACHE.get = get
+        bot.NAV_MODE = nav
+
+
+# ========= СРАВНЕНИЕ С БАЗОЙ =========
+def load_baseline(path: str = BASELINE_FILE) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(results: Dict[str, dict], path: str = BASELINE_FILE) -> None:
+    data = {"_meta": {"python": platform.python_version(), "ptb": telegram.__version__,
+                      "machine": platform.machine()},
+            **results}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare(results: Dict[str, dict], baseline: dict, *, cpu_tolerance: float = CPU_TOLERANCE,
+            mem_tolerance: float = MEM_TOLERANCE, check_cpu: bool = True) -> List[str]:
+    """Список регрессий (пустой — всё в норме). Сценарии без базы не проверяются."""
+    problems = []
+    for name, got in results.items():
+        ref = baseline.get(name)
+        if not ref:
+            continue
+        if got["api_calls"] > ref["api_calls"]:
+            problems.append(f"{name}: вызовов API {got['api_calls']} > {ref['api_calls']} "
+                            f"({' '.join(got['api'])})")
+        if check_cpu and got["cpu_us"] > ref["cpu_us"] * cpu_tolerance:
+            problems.append(f"{name}: CPU {got['cpu_us']} us > {ref['cpu_us']} × {cpu_tolerance}")
+        if got["peak_kib"] > ref["peak_kib"] * mem_tolerance + MEM_SLACK_KIB:
+            problems.append(f"{name}: пик памяти {got['peak_kib']} KiB > {ref['peak_kib']} × {mem_tolerance}")
+        if got["retained_b"] > ref["retained_b"] * mem_tolerance + RETAINED_SLACK_B:
+            problems.append(f"{name}: остаётся {got['retained_b']} B/действие > {ref['retained_b']} × {mem_tolerance}")
+    return problems
+
+
+def _print(results: Dict[str, dict], baseline: dict) -> None:
+    print(f"{'действие':<26} {'cpu us':>9} {'база':>9} {'peak KiB':>9} {'retain B':>9} {'API':>4}")
+    for name, r in results.items():
+        ref = baseline.get(name, {}).get("cpu_us", "")
+        print(f"{name:<26} {r['cpu_us']:9.1f} {ref:>9} {r['peak_kib']:9.1f} {r['retained_b']:9d} {r['api_calls']:4d}")
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк хендлеров с базовыми значениями")
+    parser.add_argument("--n", type=int, default=500, help="действий на раунд")
+    parser.add_argument("--only", default=None, help="только сценарии с этой подстрокой")
+    parser.add_argument("--update", action="store_true", help="записать результат как новую базу")
+    opts = parser.parse_args(argv)
+
+    results = asyncio.run(run_suite(opts.n, opts.only))
+    baseline = load_baseline()
+    _print(results, baseline)
+    if opts.update:
+        save_baseline({**{k: v for k, v in baseline.items() if k != "_meta"}, **results})
+        print(f"база записана: {BASELINE_FILE}")
+        return 0
+    problems = compare(results, baseline)
+    for p in problems:
+        print("РЕГРЕССИЯ", p)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,23 @@
+# tests/conftest.py
+# bot.py читает BOT_TOKEN при импорте — для тестов хватит фиктивного.
+# BASE_URL нужен, чтобы карточки шли с фото (локальные файлы из static/).
+
+import os
+import tempfile
+
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("BASE_URL", "https://bot.example")
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("MEDIA_CACHE_FILE", os.path.join(_tmp, "media_cache.json"))
+os.environ.setdefault("DERIVED_DIR", os.path.join(_tmp, "derived"))
+os.environ.setdefault("STATE_DB", os.path.join(_tmp, "state.sqlite3"))
+os.environ.setdefault("BROADCAST_DB", os.path.join(_tmp, "broadcast.sqlite3"))
+os.environ.setdefault("KNOWLEDGE_INDEX", os.path.join(_tmp, "knowledge.idx"))
+os.environ.setdefault("LEADS_DB", os.path.join(_tmp, "leads.sqlite3"))
+# условный прайс только для тестов: в боте PRICES_FILE по умолчанию не задан
+os.environ.setdefault("PRICES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                  "prices_sample.json"))
+# /stats и /metrics закрыты этим секретом
+os.environ.setdefault("WEBHOOK_SECRET", "test-secret")
+# прогрев без сети: getMe с фиктивным токеном не пройдёт
+os.environ.setdefault("WARMUP", "0")
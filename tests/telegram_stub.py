@@ -0,0 +1,98 @@
+# tests/telegram_stub.py
+# Подменный транспорт Bot API: ничего не шлёт в сеть, записывает вызовы
+# и отвечает правдоподобными объектами. Хендлеры бота гоняются как есть.
+
+import json
+import asyncio
+import itertools
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+import bot
+
+_PHOTO = [{"file_id": "PHOTO_ID", "file_unique_id": "U1", "width": 1280, "height": 720}]
+
+
+class StubRequest(BaseRequest):
+    def __init__(self, latency: float = 0.0):
+        self.calls = []
+        self.latency = latency  # имитация сетевой задержки каждого вызова, сек
+        self._ids = itertools.count(1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _message(self, params, photo=False):
+        msg = {
+            "message_id": params.get("message_id") or next(self._ids),
+            "date": 0,
+            "chat": {"id": int(params.get("chat_id", 1)), "type": "private"},
+        }
+        if photo:
+            msg["photo"] = _PHOTO
+            msg["caption"] = params.get("caption", "")
+        else:
+            msg["text"] = params.get("text", "")
+        return msg
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append(endpoint)
+        if self.latency and endpoint != "getMe":
+            await asyncio.sleep(self.latency)
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "MR.House", "username": "mrhouse_bot"}
+        elif endpoint in ("sendPhoto", "editMessageMedia"):
+            result = self._message(params, photo=True)
+        elif endpoint in ("sendMessage", "editMessageText", "editMessageCaption", "editMessageReplyMarkup"):
+            result = self._message(params, photo=endpoint == "editMessageCaption")
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+async def make_app(latency: float = 0.0, request: StubRequest = None):
+    """Application с хендлерами бота поверх подменного транспорта (свой — через request)."""
+    stub = request or StubRequest(latency)
+    app = Application.builder().token(bot.BOT_TOKEN).request(stub).get_updates_request(StubRequest()).build()
+    for group, handlers in bot.application.handlers.items():
+        for handler in handlers:
+            app.add_handler(handler, group)
+    await app.initialize()
+    stub.calls.clear()
+    return app, stub
+
+
+_update_ids = itertools.count(1)
+
+
+def callback_update(app, data, *, chat_id=7, message_id=10, photo=False):
+    message = {"message_id": message_id, "date": 0, "chat": {"id": chat_id, "type": "private"}}
+    if photo:
+        message.update(photo=_PHOTO, caption="")
+    else:
+        message["text"] = "Локации:"
+    return Update.de_json({
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": "q", "chat_instance": "c", "data": data, "message": message,
+            "from": {"id": chat_id, "is_bot": False, "first_name": "U"},
+        },
+    }, app.bot)
+
+
+def text_update(app, text, *, chat_id=7):
+    message = {
+        "message_id": next(_update_ids) + 500, "date": 0, "text": text,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "U"},
+    }
+    if text.startswith("/"):  # как у Telegram: команда размечена сущностью
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return Update.de_json({"update_id": next(_update_ids), "message": message}, app.bot)
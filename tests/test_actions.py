@@ -0,0 +1,66 @@
+# tests/test_actions.py
+# Независимые вызовы одного действия идут параллельно: клик стоит меньше
+# сетевых задержек, а видимый порядок сообщений не меняется.
+
+import time
+import asyncio
+
+import bot
+from actions import SIDE_ERRORS, ActionPlan
+from callbacks import LOC, LOCS, encode
+from telegram_stub import callback_update, make_app
+
+RTT = 0.05
+
+
+def test_plan_waits_for_side_calls_and_swallows_their_errors():
+    done = []
+
+    async def call(name, delay, fail=False):
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError(name)
+        done.append(name)
+
+    async def main():
+        async with ActionPlan("t") as plan:
+            await plan.side(call("side", 0.02))
+            await plan.side(call("broken", 0.0, fail=True))
+            await call("main", 0.0)
+        return list(done)
+
+    label = call.__qualname__
+    errors0 = SIDE_ERRORS.value(label)
+    assert asyncio.run(main()) == ["main", "side"]  # блок закрылся только после побочного
+    assert SIDE_ERRORS.value(label) == errors0 + 1
+
+
+def _click_ms(nav, data, photo, monkeypatch):
+    monkeypatch.setattr(bot, "NAV_MODE", nav)
+    monkeypatch.setattr(bot.MEDIA_CACHE, "get", lambda path: "PHOTO_ID")
+
+    async def main():
+        app, stub = await make_app(latency=RTT)
+        if photo:
+            app.user_data[7]["card_msg_id"] = 10
+        started = time.perf_counter()
+        await app.process_update(callback_update(app, data, photo=photo))
+        elapsed = time.perf_counter() - started
+        await app.shutdown()
+        return elapsed, stub.calls
+
+    return asyncio.run(main())
+
+
+def test_answer_overlaps_card_edit(monkeypatch):
+    elapsed, calls = _click_ms("inplace", encode(LOC, "shopino"), True, monkeypatch)
+    assert calls == ["answerCallbackQuery", "editMessageMedia"]
+    assert elapsed < 1.8 * RTT  # один сетевой круг вместо двух
+
+
+def test_classic_click_keeps_order_and_saves_round_trips(monkeypatch):
+    elapsed, calls = _click_ms("classic", encode(LOC, "shopino"), False, monkeypatch)
+    assert calls == ["answerCallbackQuery", "editMessageText", "sendPhoto"]
+    assert elapsed < 1.8 * RTT
+    elapsed, calls = _click_ms("classic", encode(LOCS), False, monkeypatch)
+    assert calls == ["answerCallbackQuery", "editMessageText"]  # текст и кнопки одной правкой
@@ -0,0 +1,27 @@
+# tests/test_assets.py
+# Версия в URL = хэш содержимого; актуальная версия отдаётся как immutable.
+
+from starlette.testclient import TestClient
+
+import bot
+from assets import IMMUTABLE, AssetManifest
+
+
+def test_version_changes_only_for_changed_file(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"a")
+    (tmp_path / "b.jpg").write_bytes(b"b")
+    manifest = AssetManifest(str(tmp_path)).build()
+    va, vb = manifest.version("a.jpg"), manifest.version("b.jpg")
+
+    (tmp_path / "a.jpg").write_bytes(b"a2")
+    assert manifest.refresh() == {"a.jpg"}
+    assert manifest.version("a.jpg") != va and manifest.version("b.jpg") == vb
+    assert manifest.url("https://x", "b.jpg") == f"https://x/static/b.jpg?v={vb}"
+
+
+def test_static_cache_headers():
+    url = bot.asset_url("welcome.jpg")
+    path = url[len(bot.BASE_URL):]
+    with TestClient(bot.web_app) as client:
+        assert client.get(path).headers["cache-control"] == IMMUTABLE
+        assert client.get("/static/welcome.jpg").headers["cache-control"] != IMMUTABLE
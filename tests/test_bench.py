@@ -0,0 +1,41 @@
+# tests/test_bench.py
+# Регрессии производительности хендлеров против tests/bench_baseline.json:
+# лишний вызов Bot API на действие — всегда ошибка; память — с допуском;
+# CPU — только по запросу (база записана на тихой машине, общий CI шумнее).
+
+import os
+import asyncio
+
+import bench_handlers
+from bench_handlers import compare, load_baseline, run_suite
+
+# По CPU сравниваем, только если задан допуск:
+#   BENCH_CPU_TOLERANCE=1.5 python -m pytest tests/test_bench.py
+CPU_TOLERANCE = os.environ.get("BENCH_CPU_TOLERANCE")
+
+
+def test_handlers_do_not_regress_against_baseline():
+    baseline = load_baseline()
+    results = asyncio.run(run_suite(n=30))
+    assert set(results) <= set(baseline), "новые сценарии: python tests/bench_handlers.py --update"
+    if CPU_TOLERANCE:
+        assert compare(results, baseline, cpu_tolerance=float(CPU_TOLERANCE)) == []
+    else:
+        assert compare(results, baseline, check_cpu=False) == []
+
+
+def test_compare_flags_extra_api_call_and_slowdown():
+    ref = {"click": {"cpu_us": 100.0, "peak_kib": 10.0, "retained_b": 200, "api_calls": 2,
+                     "api": ["answerCallbackQuery", "editMessageMedia"]}}
+    same = {"click": dict(ref["click"], cpu_us=120.0)}
+    assert compare(same, ref) == []
+    worse = {"click": dict(ref["click"], cpu_us=400.0, api_calls=3,
+                           api=["answerCallbackQuery", "editMessageMedia", "sendMessage"])}
+    problems = compare(worse, ref)
+    assert len(problems) == 2 and "sendMessage" in problems[0]
+    assert compare(worse, ref, check_cpu=False) == [problems[0]]
+
+
+def test_baseline_covers_every_scenario():
+    names = {s.name for s in bench_handlers.scenarios()}
+    assert names <= set(load_baseline())
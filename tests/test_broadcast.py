@@ -0,0 +1,170 @@
+# tests/test_broadcast.py
+# Рассылка: вся аудитория, заблокировавшие выпадают из следующих рассылок,
+# фото заливается один раз, после падения воркера — продолжение с курсора.
+
+import json
+import asyncio
+from collections import Counter
+
+from telegram.ext import Application
+
+import bot
+from broadcast import AudienceStore, Broadcaster, describe
+from media_cache import MediaCache
+from ratelimit import OutboundLimiter
+from telegram_stub import StubRequest
+
+
+class AudienceStub(StubRequest):
+    """Bot API, где часть пользователей заблокировала бота или удалила аккаунт."""
+
+    def __init__(self, blocked=(), gone=(), latency=0.0):
+        super().__init__(latency)
+        self.blocked = set(blocked)
+        self.gone = set(gone)
+        self.sent = Counter()       # chat_id → сколько сообщений получил
+        self.photos = []            # что ушло в поле photo
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        chat_id = int(params.get("chat_id", 0))
+        if endpoint in ("sendMessage", "sendPhoto"):
+            if chat_id in self.blocked:
+                return 403, json.dumps({"ok": False, "error_code": 403,
+                                        "description": "Forbidden: bot was blocked by the user"}).encode()
+            if chat_id in self.gone:
+                return 400, json.dumps({"ok": False, "error_code": 400,
+                                        "description": "Bad Request: chat not found"}).encode()
+        result = await super().do_request(url, method, request_data, **kwargs)
+        if endpoint in ("sendMessage", "sendPhoto"):
+            self.sent[chat_id] += 1
+        if endpoint == "sendPhoto":
+            self.photos.append(params.get("photo"))
+        return result
+
+
+async def _bot(stub):
+    limiter = OutboundLimiter(global_rate=10000, chat_rate=100, chat_burst=100)
+    app = Application.builder().token("123456:TEST").request(stub) \
+        .get_updates_request(StubRequest()).rate_limiter(limiter).build()
+    await app.initialize()
+    return app.bot
+
+
+def _audience(tmp_path, n):
+    store = AudienceStore(str(tmp_path / "broadcast.sqlite3"))
+    store.add_many(range(1, n + 1))
+    return store
+
+
+def test_delivers_to_everyone_and_prunes_blocked(tmp_path):
+    store = _audience(tmp_path, 50)
+    stub = AudienceStub(blocked={7, 20}, gone={33})
+
+    async def main():
+        sender = Broadcaster(store, await _bot(stub), rate=10000, concurrency=8, chunk=16)
+        reports = []
+
+        async def report(run, progress):
+            reports.append(progress)
+        sender.on_progress = report
+
+        for _ in range(2):
+            await sender.enqueue({"text": "Открыли продажи в новом посёлке"})
+            run = store.claim(sender.owner, lease=60)
+            assert await sender.execute(run) == "done"
+        return reports
+
+    reports = asyncio.run(main())
+    first, second = store.runs()[::-1]
+    assert (first["status"], first["total"], first["sent"], first["blocked"]) == ("done", 50, 47, 3)
+    assert (second["total"], second["sent"], second["blocked"]) == (47, 47, 0)
+    assert all(stub.sent[cid] == 2 for cid in range(1, 51) if cid not in (7, 20, 33))
+    assert store.stats() == {"active": 47, "blocked": 3}
+    assert "50/50 (100%)" in describe(reports[0])
+    store.add(7)  # разблокировал и снова нажал /start
+    assert store.stats() == {"active": 48, "blocked": 2}
+
+
+def test_photo_is_uploaded_once_then_sent_by_file_id(tmp_path):
+    store = _audience(tmp_path, 20)
+    photo = tmp_path / "village.jpg"
+    photo.write_bytes(b"\xff\xd8" + b"x" * 2000)
+    cache = MediaCache(str(tmp_path / "media_cache.json"))
+    stub = AudienceStub(blocked={1})  # первый получатель заблокировал — заливает следующий
+
+    async def main():
+        sender = Broadcaster(store, await _bot(stub), media_cache=cache, rate=10000, concurrency=8)
+        await sender.enqueue({"text": "Новый проект", "photo": str(photo)})
+        return await sender.execute(store.claim(sender.owner, lease=60))
+
+    assert asyncio.run(main()) == "done"
+    assert len(stub.photos) == 19
+    assert sum(p != "PHOTO_ID" for p in stub.photos) == 1
+    assert cache.get(str(photo)) == "PHOTO_ID"
+
+
+def test_resumes_from_checkpoint_after_worker_crash(tmp_path):
+    store = _audience(tmp_path, 300)
+    stub = AudienceStub(latency=0.005)
+
+    class Dead:
+        """Упавший процесс: прогресс больше не пишется."""
+        def checkpoint(self, *args, **kwargs):
+            raise OSError("worker died")
+
+    async def main():
+        bot = await _bot(stub)
+        first = Broadcaster(store, bot, rate=10000, concurrency=8, chunk=32, lease=0.2, checkpoint_every=0.02)
+        await first.enqueue({"text": "Новая локация"})
+        task = asyncio.create_task(first.execute(store.claim(first.owner, lease=0.2)))
+        while sum(stub.sent.values()) < 100:
+            await asyncio.sleep(0.01)
+        first.store = Dead()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        sent_before = sum(stub.sent.values())
+
+        assert store.claim("other", lease=0.2) is None  # аренда ещё не истекла
+        await asyncio.sleep(0.25)
+        run = store.claim("other", lease=0.2)
+        second = Broadcaster(store, bot, rate=10000, concurrency=8, chunk=32)
+        second.owner = "other"
+        resumed_from = run.cursor
+        assert await second.execute(run) == "done"
+        return sent_before, resumed_from
+
+    sent_before, resumed_from = asyncio.run(main())
+    assert set(stub.sent) == set(range(1, 301))
+    assert 1 <= resumed_from <= sent_before
+    # повтор — только отправленное после последнего курсора (полёт + один интервал записи)
+    repeats = sum(stub.sent.values()) - 300
+    assert repeats == sent_before - resumed_from
+    assert repeats < 60
+    assert store.runs()[0]["status"] == "done"
+
+
+def test_broadcasts_start_once_application_is_initialized(monkeypatch):
+    started = []
+
+    async def watch():
+        started.append("broadcasts")
+
+    async def initialize(self):
+        pass
+
+    monkeypatch.setattr(bot.BROADCASTER, "watch", watch)
+    monkeypatch.setattr(type(bot.application), "initialize", initialize)
+    monkeypatch.setattr(bot, "_initialized", False)
+    monkeypatch.setattr(bot, "_init_done", asyncio.Event())
+
+    async def main():
+        task = asyncio.create_task(bot.run_broadcasts())
+        await asyncio.sleep(0.05)
+        assert started == []          # ждёт initialize, а не опрашивает флаг
+        await bot.ensure_initialized()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert started == ["broadcasts"]
@@ -0,0 +1,76 @@
+# tests/test_callbacks.py
+# Компактный callback_data: схема с версией, старые кнопки, устаревшие кнопки.
+
+import asyncio
+
+import pytest
+
+import bot
+from callbacks import LIMIT, LOC, LOCS, MENU, CallbackRouter, decode, encode
+from catalog import CatalogError, validate
+from telegram_stub import callback_update, make_app
+
+
+def test_encode_decode_and_legacy():
+    assert encode(LOC, "shopino") == "1l:shopino" and encode(MENU) == "1m"
+    assert decode("1l:shopino") == (LOC, "shopino", "v1")
+    assert decode("1L") == (LOCS, "", "v1")
+    assert decode("loc:ВеснаЛэнд (Черносвитино)") == (LOC, "ВеснаЛэнд (Черносвитино)", "legacy")
+    assert decode("back_to_menu") == (MENU, "", "legacy")
+    for stale in ("9l:shopino", "1lshopino", "", "something", "x:y"):
+        assert decode(stale) is None, stale
+    with pytest.raises(ValueError):
+        encode(LOC, "a" * LIMIT)
+
+
+def test_router_table():
+    router = CallbackRouter()
+
+    @router.route(LOC)
+    async def on_loc(update, context, key):
+        pass
+
+    assert router.resolve("1l:x")[0] is on_loc and router.resolve("loc:Шопино")[1].arg == "Шопино"
+    assert router.resolve("1p:x") == (None, None)  # тег без маршрута
+    with pytest.raises(ValueError):
+        router.route(LOC)(on_loc)
+
+
+def test_catalog_buttons_are_compact():
+    for markup in (bot.CATALOG.locations_markup, bot.CATALOG.projects_markup):
+        for row in markup.inline_keyboard:
+            data = row[0].callback_data
+            assert data.startswith("1") and len(data.encode()) <= 16, data
+    entry = bot.CATALOG.location("shopino")
+    assert entry is bot.CATALOG.location("Шопино")
+    assert entry.markup.inline_keyboard[-2][0].callback_data == encode(LOCS)
+
+
+def test_catalog_rejects_duplicate_slug():
+    raw = {"locations": [{"name": "А", "slug": "a", "description": ""},
+                         {"name": "Б", "slug": "a", "description": ""}],
+           "projects": [{"name": "П", "slug": "p", "description": ""}]}
+    with pytest.raises(CatalogError, match="повтор slug"):
+        validate(raw)
+
+
+def test_new_legacy_and_stale_buttons_in_handlers(monkeypatch):
+    monkeypatch.setattr(bot, "NAV_MODE", "classic")
+    monkeypatch.setattr(bot.MEDIA_CACHE, "get", lambda path: "PHOTO_ID")
+    stale0 = bot.CALLBACK_TOTAL.value("stale", "unknown")
+
+    async def main():
+        app, stub = await make_app()
+        seen = {}
+        for data in (encode(LOC, "shopino"), "loc:Шопино", "2l:shopino"):
+            stub.calls.clear()
+            await app.process_update(callback_update(app, data))
+            seen[data] = list(stub.calls)
+        await app.shutdown()
+        return seen
+
+    seen = asyncio.run(main())
+    assert seen["1l:shopino"] == seen["loc:Шопино"] == ["answerCallbackQuery", "editMessageText", "sendPhoto"]
+    # устаревшая кнопка не проваливается молча: ответ с пояснением и меню
+    assert seen["2l:shopino"] == ["answerCallbackQuery", "sendMessage"]
+    assert bot.CALLBACK_TOTAL.value("stale", "unknown") == stale0 + 1
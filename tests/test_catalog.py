@@ -0,0 +1,33 @@
+# tests/test_catalog.py
+# Каталог из файла: правка подхватывается, битый файл не ломает текущий каталог.
+
+import json
+import os
+import shutil
+
+from catalog import CatalogSource, build_catalog
+
+
+def _source(path):
+    return CatalogSource(str(path), build=lambda raw: build_catalog(
+        raw, asset_url=lambda rel: f"https://bot.example/static/{rel}", local_path_of=lambda url: None))
+
+
+def test_reload_on_change_and_keep_old_on_error(tmp_path):
+    path = tmp_path / "catalog.json"
+    shutil.copy(os.path.join(os.path.dirname(__file__), "..", "static", "catalog.json"), path)
+    source = _source(path)
+    catalog = source.load()
+    assert "Шопино" in catalog.locations
+    assert source.poll() is None  # ничего не менялось
+
+    raw = json.loads(path.read_text(encoding="utf-8"))
+    raw["locations"].append({"name": "Новый посёлок", "slug": "novyi", "description": "Скоро."})
+    path.write_text(json.dumps(raw, ensure_ascii=False), encoding="utf-8")
+    fresh = source.poll()
+    assert fresh.location("Новый посёлок").caption == "<b>Новый посёлок</b>\nСкоро."
+    assert "Новый посёлок" not in catalog.locations  # старый объект не тронут
+
+    raw["projects"][0]["slug"] = "Не Слаг"
+    path.write_text(json.dumps(raw, ensure_ascii=False), encoding="utf-8")
+    assert source.poll() is None
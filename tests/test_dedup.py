@@ -0,0 +1,36 @@
+# tests/test_dedup.py
+# Повтор update_id отсекается в обоих режимах; sqlite общий для «воркеров».
+
+import asyncio
+
+from dedup import MemoryDedup, SqliteDedup
+
+
+def test_memory_window_is_bounded():
+    async def main():
+        d = MemoryDedup(ttl=60, max_size=2)
+        assert not await d.seen(1)
+        assert await d.seen(1)
+        assert not await d.seen(2) and not await d.seen(3)
+        # 1 вытеснен по размеру окна
+        assert not await d.seen(1)
+        await d.forget(1)
+        assert not await d.seen(1)
+        return d.stats()
+
+    stats = asyncio.run(main())
+    assert stats["duplicates"] == 1 and stats["size"] == 2
+
+
+def test_sqlite_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "dedup.sqlite3")
+
+    async def main():
+        a, b = SqliteDedup(path), SqliteDedup(path)
+        assert not await a.seen(42)
+        assert await b.seen(42)
+        await b.forget(42)
+        assert not await a.seen(42)
+        return b.stats()
+
+    assert asyncio.run(main())["duplicates"] == 1
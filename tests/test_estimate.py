@@ -0,0 +1,156 @@
+# tests/test_estimate.py
+# Расчёт стоимости: тензор цен совпадает с формулой, «лучшее в бюджете»
+# совпадает с полным перебором, прайс перечитывается без остановки запросов.
+
+import json
+import os
+import asyncio
+import itertools
+
+import numpy as np
+import pytest
+
+import bot
+from estimate import PriceSource, build_estimator, parse_request, validate_prices
+from catalog import CatalogError
+from telegram_stub import make_app, text_update
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "static")
+
+
+def _raw(name):
+    folder = os.path.dirname(__file__) if name == "prices_sample.json" else ROOT
+    with open(os.path.join(folder, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _estimator():
+    return build_estimator(_raw("catalog.json"), validate_prices(_raw("prices_sample.json")))
+
+
+def test_tensor_matches_price_formula():
+    est, prices, catalog = _estimator(), _raw("prices_sample.json"), _raw("catalog.json")
+    assert est.shape == (4, 10, 3, 3, 2)
+    proj = catalog["projects"][1]
+    area = sum(a for _, a in proj["rooms"])
+    loc = prices["locations"]["elovka"]
+    expected = (area * (prices["projects"][proj["slug"]]["m2"] + prices["finishing"][2]["m2"]) * loc["coef"]
+                + prices["utilities"][1]["price"] + loc["lot"])
+    p, l = est.index("project", "vesna98"), est.index("location", "Еловка")
+    assert abs(est.prices[p, l, 2, 1, 0] - expected) <= 5000   # округление до 10 тыс.
+    table = est.table("project", "finishing", location="elovka")
+    assert table.shape == (4, 3) and (np.diff(table, axis=1) > 0).all()
+    assert est.table("finishing", "project", location="elovka").T.tolist() == table.tolist()
+
+
+def _brute(est, budget, **filters):
+    """Полный перебор тем же критерием: площадь, сети, отделка, участок, цена."""
+    best = None
+    for p, l, f, u, k in itertools.product(*(range(n) for n in est.shape)):
+        fixed = {a: est.index(a, v) for a, v in filters.items()}
+        if any(fixed.get(a) not in (None, i) for a, i in zip(("project", "location", "finishing",
+                                                                "utilities", "lot"), (p, l, f, u, k))):
+            continue
+        price = est.prices[p, l, f, u, k]
+        if price > budget:
+            continue
+        key = (-est.area[p], -u, -f, k, price)
+        if best is None or key < best[0]:
+            best = (key, price)
+    return None if best is None else best[1]
+
+
+def test_best_fit_matches_brute_force_and_batch():
+    est = _estimator()
+    rng = np.random.default_rng(7)
+    budgets = rng.uniform(5e6, 16e6, size=40)
+    for filters in ({}, {"lot": "с участком"}, {"location": "shopino", "finishing": "под ключ"}):
+        batch = est.best_fit_many(budgets, **filters)
+        for budget, flat in zip(budgets, batch):
+            expected = _brute(est, budget, **filters)
+            quote = est.best_fit(budget, **filters)
+            assert (quote.price if quote else None) == expected
+            assert (est.quote(flat).price if flat >= 0 else None) == expected
+    big = est.best_fit(20e6, area_min=100)
+    assert big.area >= 100 and big.finishing == "под ключ"
+    assert est.best_fit(1e6) is None
+    with pytest.raises(KeyError):
+        est.best_fit(9e6, location="Атлантида")
+
+
+def test_parse_request():
+    assert parse_request("9 млн") == {"budget": 9e6, "area_min": None, "own_lot": False}
+    assert parse_request("8 500 000")["budget"] == 8.5e6
+    assert parse_request("9,5 млн")["budget"] == 9.5e6
+    assert parse_request("от 100 м² до 12 млн на своём участке") == \
+        {"budget": 12e6, "area_min": 100.0, "own_lot": True}
+    assert parse_request("7500 тыс")["budget"] == 7.5e6
+    assert parse_request("бюджет 9 млн 500 тыс")["budget"] == 9.5e6
+    assert parse_request("9 млн и 200 к, свой участок")["budget"] == 9.2e6
+    assert parse_request("было 8 млн, стало 10 млн")["budget"] == 10e6   # не соседние — последняя сумма
+    assert parse_request("привет") is None and parse_request("100 м2") is None
+
+
+def test_price_sheet_reload_swaps_estimator(tmp_path):
+    path = tmp_path / "prices.json"
+    prices = _raw("prices_sample.json")
+    path.write_text(json.dumps(prices, ensure_ascii=False), encoding="utf-8")
+    source = PriceSource(str(path), build=lambda raw: build_estimator(_raw("catalog.json"), raw))
+    old = source.load()
+    assert source.poll() is None
+
+    prices["projects"]["vesna90"]["m2"] += 10000
+    del prices["locations"]["gruzdovo"]
+    path.write_text(json.dumps(prices, ensure_ascii=False), encoding="utf-8")
+    fresh = source.poll()
+    assert fresh.shape[1] == 9 and "Груздово" not in fresh.location_names
+    assert fresh.min_by_project[0] > old.min_by_project[0]
+    assert old.shape[1] == 10  # старый объект не тронут — запросы в полёте досчитают по нему
+
+    path.write_text('{"projects": {}}', encoding="utf-8")
+    assert source.poll() is None
+    with pytest.raises(CatalogError):
+        validate_prices({"projects": {"x": {"m2": -1}}, "locations": {"y": {"lot": 0}}})
+
+
+def test_calc_button_and_budget_reply():
+    async def main():
+        app, stub = await make_app()
+        await app.process_update(text_update(app, "🧮 Расчёт стоимости", chat_id=41))
+        assert app.user_data[41]["state"] == "CALC"
+        await app.process_update(text_update(app, "10 млн", chat_id=41))
+        await app.process_update(text_update(app, "👨‍💼 Связаться с менеджером", chat_id=41))
+        state = app.user_data[41]["state"]
+        await app.shutdown()
+        return stub.calls, state
+
+    calls, state = asyncio.run(main())
+    assert calls == ["sendMessage"] * 3 and state == "LEAD"
+    reply = bot.answer(bot.ESTIMATOR, parse_request("10 млн"))
+    assert "лучший вариант" in reply and "Весна" in reply
+
+
+def test_own_lot_is_chosen_by_key_not_position():
+    prices = _raw("prices_sample.json")
+    prices["lot"].reverse()                         # «на своём участке» теперь первый
+    est = build_estimator(_raw("catalog.json"), validate_prices(prices))
+    assert est.own_lot == "на своём участке"
+    assert "на своём участке" in bot.answer(est, parse_request("12 млн на своём участке"))
+    assert "с участком" in bot.answer(est, parse_request("12 млн"))
+    prices["lot"][1]["own"] = True
+    with pytest.raises(CatalogError):
+        validate_prices(prices)
+
+
+def test_without_price_sheet_calc_goes_to_manager(monkeypatch):
+    monkeypatch.setattr(bot, "ESTIMATOR", None)
+
+    async def main():
+        app, stub = await make_app()
+        await app.process_update(text_update(app, "🧮 Расчёт стоимости", chat_id=44))
+        state = app.user_data[44].get("state")
+        await app.shutdown()
+        return stub, state
+
+    stub, state = asyncio.run(main())
+    assert stub.calls == ["sendMessage"] and state != "CALC"
@@ -0,0 +1,48 @@
+# tests/test_images.py
+# Облегчённая копия: не больше 1280 px, без EXIF, новая при смене исходника.
+
+import os
+import threading
+
+import pytest
+
+from images import Derivatives
+from media_cache import file_digest
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def test_tg_variant_is_capped_and_stripped(tmp_path):
+    src = tmp_path / "big.jpg"
+    exif = Image.Exif()
+    exif[0x010F] = "Camera"
+    Image.new("RGB", (3000, 2000), "green").save(src, quality=95, exif=exif)
+
+    images = Derivatives(str(tmp_path / "derived"), digest_of=file_digest)
+    out = images.for_upload(str(src))
+    assert out != str(src) and os.path.getsize(out) < os.path.getsize(src)
+    with Image.open(out) as im:
+        assert max(im.size) == 1280
+        assert not im.getexif()
+    with Image.open(images.get(str(src), "thumb")) as im:
+        assert max(im.size) == 320
+
+    Image.new("RGB", (3000, 2000), "red").save(src, quality=95)
+    assert images.for_upload(str(src)) != out
+
+
+def test_parallel_renders_do_not_share_temp_files(tmp_path):
+    src = tmp_path / "big.jpg"
+    Image.new("RGB", (2400, 1600), "blue").save(src, quality=95)
+    images = Derivatives(str(tmp_path / "derived"), digest_of=file_digest)
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(images.for_upload(str(src)))) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(out)) == 1 and out[0] != str(src)
+    assert os.listdir(tmp_path / "derived") == [os.path.basename(out[0])]
+    with Image.open(out[0]) as im:
+        im.load()
+        assert max(im.size) == 1280
@@ -0,0 +1,92 @@
+# tests/test_inline.py
+# Inline-режим: префиксы и опечатки находят нужные карточки, страницы идут
+# по next_offset, фото — по file_id из кэша, ссылка из карточки открывает её в боте.
+
+import asyncio
+
+from telegram import Update
+
+import bot
+from inline_search import build_search, deep_link, parse_start
+from telegram_stub import StubRequest, make_app, text_update
+
+
+def _names(found):
+    return [e.name for e in found]
+
+
+def test_prefix_typo_and_pagination():
+    search = build_search(bot.CATALOG, page_size=4)
+    assert _names(search.search("вес 9"))[:2] == ["Весна 90", "Весна 98"]
+    assert _names(search.search("  ВЕСНА, 112!")) == ["Весна 112"]
+    assert _names(search.search("шапино")) == ["Шопино"]          # опечатка
+    assert _names(search.search("гросдово")) == ["Груздово"]
+    assert _names(search.search("кп")) == ["КП Южный", "КП Московский"]
+    assert search.search("qwerty") == ()
+    assert search.search("весна 112") is search.search("Весна  112")   # из кэша
+    assert search.hits == 2
+
+    pages, offset = [], ""
+    while True:
+        page, offset = search.page("", offset)
+        pages.append(page)
+        if not offset:
+            break
+    assert [len(p) for p in pages] == [4, 4, 4, 2]
+    assert sum(pages, ()) == search.search("")
+
+
+def test_deep_link_roundtrip():
+    entry = bot.CATALOG.project("vesna90")
+    link = deep_link("mrhouse_bot", entry)
+    assert link == "https://t.me/mrhouse_bot?start=p-vesna90"
+    assert parse_start(link.rsplit("=", 1)[1]) == ("proj", "vesna90")
+    assert parse_start("ref42") is None and deep_link(None, entry) is None
+
+
+class InlineStub(StubRequest):
+    def __init__(self):
+        super().__init__()
+        self.answers = []
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        if url.endswith("/answerInlineQuery"):
+            self.answers.append(request_data.parameters)
+        return await super().do_request(url, method, request_data, **kwargs)
+
+
+def _inline_update(app, query, offset=""):
+    return Update.de_json({"update_id": 900, "inline_query": {
+        "id": "iq", "query": query, "offset": offset, "chat_type": "sender",
+        "from": {"id": 55, "is_bot": False, "first_name": "U"}}}, app.bot)
+
+
+def test_inline_answer_uses_cached_file_id():
+    shopino = bot.CATALOG.location("shopino")
+    bot.MEDIA_CACHE.put(shopino.local_path, "SHOPINO_ID")
+
+    async def main():
+        app, stub = await make_app(request=InlineStub())
+        await app.process_update(_inline_update(app, "шоп"))
+        await app.process_update(_inline_update(app, "", offset="20"))
+        await app.shutdown()
+        return stub.answers
+
+    first, second = asyncio.run(main())
+    results = first["results"]
+    assert first["cache_time"] == bot.INLINE_CACHE_TIME and first["next_offset"] == ""
+    assert results[0]["type"] == "photo" and results[0]["photo_file_id"] == "SHOPINO_ID"
+    urls = [row[0]["url"] for row in results[0]["reply_markup"]["inline_keyboard"]]
+    assert urls[-1] == "https://t.me/mrhouse_bot?start=l-shopino"
+    assert second["results"] == []   # каталог — 14 карточек, вторая страница пуста
+
+
+def test_start_deep_link_sends_card():
+    async def main():
+        app, stub = await make_app()
+        await app.process_update(text_update(app, "/start p-vesna112", chat_id=56))
+        await app.shutdown()
+        return stub.calls
+
+    calls = asyncio.run(main())
+    assert calls[-1] == "sendPhoto" and calls.count("sendPhoto") == 2
@@ -0,0 +1,122 @@
+# tests/test_knowledge.py
+# База знаний: стеммер сводит словоформы, BM25 по файлу индекса совпадает
+# с подсчётом «в лоб», повторный вопрос — из кэша, подмена файла подхватывается.
+
+import os
+import json
+import math
+import asyncio
+import threading
+from collections import Counter
+
+import bot
+from knowledge import KnowledgeBase, build_index, catalog_passages, stem, terms
+from telegram_stub import make_app, text_update
+
+ROOT = os.path.join(os.path.dirname(__file__), "..", "static")
+
+
+def _docs():
+    with open(os.path.join(ROOT, "catalog.json"), encoding="utf-8") as f:
+        return catalog_passages(json.load(f))
+
+
+def test_stemmer_folds_word_forms():
+    assert {stem(w) for w in ("спальня", "спальни", "спальнях")} == {"спальн"}
+    assert stem("посёлке") == stem("посёлка") == "поселк"
+    assert stem("детская") == stem("детской") == "детск"
+    assert stem("красивейший") == "красив"
+    assert terms("Где есть детская и 2 санузла?") == ["детск", "2", "санузл"]
+
+
+def _brute(docs, question, k1=1.2, b=0.75):
+    bags = [Counter(terms(f"{d['title']} {d['text']}")) for d in docs]
+    avgdl = sum(sum(bag.values()) for bag in bags) / len(bags)
+    scores = [0.0] * len(docs)
+    for term in set(terms(question)):
+        df = sum(term in bag for bag in bags)
+        idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+        for i, bag in enumerate(bags):
+            tf = bag[term]
+            if tf:
+                scores[i] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * sum(bag.values()) / avgdl))
+    return scores
+
+
+def test_index_scores_match_brute_force_and_cache(tmp_path):
+    docs = _docs()
+    path = str(tmp_path / "knowledge.idx")
+    summary = build_index(docs, path)
+    assert summary["docs"] == len(docs)
+    kb = KnowledgeBase(path)
+    for question in ("посёлок у леса с озером", "сколько спален в Весна 112", "кабинет и гардеробная",
+                     "видео", "терраса"):
+        expected = _brute(docs, question)
+        found = kb.ask(question, k=len(docs))
+        assert [d["title"] for d, _ in found] == \
+            [docs[i]["title"] for i in sorted(range(len(docs)), key=lambda i: -expected[i]) if expected[i] > 0]
+        for doc, score in found:
+            assert abs(score - expected[docs.index(doc)]) < 1e-3   # длины в индексе — uint16, tf точный
+    assert kb.ask("Весна 112 сколько спален?", k=len(docs)) is kb.ask("сколько спален в Весна 112", k=len(docs))
+    assert kb.hits == 2 and kb.ask("абракадабра") == [] and kb.ask("и в на") == []
+
+
+def test_replaced_index_is_picked_up(tmp_path):
+    path = str(tmp_path / "knowledge.idx")
+    build_index(_docs(), path)
+    kb = KnowledgeBase(path)
+    assert kb.ask("баня") == []
+    build_index([{"kind": "proj", "slug": "vesna90", "title": "Весна 90, презентация",
+                  "text": "Баня и терраса на участке", "page": 12}], path)
+    kb._checked = 0  # не ждём RECHECK
+    (doc, _), = kb.ask("баня")
+    assert doc["page"] == 12 and kb.stats()["docs"] == 1
+
+
+def test_concurrent_rebuilds_and_questions(tmp_path):
+    path = str(tmp_path / "knowledge.idx")
+    build_index(_docs(), path)
+    kb = KnowledgeBase(path, cache_size=4)
+    errors = []
+
+    def ask():
+        try:
+            for n in range(300):
+                kb._checked = 0  # заставляем перепроверять файл на каждом вопросе
+                kb.ask(("терраса", "кабинет", "видео", "баня", "озеро")[n % 5])
+        except Exception as e:
+            errors.append(e)
+
+    def rebuild():
+        try:
+            for _ in range(20):
+                build_index(_docs(), path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fn) for fn in (ask, ask, ask, ask, rebuild, rebuild)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [] and os.listdir(tmp_path) == ["knowledge.idx"]
+
+
+def test_ask_button_answers_from_index():
+    bot.refresh_knowledge()
+
+    async def main():
+        app, stub = await make_app()
+        await app.process_update(text_update(app, "🤖 Задать вопрос ИИ", chat_id=43))
+        assert app.user_data[43]["state"] == "ASK"
+        await app.process_update(text_update(app, "Где школы и сады рядом?", chat_id=43))
+        await app.process_update(text_update(app, "🏗️ Проекты", chat_id=43))
+        await app.shutdown()
+        return stub.calls
+
+    assert asyncio.run(main())[:2] == ["sendMessage", "sendMessage"]
+    text, markup = bot.knowledge_reply(bot.KNOWLEDGE.ask("какая площадь кухни в Весна 112"))
+    assert text.splitlines()[2] == "<b>Весна 112</b>"
+    first = markup.inline_keyboard[0]
+    assert first[0].text == "🏡 Весна 112" and first[1].url.startswith("https://bot.example/static/projects/")
+    assert bot.knowledge_reply([]) is None
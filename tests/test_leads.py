@@ -0,0 +1,157 @@
+# tests/test_leads.py
+# Заявки: хендлер отвечает сразу, заявки пишутся пачками, CRM с отказами
+# получает каждую ровно один раз, недоставленное переживает остановку.
+
+import time
+import asyncio
+
+import httpx
+from telegram import Update
+
+import bot
+from callbacks import PROJ, encode
+from fake_telegram import FakeBotApi
+from leads import CrmWebhook, LeadQueue, LeadStore
+from telegram_stub import callback_update, make_app, text_update
+
+
+async def _until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "не дождались"
+        await asyncio.sleep(0.01)
+
+
+def test_batches_and_retries_flaky_crm_exactly_once(tmp_path):
+    store = LeadStore(str(tmp_path / "leads.sqlite3"))
+    writes = []
+    add_many = store.add_many
+    store.add_many = lambda leads, targets: writes.append(len(leads)) or add_many(leads, targets)
+    api = FakeBotApi(crm_latency=0.01, crm_fail=0.5, seed=3)
+    managers = []
+
+    async def to_managers(lead_id, lead):
+        managers.append(lead_id)
+
+    async def main():
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app()), base_url="http://crm")
+        crm = CrmWebhook("http://crm/crm", client=client)
+        queue = LeadQueue(store, {"managers": to_managers, "crm": crm}, linger=0.05, retry_base=0.01,
+                          retry_cap=0.05, poll=0.02)
+        runner = asyncio.create_task(queue.run())
+        started = time.perf_counter()
+        for i in range(30):
+            queue.submit({"chat_id": i, "phone": f"+7910000{i:04d}"})
+        submit_s = time.perf_counter() - started
+        await _until(lambda: store.stats(10)["total"] == 30 and store.stats(10)["pending"] == 0)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        await crm.close()
+        return submit_s
+
+    submit_s = asyncio.run(main())
+    assert submit_s < 0.01
+    assert sum(writes) == 30 and len(writes) <= 3              # пачками, а не по одной
+    assert sorted(managers) == list(range(1, 31))                # менеджерам — без повторов
+    assert len(api.crm_leads) == 30 and api.crm_calls["failed"] > 0
+    assert {lead["phone"] for lead in api.crm_leads.values()} == {f"+7910000{i:04d}" for i in range(30)}
+
+
+def test_undelivered_leads_survive_restart(tmp_path):
+    path = str(tmp_path / "leads.sqlite3")
+    delivered = []
+
+    async def down(lead_id, lead):
+        raise ConnectionError("CRM недоступна")
+
+    async def up(lead_id, lead):
+        delivered.append(lead["phone"])
+
+    async def first_worker():
+        queue = LeadQueue(LeadStore(path), {"crm": down}, linger=10, retry_base=0.01, max_attempts=2, poll=0.02)
+        runner = asyncio.create_task(queue.run())
+        queue.submit({"phone": "+79100000001"})
+        await asyncio.sleep(0.05)         # ещё копится пачка — запишет остановка
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        queue = LeadQueue(LeadStore(path), {"crm": down}, retry_base=0.01, max_attempts=2, poll=0.02)
+        runner = asyncio.create_task(queue.run())
+        await _until(lambda: queue.store.stats(2)["failed"] == 1)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+    async def second_worker():
+        queue = LeadQueue(LeadStore(path), {"crm": up}, max_attempts=5, poll=0.02)
+        runner = asyncio.create_task(queue.run())
+        await _until(lambda: delivered)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        return queue.store
+
+    asyncio.run(first_worker())
+    store = asyncio.run(second_worker())   # подняли лимит попыток — дошло
+    assert delivered == ["+79100000001"] and store.stats(5) == {"total": 1, "pending": 0, "failed": 0}
+    assert store.recent()[0]["error"] is None
+
+
+def _contact_update(app, chat_id, phone, owner=None):
+    return Update.de_json({"update_id": 950 + chat_id, "message": {
+        "message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "Анна", "username": "anna"},
+        "contact": {"phone_number": phone, "first_name": "Анна", "user_id": owner or chat_id}}}, app.bot)
+
+
+def test_contact_button_queues_lead_with_viewed_project():
+    assert bot.parse_phone("8 (910) 123-45-67") == "+79101234567"
+    assert bot.parse_phone("9101234567") == bot.parse_phone("+7 910 123 45 67") == "+79101234567"
+    assert bot.parse_phone("позвоните мне") is None and bot.parse_phone("12345") is None
+
+    async def main():
+        app, stub = await make_app()
+        await app.process_update(callback_update(app, encode(PROJ, "vesna98"), chat_id=57))
+        await app.process_update(_contact_update(app, 57, "+79990000000"))    # не в LEAD — не заявка
+        stub.calls.clear()
+        await app.process_update(text_update(app, "👨‍💼 Связаться с менеджером", chat_id=57))
+        assert app.user_data[57]["state"] == "LEAD"
+        await app.process_update(_contact_update(app, 57, "+79990000000", owner=99))  # чужой контакт
+        assert app.user_data[57]["state"] == "LEAD"
+        await app.process_update(_contact_update(app, 57, "79101234567"))
+        await app.process_update(text_update(app, "👨‍💼 Связаться с менеджером", chat_id=58))
+        await app.process_update(text_update(app, "+7 910 765-43-21", chat_id=58))
+        state = app.user_data[57]["state"]
+        await app.shutdown()
+        return stub.calls, state
+
+    accepted = bot.LEADS.accepted
+    calls, state = asyncio.run(main())
+    assert calls == ["sendMessage"] * 5 and state == "MAIN"     # ответ сразу, без записи и пересылки
+    assert bot.LEADS.accepted == accepted + 2
+    first, second = (bot.LEADS._queue.get_nowait() for _ in range(2))
+    assert (first["phone"], first["project"], first["username"]) == ("+79101234567", "Весна 98", "anna")
+    assert (second["phone"], second["source"]) == ("+79107654321", "text")
+    assert "Весна 98" in bot.format_lead(1, first)
+
+
+def test_lead_delivery_waits_for_initialize(monkeypatch):
+    started = []
+
+    async def run():
+        started.append("leads")
+
+    async def initialize(self):
+        pass
+
+    monkeypatch.setattr(bot.LEADS, "run", run)
+    monkeypatch.setattr(type(bot.application), "initialize", initialize)
+    monkeypatch.setattr(bot, "_initialized", False)
+    monkeypatch.setattr(bot, "_init_done", asyncio.Event())
+
+    async def main():
+        task = asyncio.create_task(bot.run_leads())
+        await asyncio.sleep(0.05)
+        assert started == []
+        await bot.ensure_initialized()
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert started == ["leads"]
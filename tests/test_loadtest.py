@@ -0,0 +1,134 @@
+# tests/test_loadtest.py
+# Запись/воспроизведение вебхуков и фейковый Bot API для нагрузочных прогонов.
+
+import json
+import asyncio
+from collections import Counter
+
+import httpx
+from starlette.testclient import TestClient
+from telegram import Update
+
+import bot
+from fake_telegram import FakeBotApi
+from loadtest import UpdateRecorder, anonymize, load_updates, percentile, replay, report, synthetic_sessions
+from telegram_stub import make_app
+
+
+def _message(text, user_id=555, chat_id=555):
+    return {"update_id": 1, "message": {
+        "message_id": 3, "date": 0, "text": text,
+        "chat": {"id": chat_id, "type": "private", "first_name": "Иван", "username": "ivan"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Иван", "last_name": "П", "username": "ivan"},
+        "contact": {"phone_number": "+79990000000", "first_name": "Иван"},
+    }}
+
+
+def test_anonymize_strips_personal_data_and_keeps_routing():
+    a, b = anonymize(_message("мой телефон 8999"), salt="s"), anonymize(_message("/start"), salt="s")
+    msg = a["message"]
+    assert msg["from"] == {"id": msg["from"]["id"], "is_bot": False, "first_name": "User"}
+    assert msg["from"]["id"] != 555 and msg["from"]["id"] == b["message"]["from"]["id"]
+    assert "contact" not in msg and "username" not in msg["chat"]
+    assert msg["text"] == "x" * len("мой телефон 8999")
+    assert b["message"]["text"] == "/start"
+    mention = {"type": "text_mention", "offset": 0, "length": 4,
+               "user": {"id": 7, "is_bot": False, "first_name": "Иван"}}
+    c = _message("/start")
+    c["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}, mention]
+    c["message"]["photo"] = [{"file_id": "F", "file_unique_id": "U", "width": 10, "height": 10}]
+    c = anonymize(c)["message"]
+    assert c["entities"] == [{"type": "bot_command", "offset": 0, "length": 6},
+                             {"type": "text_mention", "offset": 0, "length": 4}]
+    assert c["photo"][0]["file_id"] == "F"
+    assert anonymize(_message("🏗️ Проекты"))["message"]["text"] == "🏗️ Проекты"
+    # группа остаётся группой (отрицательный id)
+    assert anonymize(_message("hi", chat_id=-100123))["message"]["chat"]["id"] < 0
+
+
+def test_webhook_records_accepted_updates(monkeypatch, tmp_path):
+    async def fake_init():
+        bot._initialized = True
+
+    async def noop(update):
+        pass
+
+    path = tmp_path / "rec" / "updates.jsonl"
+    monkeypatch.setattr(bot, "ensure_initialized", fake_init)
+    monkeypatch.setattr(bot.application, "process_update", noop)
+    monkeypatch.setattr(bot, "RECORDER", UpdateRecorder(str(path)))
+    update = dict(_message("/start"), update_id=424242)
+    with TestClient(bot.web_app) as client:
+        client.post("/webhook", json=update)
+        client.post("/webhook", json=update)  # повтор не пишем
+    recorded = load_updates(str(path))
+    assert len(recorded) == 1
+    assert recorded[0]["message"]["text"] == "/start" and recorded[0]["message"]["from"]["id"] != 555
+
+
+def test_fake_api_answers_throttles_and_counts():
+    api = FakeBotApi(latency=0, jitter=0, p429=0, seed=1)
+    with TestClient(api.app()) as client:
+        resp = client.post("/botTOKEN/sendMessage", data={"chat_id": "7", "text": '"hi"'})
+        assert resp.json()["result"]["chat"]["id"] == 7
+        assert client.post("/botTOKEN/getMe").json()["result"]["is_bot"] is True
+        api.p429 = 1.0
+        resp = client.post("/botTOKEN/sendMessage", data={"chat_id": "7", "text": "x"})
+        assert resp.status_code == 429 and resp.json()["parameters"]["retry_after"] == 1
+        stats = client.get("/stats").json()
+    assert stats["calls"] == {"sendMessage": 2, "getMe": 1} and stats["throttled"] == {"sendMessage": 1}
+
+
+def test_synthetic_sessions_run_through_handlers(monkeypatch):
+    monkeypatch.setattr(bot.MEDIA_CACHE, "get", lambda path: "PHOTO_ID")
+    updates = synthetic_sessions(2, list(bot.CATALOG.location_slugs), list(bot.CATALOG.project_slugs))
+    assert [u["update_id"] for u in updates] == list(range(1, len(updates) + 1))
+
+    async def main():
+        app, stub = await make_app()
+        await app.process_update(Update.de_json(updates[0], app.bot))
+        welcome = list(stub.calls)
+        for data in updates[1:]:
+            await app.process_update(Update.de_json(data, app.bot))
+        await app.shutdown()
+        return welcome, stub.calls
+
+    welcome, calls = asyncio.run(main())
+    assert updates[0]["message"]["entities"][0]["type"] == "bot_command"
+    assert "sendPhoto" in welcome and "sendMessage" in welcome  # /start → cmd_start, не handle_text
+    assert "answerCallbackQuery" in calls
+    assert "editMessageMedia" in calls or "editMessageCaption" in calls
+
+
+def test_replay_renumbers_and_reports():
+    seen = []
+
+    def webhook(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/stats":
+            assert request.headers["authorization"] == "Bearer s3cret"
+            return httpx.Response(200, json={"scheduler": {"pending": 0}})
+        body = json.loads(request.content)
+        seen.append((body["update_id"], body["message"]["from"]["id"]))
+        return httpx.Response(503 if len(seen) == 3 else 200, json={"ok": True})
+
+    async def main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(webhook))
+        try:
+            return await replay([_message("/start")], "http://bot", concurrency=2, loops=4, users=10,
+                                client=client, stats_token="s3cret")
+        finally:
+            await client.aclose()
+
+    result = asyncio.run(main())
+    ids = sorted(seen)
+    assert [u for u, _ in ids] == list(range(ids[0][0], ids[0][0] + 4))
+    assert sorted(uid for _, uid in seen) == [555, 565, 575, 585]
+    assert result["sent"] == 4 and result["statuses"] == {"200": 3, "503": 1}
+    assert result["error_rate"] == 0.25 and result["drain_s"] is not None
+
+
+def test_percentiles():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.05 and percentile(values, 99) == 0.099
+    assert percentile([], 95) == 0.0
+    assert report(values, Counter({200: 100}), 2.0)["throughput_rps"] == 50.0
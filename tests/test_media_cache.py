@@ -0,0 +1,39 @@
+# tests/test_media_cache.py
+# Кэш file_id: переживает рестарт и сбрасывается при изменении файла.
+
+from media_cache import MediaCache
+
+
+def test_file_id_survives_restart_and_invalidates_on_change(tmp_path):
+    photo = tmp_path / "photo.jpg"
+    photo.write_bytes(b"v1")
+    store = str(tmp_path / "cache.json")
+
+    cache = MediaCache(store)
+    assert cache.get(str(photo)) is None
+    cache.put(str(photo), "FILE_ID_1")
+
+    again = MediaCache(store)
+    assert again.get(str(photo)) == "FILE_ID_1"
+
+    photo.write_bytes(b"v2-changed")
+    assert again.get(str(photo)) is None
+
+    again.put(str(photo), "FILE_ID_2")
+    again.forget(str(photo))
+    assert MediaCache(store).get(str(photo)) is None
+
+
+def test_digests_are_primed_before_first_show(tmp_path):
+    photo = tmp_path / "photo.jpg"
+    photo.write_bytes(b"v1")
+    cache = MediaCache(str(tmp_path / "cache.json"))
+    assert not cache.known(str(photo))
+    assert cache.prime([str(photo), str(tmp_path / "missing.jpg")]) == 1
+    assert cache.known(str(photo))
+    photo.write_bytes(b"v2-changed")
+    assert not cache.known(str(photo))
+
+    import bot
+    bot.warm_images()
+    assert all(bot.MEDIA_CACHE.known(p) for p in bot.catalog_photos())
@@ -0,0 +1,70 @@
+# tests/test_metrics.py
+# /metrics в формате Prometheus: хендлеры, исход отправки фото, вебхук.
+
+import asyncio
+
+from starlette.testclient import TestClient
+
+import bot
+import metrics
+from metrics import Registry
+from telegram_stub import callback_update, make_app
+
+
+def test_histogram_and_counter_exposition():
+    reg = Registry()
+    h = reg.histogram("t_seconds", "test", ("op",), buckets=(0.1, 1.0))
+    c = reg.counter("t_total", "test", ("op", "outcome"))
+    for v in (0.05, 0.5, 3.0):
+        h.observe(v, "a")
+    c.inc("a", "ok", amount=2)
+    text = reg.render()
+    assert 't_seconds_bucket{op="a",le="0.1"} 1' in text
+    assert 't_seconds_bucket{op="a",le="1.0"} 2' in text
+    assert 't_seconds_bucket{op="a",le="+Inf"} 3' in text
+    assert 't_seconds_count{op="a"} 3' in text
+    assert 't_total{op="a",outcome="ok"} 2' in text
+    # повторная регистрация отдаёт ту же метрику
+    assert reg.histogram("t_seconds", "test", ("op",)) is h
+
+
+def test_handlers_and_photo_source_are_counted(monkeypatch):
+    monkeypatch.setattr(bot, "NAV_MODE", "classic")
+    monkeypatch.setattr(bot.MEDIA_CACHE, "get", lambda path: None)
+    calls0 = metrics.HANDLER_SECONDS.count("handle_callback")
+    local0 = bot.PHOTO_TOTAL.value("local")
+
+    async def main():
+        app, stub = await make_app()
+        await app.process_update(callback_update(app, "loc:Шопино"))
+        await app.shutdown()
+
+    asyncio.run(main())
+    assert metrics.HANDLER_SECONDS.count("handle_callback") == calls0 + 1
+    assert metrics.HANDLER_SECONDS.count("send_location_card") >= 1
+    assert metrics.HANDLER_IN_FLIGHT.value("handle_callback") == 0
+    assert bot.PHOTO_TOTAL.value("local") == local0 + 1
+
+
+def test_metrics_endpoint(monkeypatch):
+    async def fake_init():
+        bot._initialized = True
+
+    async def noop(update):
+        pass
+
+    monkeypatch.setattr(bot, "ensure_initialized", fake_init)
+    monkeypatch.setattr(bot.application, "process_update", noop)
+    with TestClient(bot.web_app) as client:
+        client.post("/webhook", json={"update_id": 9001})
+        client.post("/webhook", json={"update_id": 9001})
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/stats", headers={"Authorization": "Bearer wrong"}).status_code == 401
+        resp = client.get("/metrics", headers={"Authorization": f"Bearer {bot.STATS_TOKEN}"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = resp.text
+    assert 'bot_webhook_total{outcome="duplicate"}' in text
+    assert "bot_webhook_seconds_bucket" in text
+    assert 'bot_http_pool_in_use{pool="media"} 0' in text
+    assert "bot_update_queue_seconds_count" in text
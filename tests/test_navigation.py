@@ -0,0 +1,41 @@
+# tests/test_navigation.py
+# Навигация в одном сообщении: после первой карточки каждый клик — одна правка.
+
+import asyncio
+
+import bot
+from telegram_stub import callback_update, make_app
+
+
+def test_inplace_navigation_edits_single_card(monkeypatch):
+    monkeypatch.setattr(bot, "NAV_MODE", "inplace")
+
+    async def main():
+        app, stub = await make_app()
+        # клик из текстового списка: новая карточка, список убираем
+        await app.process_update(callback_update(app, "loc:Шопино"))
+        assert stub.calls == ["answerCallbackQuery", "sendPhoto", "deleteMessage"]
+        card_id = app.user_data[7]["card_msg_id"]
+
+        # дальше всё правится на месте
+        for data in ("back_to_locs", "loc:Чижовка", "back_to_projects", "proj:Весна 90"):
+            stub.calls.clear()
+            await app.process_update(callback_update(app, data, message_id=card_id, photo=True))
+            assert len(stub.calls) == 2, (data, stub.calls)
+            assert app.user_data[7]["card_msg_id"] == card_id
+        assert stub.calls == ["answerCallbackQuery", "editMessageMedia"]
+        await app.shutdown()
+
+    asyncio.run(main())
+
+
+def test_classic_navigation_still_sends_new_cards(monkeypatch):
+    monkeypatch.setattr(bot, "NAV_MODE", "classic")
+
+    async def main():
+        app, stub = await make_app()
+        await app.process_update(callback_update(app, "loc:Шопино"))
+        assert stub.calls == ["answerCallbackQuery", "editMessageText", "sendPhoto"]
+        await app.shutdown()
+
+    asyncio.run(main())
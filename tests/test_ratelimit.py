@@ -0,0 +1,50 @@
+# tests/test_ratelimit.py
+# 429 повторяется с паузой, интерактивные ответы обгоняют рассылку.
+
+import asyncio
+
+from telegram.error import RetryAfter
+
+from ratelimit import OutboundLimiter
+
+
+def test_retry_after_is_honoured():
+    calls = []
+
+    async def callback():
+        calls.append(asyncio.get_running_loop().time())
+        if len(calls) == 1:
+            raise RetryAfter(0)
+        return {"ok": True}
+
+    async def main():
+        limiter = OutboundLimiter(max_retries=2)
+        result = await limiter.process_request(callback, (), {}, "sendMessage", {"chat_id": 1}, None)
+        return result, limiter.stats()
+
+    result, stats = asyncio.run(main())
+    assert result == {"ok": True}
+    assert len(calls) == 2 and stats["retries"] == 1
+    assert calls[1] - calls[0] >= 0.1  # джиттер поверх retry_after
+
+
+def test_interactive_overtakes_bulk():
+    order = []
+
+    def make(tag):
+        async def callback():
+            order.append(tag)
+        return callback
+
+    async def main():
+        limiter = OutboundLimiter(global_rate=20)
+        limiter._global.tokens = 0  # общий лимит исчерпан
+        bulk = [limiter.process_request(make(f"bulk{i}"), (), {}, "sendMessage",
+                                        {"chat_id": 100 + i}, {"priority": "bulk"}) for i in range(3)]
+        tasks = [asyncio.create_task(c) for c in bulk]
+        await asyncio.sleep(0)
+        await limiter.process_request(make("reply"), (), {}, "sendMessage", {"chat_id": 1}, None)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order[0] == "reply"
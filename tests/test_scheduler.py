@@ -0,0 +1,56 @@
+# tests/test_scheduler.py
+# Один чат — строго по порядку, разные чаты — параллельно, очередь ограничена.
+
+import asyncio
+
+from scheduler import ChatScheduler
+
+
+def test_per_chat_order_and_cross_chat_parallelism():
+    log = []
+    running = 0
+    peak = 0
+
+    async def handler(item):
+        nonlocal running, peak
+        chat, n = item
+        running += 1
+        peak = max(peak, running)
+        log.append(("start", chat, n))
+        await asyncio.sleep(0.01)
+        log.append(("end", chat, n))
+        running -= 1
+
+    async def main():
+        sched = ChatScheduler(handler, workers=4, max_pending=100)
+        for n in range(3):
+            for chat in ("a", "b", "c"):
+                assert sched.submit(chat, (chat, n))
+        await sched.stop(timeout=5)
+        return sched.stats()
+
+    stats = asyncio.run(main())
+    assert stats["processed"] == 9 and stats["pending"] == 0
+    # внутри чата: следующий стартует только после конца предыдущего
+    for chat in ("a", "b", "c"):
+        events = [(kind, n) for kind, c, n in log if c == chat]
+        assert events == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+    assert peak == 3
+
+
+def test_backpressure_rejects_when_full():
+    async def main():
+        gate = asyncio.Event()
+
+        async def handler(item):
+            await gate.wait()
+
+        sched = ChatScheduler(handler, workers=1, max_pending=2)
+        assert sched.submit(1, "x") and sched.submit(2, "y")
+        assert not sched.submit(3, "z")
+        gate.set()
+        await sched.stop(timeout=5)
+        return sched.stats()
+
+    stats = asyncio.run(main())
+    assert stats["rejected"] == 1 and stats["processed"] == 2
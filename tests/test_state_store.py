@@ -0,0 +1,110 @@
+# tests/test_state_store.py
+# user_data переживает «другой воркер», пишется пачками и выгружается по TTL.
+
+import asyncio
+
+from telegram.ext import Application, MessageHandler, filters
+
+from state_store import RedisStateBackend, RespServer, SqliteStateBackend, UserStatePersistence
+from telegram_stub import StubRequest, text_update
+
+
+async def _worker(backend, **kwargs):
+    """Отдельное Application поверх общего хранилища — как воркер gunicorn."""
+    state = UserStatePersistence(backend, **kwargs)
+    app = Application.builder().token("123456:TEST").request(StubRequest()) \
+        .get_updates_request(StubRequest()).persistence(state).build()
+
+    async def count(update, context):
+        context.user_data["clicks"] = context.user_data.get("clicks", 0) + 1
+
+    app.add_handler(MessageHandler(filters.TEXT, count))
+    state.install(app)
+    await app.initialize()
+    return app, state
+
+
+def test_state_follows_user_between_workers(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        a, state_a = await _worker(SqliteStateBackend(path), shared=True)
+        b, state_b = await _worker(SqliteStateBackend(path), shared=True)
+        for _ in range(3):
+            await a.process_update(text_update(a, "hi", chat_id=5))
+        await a.process_update(text_update(a, "hi", chat_id=6))
+        await a.update_persistence()
+        await state_a.flush()
+        await b.process_update(text_update(b, "hi", chat_id=5))
+        return b.user_data[5], state_a.stats(), state_b.stats()
+
+    clicks, stats_a, stats_b = asyncio.run(main())
+    assert clicks == {"clicks": 4}
+    # два пользователя — одна транзакция
+    assert stats_a["writes"] == 2 and stats_a["batches"] == 1
+    assert stats_b["hydrated"] == 1
+
+
+
+def test_quick_updates_in_shared_mode_keep_local_state(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        a, state_a = await _worker(SqliteStateBackend(path), shared=True)
+        b, state_b = await _worker(SqliteStateBackend(path), shared=True)
+        await b.process_update(text_update(b, "hi", chat_id=5))
+        await b.update_persistence()
+        await state_b.flush()                      # в хранилище clicks=1
+        # два быстрых апдейта на одном воркере, flush между ними не было
+        await a.process_update(text_update(a, "hi", chat_id=5))
+        await a.process_update(text_update(a, "hi", chat_id=5))
+        assert a.user_data[5]["clicks"] == 3
+        await state_a.flush()
+        await b.process_update(text_update(b, "hi", chat_id=5))
+        assert b.user_data[5]["clicks"] == 4
+        for app in (a, b):
+            await app.shutdown()
+
+    asyncio.run(main())
+
+def test_idle_users_are_evicted_but_kept_in_store(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        app, state = await _worker(SqliteStateBackend(path), ttl=0, shared=False)
+        await app.process_update(text_update(app, "hi", chat_id=5))
+        await app.update_persistence()
+        await state.flush()
+        assert state.evict_idle(app) == 1
+        await app.update_persistence()
+        assert 5 not in app.user_data
+        # вернулся — состояние подтянулось из хранилища
+        await app.process_update(text_update(app, "hi", chat_id=5))
+        return app.user_data[5], state.stats()
+
+    data, stats = asyncio.run(main())
+    assert data == {"clicks": 2}
+    assert stats["evicted"] == 1 and stats["in_memory"] == 1
+
+
+def test_redis_backend_over_local_stand_in():
+    async def main():
+        server = await RespServer().serve("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backend = RedisStateBackend(f"redis://127.0.0.1:{port}/0", store_ttl=60)
+        try:
+            await asyncio.to_thread(backend.save_many, {1: '{"state":"MAIN"}', 2: "{}"})
+            first = await asyncio.to_thread(backend.load, 1)
+            await asyncio.to_thread(backend.delete_many, [1])
+            gone = await asyncio.to_thread(backend.load, 1)
+            ttl = await asyncio.to_thread(backend.execute, [("TTL", "mrhouse:user:2")])
+        finally:
+            backend.close()
+            server.close()
+            await server.wait_closed()
+        return first, gone, ttl[0]
+
+    first, gone, ttl = asyncio.run(main())
+    assert first == '{"state":"MAIN"}'
+    assert gone is None
+    assert 0 < ttl <= 60
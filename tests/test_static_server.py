@@ -0,0 +1,151 @@
+# tests/test_static_server.py
+# Статика: сильный ETag по содержимому, Range для видео, предсжатые копии,
+# отдельный процесс с sendfile.
+
+import os
+import gzip
+import asyncio
+
+import httpx
+import pytest
+from starlette.testclient import TestClient
+
+import bot
+from assets import IMMUTABLE
+from static_server import StaticApp, StaticResolver, parse_range, precompress, serve
+
+
+def _tree(tmp_path):
+    (tmp_path / "video.mp4").write_bytes(bytes(range(256)) * 40)           # 10240 байт
+    (tmp_path / "catalog.json").write_text('{"a": "' + "x" * 4000 + '"}')
+    (tmp_path / "noise.pdf").write_bytes(os.urandom(4000))
+    (tmp_path / ".secret").write_text("no")
+    return StaticResolver(str(tmp_path))
+
+
+def _headers(reply):
+    return dict(reply.headers)
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=990-5000", 1000) == (990, 999)
+    assert parse_range("bytes=0-1,5-6", 1000) is None      # несколько — отдаём целиком
+    assert parse_range("items=0-1", 1000) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=1000-", 1000)
+
+
+def test_etag_range_and_conditional(tmp_path):
+    resolver = _tree(tmp_path)
+    digest = resolver.manifest.digest("video.mp4")
+    full = resolver.resolve("GET", "/video.mp4", "", {})
+    etag = _headers(full)["ETag"]
+    assert full.status == 200 and etag == f'"{digest[:32]}"' and full.length == 10240
+    assert _headers(full)["Accept-Ranges"] == "bytes" and "Vary" not in _headers(full)
+
+    assert resolver.resolve("GET", "/video.mp4", "", {"if-none-match": f"W/{etag}"}).status == 304
+    part = resolver.resolve("GET", "/video.mp4", "", {"range": "bytes=1000-1999"})
+    assert (part.status, part.offset, part.length) == (206, 1000, 1000)
+    assert _headers(part)["Content-Range"] == "bytes 1000-1999/10240"
+    stale = resolver.resolve("GET", "/video.mp4", "", {"range": "bytes=0-9", "if-range": '"old"'})
+    assert stale.status == 200
+    assert resolver.resolve("GET", "/video.mp4", "", {"range": "bytes=20000-"}).status == 416
+    assert resolver.resolve("HEAD", "/video.mp4", "", {}).path is None
+    fresh = resolver.resolve("GET", "/video.mp4", f"v={digest[:12]}", {})
+    assert _headers(fresh)["Cache-Control"] == IMMUTABLE
+
+    for bad in ("/.secret", "/../etc/passwd", "/missing.mp4", "/"):
+        assert resolver.resolve("GET", bad, "", {}).status == 404, bad
+    assert resolver.resolve("POST", "/video.mp4", "", {}).status == 405
+
+
+def test_precompressed_variant(tmp_path):
+    resolver = _tree(tmp_path)
+    assert precompress(str(tmp_path)) == (1, 1)           # json сжали, шум — нет
+    assert not (tmp_path / "noise.pdf.gz").exists()
+    assert precompress(str(tmp_path)) == (0, 1)           # свежий .gz не трогаем
+
+    reply = resolver.resolve("GET", "/catalog.json", "", {"accept-encoding": "br, gzip"})
+    headers = _headers(reply)
+    assert headers["Content-Encoding"] == "gzip" and headers["Vary"] == "Accept-Encoding"
+    assert headers["ETag"].endswith('-gz"') and reply.path.endswith(".gz")
+    assert gzip.decompress((tmp_path / "catalog.json.gz").read_bytes()) == (tmp_path / "catalog.json").read_bytes()
+    assert "Content-Encoding" not in _headers(resolver.resolve("GET", "/catalog.json", "", {}))
+    assert "Content-Encoding" not in _headers(
+        resolver.resolve("GET", "/catalog.json", "", {"accept-encoding": "gzip", "range": "bytes=0-9"}))
+    assert resolver.resolve("GET", "/catalog.json.gz", "", {}).status == 404
+    # .gz в манифест не попадает
+    assert resolver.manifest.build().digest("catalog.json.gz") is None
+
+
+def test_bot_static_mount_serves_ranges():
+    url = bot.asset_url("welcome.jpg")
+    path = url[len(bot.BASE_URL):]
+    data = open(os.path.join(bot.STATIC_DIR, "welcome.jpg"), "rb").read()
+    with TestClient(bot.web_app) as client:
+        full = client.get(path)
+        assert full.content == data and full.headers["cache-control"] == IMMUTABLE
+        part = client.get(path, headers={"Range": "bytes=10-19"})
+        assert part.status_code == 206 and part.content == data[10:20]
+        again = client.get("/static/welcome.jpg", headers={"If-None-Match": full.headers["etag"]})
+        assert again.status_code == 304
+
+
+
+def _asgi_get(app, path):
+    """Прямой вызов ASGI: TestClient раскодирует путь второй раз и %25 не проверить."""
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "root_path": "/static",
+             "query_string": b"", "headers": []}
+    asyncio.run(app(scope, receive, send))
+    assert sent[-1]["type"] == "http.response.body" and not sent[-1].get("more_body")
+    return sent[0]["status"], b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_asgi_app_serves_empty_and_percent_names(tmp_path):
+    (tmp_path / "empty.txt").write_bytes(b"")
+    (tmp_path / "a%25.jpg").write_bytes(b"quoted")
+    (tmp_path / "a%.jpg").write_bytes(b"wrong")
+    resolver = StaticResolver(str(tmp_path))
+    app = StaticApp(resolver)
+    assert _asgi_get(app, "/static/empty.txt") == (200, b"")
+    assert _asgi_get(app, "/static/a%25.jpg") == (200, b"quoted")   # в ASGI путь уже раскодирован
+    (tmp_path / "empty.txt").write_bytes(b"changed")                 # манифест устарел — хэш в потоке
+    assert not resolver.hashed("/empty.txt")
+    assert _asgi_get(app, "/static/empty.txt") == (200, b"changed")
+    assert resolver.hashed("/empty.txt")
+
+
+def test_standalone_server_with_sendfile(tmp_path):
+    resolver = _tree(tmp_path)
+    body = (tmp_path / "video.mp4").read_bytes()
+
+    async def main():
+        server = await serve("127.0.0.1", 0, resolver)
+        port = server.sockets[0].getsockname()[1]
+        async with server, httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+            full = await client.get("/video.mp4")
+            part = await client.get("/static/video.mp4", headers={"Range": "bytes=-16"})  # то же соединение
+            missing = await client.get("/nope")
+            health = await client.get("/healthz")
+            (tmp_path / "video.mp4").write_bytes(body[::-1])     # поменялся после старта — хэш в потоке
+            assert not resolver.hashed("/video.mp4")
+            changed = await client.get("/video.mp4")
+        return full, part, missing, health, changed
+
+    full, part, missing, health, changed = asyncio.run(main())
+    assert changed.content == body[::-1] and changed.headers["etag"] != full.headers["etag"]
+    assert resolver.hashed("/video.mp4")
+    assert full.status_code == 200 and full.content == body
+    assert part.status_code == 206 and part.content == body[-16:]
+    assert missing.status_code == 404 and health.status_code == 200
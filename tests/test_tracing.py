@@ -0,0 +1,98 @@
+# tests/test_tracing.py
+# Дерево шагов апдейта, лог медленных апдейтов и экспорт в OTLP.
+
+import json
+import asyncio
+import logging
+
+import httpx
+
+import bot
+from telegram_stub import callback_update, make_app, text_update
+from tracing import OtlpExporter, Tracer, activate, deactivate, span
+
+
+def _names(node):
+    yield node["name"]
+    for child in node.get("children", []):
+        yield from _names(child)
+
+
+def test_slow_update_is_logged_with_span_tree(monkeypatch, caplog):
+    monkeypatch.setattr(bot, "NAV_MODE", "classic")
+    monkeypatch.setattr(bot.MEDIA_CACHE, "get", lambda path: None)
+    tracer = Tracer(slow_ms=0)
+
+    async def main():
+        app, stub = await make_app()
+        trace = tracer.start("update", chat_id=7)
+        tokens = activate(trace)
+        try:
+            with span("dispatch"):
+                await app.process_update(callback_update(app, "loc:Шопино"))
+        finally:
+            deactivate(tokens)
+        tracer.finish(trace)
+        await app.shutdown()
+
+    with caplog.at_level(logging.WARNING, logger="bot.trace"):
+        asyncio.run(main())
+    record = json.loads(caplog.records[-1].getMessage())
+    tree = record["tree"]
+    assert tree["attrs"] == {"chat_id": 7}
+    names = list(_names(tree))
+    # хендлер → карточка → копия и чтение файла фото
+    assert names[:4] == ["update", "dispatch", "handle_callback", "send_location_card"]
+    assert "photo.derive" in names and "photo.read" in names
+    assert tracer.stats()["logged"] == 1
+
+
+
+def test_described_text_keeps_buttons_and_hides_free_text():
+    async def main():
+        app, _ = await make_app()
+        texts = ("🏗️ Проекты", "/start l-vesna", "+7 910 123-45-67", "Где школы?")
+        described = [bot._describe(text_update(app, text, chat_id=61)) for text in texts]
+        await app.shutdown()
+        return described
+
+    button, command, phone, question = asyncio.run(main())
+    assert button["text"] == "🏗️ Проекты" and command["text"] == "/start"
+    assert "text" not in phone and phone["text_len"] == len("+7 910 123-45-67")
+    assert "text" not in question and question["chat_id"] == 61
+
+def test_span_outside_trace_is_noop():
+    with span("anything") as s:
+        assert s is None
+
+
+def test_otlp_exporter_posts_span_batches():
+    received = []
+
+    def collector(request: httpx.Request) -> httpx.Response:
+        received.append((request.url.path, json.loads(request.content)))
+        return httpx.Response(200, json={})
+
+    async def main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(collector))
+        exporter = OtlpExporter("http://127.0.0.1:4318", client=client)
+        tracer = Tracer(slow_ms=10_000, exporter=exporter, export_sample=1.0)
+        trace = tracer.start("update")
+        tokens = activate(trace)
+        with span("api.sendMessage", pool="json"):
+            pass
+        deactivate(tokens)
+        tracer.finish(trace)
+        await exporter.close()
+        return exporter.stats()
+
+    stats = asyncio.run(main())
+    assert stats["exported"] == 1 and stats["errors"] == 0
+    path, payload = received[0]
+    assert path == "/v1/traces"
+    spans = payload["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    root, child = spans
+    assert len(root["traceId"]) == 32 and "parentSpanId" not in root
+    assert child["parentSpanId"] == root["spanId"]
+    assert child["attributes"] == [{"key": "pool", "value": {"stringValue": "json"}}]
+    assert int(child["endTimeUnixNano"]) >= int(child["startTimeUnixNano"])
@@ -0,0 +1,73 @@
+# tests/test_transport.py
+# Заливка файлов идёт отдельным пулом и не задерживает JSON-вызовы.
+
+import io
+import asyncio
+
+import pytest
+from telegram import InputFile
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest, RequestData
+from telegram.request._requestparameter import RequestParameter
+
+from transport import PooledHTTPXRequest, SplitRequest
+
+
+def _data(**params):
+    return RequestData([RequestParameter.from_input(k, v) for k, v in params.items()])
+
+
+@pytest.fixture
+def slow_network(monkeypatch):
+    """Сеть без сети: multipart «заливается» 0.3с, остальное отвечает сразу."""
+    async def fake(self, url, method, request_data=None, **kwargs):
+        if request_data is not None and request_data.contains_files:
+            await asyncio.sleep(0.3)
+        return 200, b'{"ok": true, "result": true}'
+    monkeypatch.setattr(HTTPXRequest, "do_request", fake)
+
+
+def test_upload_does_not_block_json_calls(slow_network):
+    async def main():
+        request = SplitRequest(PooledHTTPXRequest("json", connection_pool_size=2),
+                               PooledHTTPXRequest("media", connection_pool_size=1))
+        photo = _data(chat_id=1, photo=InputFile(io.BytesIO(b"jpeg"), filename="a.jpg"))
+        upload = asyncio.create_task(request.do_request("u/sendPhoto", "POST", photo))
+        await asyncio.sleep(0.01)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await request.do_request("u/answerCallbackQuery", "POST", _data(callback_query_id="q"))
+        elapsed = loop.time() - started
+        await upload
+        return elapsed, request.stats()
+
+    elapsed, stats = asyncio.run(main())
+    assert elapsed < 0.1
+    assert stats["json"]["requests"] == 1 and stats["media"]["requests"] == 1
+    assert stats["json"]["waited"] == 0
+
+
+def test_saturated_pool_is_counted_and_times_out(slow_network):
+    async def main():
+        pool = PooledHTTPXRequest("media", connection_pool_size=1, pool_timeout=0.05)
+        photo = _data(chat_id=1, photo=InputFile(io.BytesIO(b"jpeg"), filename="a.jpg"))
+        first = asyncio.create_task(pool.do_request("u/sendPhoto", "POST", photo))
+        await asyncio.sleep(0.01)
+        with pytest.raises(TimedOut):
+            await pool.do_request("u/sendPhoto", "POST", photo)
+        await first
+        return pool.stats()
+
+    stats = asyncio.run(main())
+    assert stats["waited"] == 1 and stats["timeouts"] == 1
+    assert stats["in_use"] == 0 and stats["wait_max_ms"] >= 40
+
+
+def test_http2_without_h2_falls_back_to_http11():
+    try:
+        import h2  # noqa: F401
+        pytest.skip("h2 установлен — фолбэк не нужен")
+    except ImportError:
+        pass
+    pool = PooledHTTPXRequest("json", connection_pool_size=4, http_version="2")
+    assert pool.http_version == "1.1"
@@ -0,0 +1,54 @@
+# tests/test_webhook.py
+# /webhook отвечает сразу, а апдейт обрабатывается в фоне на том же loop.
+
+import time
+import asyncio
+
+from starlette.testclient import TestClient
+
+import bot
+
+
+def test_webhook_acks_and_processes_in_background(monkeypatch):
+    processed = []
+    release = asyncio.Event()
+
+    async def fake_init():
+        bot._initialized = True
+
+    async def slow_process(update):
+        await release.wait()
+        processed.append(update.update_id)
+
+    monkeypatch.setattr(bot, "ensure_initialized", fake_init)
+    monkeypatch.setattr(bot.application, "process_update", slow_process)
+
+    with TestClient(bot.web_app) as client:
+        assert client.get("/").json()["ok"] is True
+        # ответ приходит, пока обработка ещё «висит»
+        assert client.post("/webhook", json={"update_id": 1}).json() == {"ok": True}
+        assert processed == []
+        # повтор того же update_id от Telegram не обрабатывается второй раз
+        assert client.post("/webhook", json={"update_id": 1}).json()["duplicate"] is True
+        assert client.post("/webhook", content=b"not json").status_code == 400
+        client.portal.call(release.set)
+    assert processed == [1]
+
+
+def test_ready_reports_after_warm_up(monkeypatch):
+    monkeypatch.setitem(bot.WARMUP_STATE, "ready", False)
+    monkeypatch.setattr(bot, "IMAGES", bot.Derivatives(bot.DERIVED_DIR, digest_of=bot.MEDIA_CACHE.digest))
+    monkeypatch.setattr(bot.IMAGES, "warm", lambda sources: time.sleep(0.2) or 0)
+
+    with TestClient(bot.web_app) as client:
+        # процесс жив сразу, готов — только после прогрева
+        assert client.get("/").status_code == 200
+        assert client.get("/ready").status_code == 503
+        deadline = time.monotonic() + 5
+        while client.get("/ready").status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        state = client.get("/ready").json()
+    assert state["ready"] is True
+    assert {"assets", "images"} <= set(state["steps"])
+    # фото на месте; у локаций пока нет PDF — прогрев об этом предупреждает
+    assert not [p for p in state["problems"] if "фото" in p]
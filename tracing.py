@@ -0,0 +1,265 @@
+# tracing.py
+# ------------------------------------------------------------------------------
+# Трассировка апдейтов: у каждого апдейта свой trace_id и дерево шагов
+# (разбор JSON, de_json, очередь, хендлеры, каждый вызов Bot API, чтение
+# файла фото). Текущий трейс и шаг живут в contextvars — span() можно звать
+# где угодно, вне трейса он ничего не делает.
+#
+# Апдейт дольше порога попадает в лог bot.trace одной JSON-строкой со всем
+# деревом (с выборкой TRACE_SAMPLE). По желанию трейсы уходят в коллектор
+# OpenTelemetry по OTLP/HTTP (JSON), например локальный otel-collector
+# на :4318 — без зависимости от opentelemetry-sdk.
+# ------------------------------------------------------------------------------
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import List, Optional
+
+import httpx
+
+logger = logging.getLogger("bot.trace")
+
+_trace: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_span: ContextVar[Optional["Span"]] = ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent", "start", "end", "attrs", "error", "_token")
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: dict):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.error: Optional[str] = None
+        self._token = None
+
+    def close(self) -> None:
+        if self.end is None:
+            self.end = time.perf_counter()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter()
+        return round(1000 * (end - self.start), 2)
+
+
+class Trace:
+    """Один апдейт: корневой шаг + всё, что открыто внутри него."""
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = os.urandom(16).hex()
+        self._wall0 = time.time()
+        self._perf0 = time.perf_counter()
+        self.spans: List[Span] = []
+        self.root = self._open(name, None, attrs)
+
+    def _open(self, name: str, parent: Optional[Span], attrs: dict) -> Span:
+        span = Span(name, parent, attrs)
+        self.spans.append(span)
+        return span
+
+    def begin(self, name: str, **attrs) -> Span:
+        """Шаг, который закроют позже и, возможно, в другой задаче (span.close())."""
+        return self._open(name, self.root, attrs)
+
+    def unix_ns(self, perf: float) -> int:
+        return int((self._wall0 + (perf - self._perf0)) * 1e9)
+
+    def finish(self) -> float:
+        if self.root.end is None:
+            self.root.end = time.perf_counter()
+        return self.root.duration_ms
+
+    def tree(self) -> dict:
+        """Дерево шагов: {name, ms, attrs, children: [...]}."""
+        nodes = {}
+        for span in self.spans:
+            node = {"name": span.name, "ms": span.duration_ms,
+                    "at_ms": round(1000 * (span.start - self.root.start), 2)}
+            if span.attrs:
+                node["attrs"] = span.attrs
+            if span.error:
+                node["error"] = span.error
+            nodes[span.span_id] = node
+        for span in self.spans:
+            if span.parent is not None:
+                nodes[span.parent.span_id].setdefault("children", []).append(nodes[span.span_id])
+        return nodes[self.root.span_id]
+
+
+class _SpanScope:
+    __slots__ = ("name", "attrs", "span")
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.span = None
+
+    def __enter__(self) -> Optional[Span]:
+        trace = _trace.get()
+        if trace is None:
+            return None
+        self.span = trace._open(self.name, _span.get() or trace.root, self.attrs)
+        self.span._token = _span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        span = self.span
+        if span is None:
+            return
+        span.end = time.perf_counter()
+        if exc is not None:
+            span.error = f"{exc_type.__name__}: {exc}"
+        _span.reset(span._token)
+
+
+def span(name: str, **attrs) -> _SpanScope:
+    """with span("api.sendPhoto", pool="media"): ... — шаг внутри текущего трейса."""
+    return _SpanScope(name, attrs)
+
+
+def current() -> Optional[Trace]:
+    return _trace.get()
+
+
+def activate(trace: Optional[Trace]):
+    """Сделать трейс текущим в этой задаче; возвращает токен для deactivate()."""
+    return _trace.set(trace), _span.set(trace.root if trace else None)
+
+
+def deactivate(tokens) -> None:
+    trace_token, span_token = tokens
+    _span.reset(span_token)
+    _trace.reset(trace_token)
+
+
+# ========= ВЫВОД =========
+class Tracer:
+    def __init__(self, *, slow_ms: float = 1000.0, sample: float = 1.0, exporter=None,
+                 export_sample: float = 0.0):
+        self.slow_ms = slow_ms
+        self.sample = sample
+        self.exporter = exporter
+        self.export_sample = export_sample
+        self.finished = 0
+        self.slow = 0
+        self.logged = 0
+
+    def start(self, name: str, **attrs) -> Trace:
+        return Trace(name, **attrs)
+
+    def finish(self, trace: Trace) -> None:
+        ms = trace.finish()
+        self.finished += 1
+        slow = ms >= self.slow_ms
+        if slow:
+            self.slow += 1
+            if random.random() < self.sample:
+                self.logged += 1
+                logger.warning(json.dumps({"slow_update": trace.trace_id, "ms": ms,
+                                           "tree": trace.tree()}, ensure_ascii=False, default=str))
+        if self.exporter is not None and (slow or random.random() < self.export_sample):
+            self.exporter.add(trace)
+
+    def stats(self) -> dict:
+        out = {"finished": self.finished, "slow": self.slow, "logged": self.logged, "slow_ms": self.slow_ms}
+        if self.exporter is not None:
+            out["exporter"] = self.exporter.stats()
+        return out
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(traces: List[Trace], service: str) -> dict:
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            item = {
+                "traceId": trace.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 2 if s.parent is None else 1,  # SERVER для корня, INTERNAL внутри
+                "startTimeUnixNano": str(trace.unix_ns(s.start)),
+                "endTimeUnixNano": str(trace.unix_ns(s.end if s.end is not None else s.start)),
+                "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attrs.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            }
+            if s.parent is not None:
+                item["parentSpanId"] = s.parent.span_id
+            spans.append(item)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service}}]},
+        "scopeSpans": [{"scope": {"name": "bot.trace"}, "spans": spans}],
+    }]}
+
+
+class OtlpExporter:
+    """Пачки трейсов в OTLP/HTTP JSON (POST {endpoint}/v1/traces) из фоновой задачи."""
+
+    def __init__(self, endpoint: str, *, service: str = "mrhouse-bot", interval: float = 5.0,
+                 max_batch: int = 200, max_queue: int = 2000, client: Optional[httpx.AsyncClient] = None):
+        self.url = endpoint.rstrip("/")
+        if not self.url.endswith("/v1/traces"):
+            self.url += "/v1/traces"
+        self.service = service
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self._client = client
+        self._queue: List[Trace] = []
+        self.exported = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def add(self, trace: Trace) -> None:
+        if len(self._queue) >= self.max_queue:
+            self.dropped += 1  # коллектор лёг — не копим память бесконечно
+            return
+        self._queue.append(trace)
+
+    async def flush(self) -> None:
+        while self._queue:
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            if self._client is None:
+                self._client = httpx.AsyncClient(timeout=5.0)
+            try:
+                resp = await self._client.post(self.url, json=otlp_payload(batch, self.service))
+                resp.raise_for_status()
+                self.exported += len(batch)
+            except Exception as e:
+                self.errors += 1
+                self.dropped += len(batch)
+                logger.info(f"OTLP-экспорт не удался ({self.url}): {e}")
+                return
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def close(self) -> None:
+        """Дослать остаток и закрыть HTTP-клиент (при остановке воркера)."""
+        await self.flush()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {"url": self.url, "queued": len(self._queue), "exported": self.exported,
+                "dropped": self.dropped, "errors": self.errors}
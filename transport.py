@@ -0,0 +1,171 @@
+# transport.py
+# ------------------------------------------------------------------------------
+# HTTP-транспорт бота к Bot API: два пула соединений вместо одного.
+#   json  — быстрые вызовы (sendMessage, answerCallbackQuery, фото по file_id);
+#   media — заливка файлов (multipart), которая держит соединение секундами.
+# Медленная заливка больше не занимает соединение, которого ждёт ответ
+# на нажатие кнопки.
+#
+# У каждого пула: размер и keep-alive из окружения, HTTP/2 по желанию
+# (нужен пакет h2, иначе остаёмся на 1.1) и счётчики ожидания свободного
+# соединения — видно, когда пул становится узким местом (/stats → http).
+# ------------------------------------------------------------------------------
+
+import time
+import asyncio
+import logging
+from typing import Optional
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from metrics import REGISTRY
+from tracing import span
+
+logger = logging.getLogger("bot.transport")
+
+API_SECONDS = REGISTRY.histogram("bot_api_seconds", "Вызов Bot API: ожидание пула + сеть", ("method", "pool"))
+API_TOTAL = REGISTRY.counter("bot_api_requests_total", "Вызовы Bot API по исходу", ("method", "outcome"))
+
+
+class PooledHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest с настраиваемым keep-alive и учётом ожидания пула."""
+
+    def __init__(self, name: str, *, connection_pool_size: int, keepalive_expiry: float = 30.0,
+                 http_version: str = "1.1", pool_timeout: float = 20.0, **kwargs):
+        self.name = name
+        self.size = connection_pool_size
+        self.keepalive_expiry = keepalive_expiry
+        self.pool_timeout = pool_timeout
+        try:
+            super().__init__(connection_pool_size=connection_pool_size, http_version=http_version,
+                             pool_timeout=pool_timeout, **kwargs)
+        except RuntimeError as e:
+            # HTTP/2 без пакета h2 — не падаем, работаем по 1.1
+            logger.warning(f"Пул {name}: HTTP/{http_version} недоступен ({e}) — использую 1.1")
+            super().__init__(connection_pool_size=connection_pool_size, http_version="1.1",
+                             pool_timeout=pool_timeout, **kwargs)
+        # Семафор = размер пула: ждём слот у себя и видим, сколько ждали
+        self._slots = asyncio.Semaphore(connection_pool_size)
+        self.in_use = 0
+        self.waiting = 0
+        self.requests = 0
+        self.waited = 0          # сколько запросов не получили слот сразу
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = self._client_kwargs["limits"]
+        kwargs = dict(self._client_kwargs, limits=httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        ))
+        return httpx.AsyncClient(**kwargs)
+
+    async def _acquire(self, pool_timeout) -> None:
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return
+        timeout = self.pool_timeout if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout
+        started = time.monotonic()
+        self.waiting += 1
+        self.waited += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError as e:
+            self.timeouts += 1
+            raise TimedOut(f"Пул {self.name}: нет свободного соединения за {timeout}с") from e
+        finally:
+            self.waiting -= 1
+            waited = time.monotonic() - started
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        await self._acquire(pool_timeout)
+        self.requests += 1
+        self.in_use += 1
+        try:
+            return await super().do_request(url, method, request_data, read_timeout=read_timeout,
+                                            write_timeout=write_timeout, connect_timeout=connect_timeout,
+                                            pool_timeout=pool_timeout)
+        finally:
+            self.in_use -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "http_version": self.http_version,
+            "size": self.size,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "waited": self.waited,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(1000 * self.wait_total / self.waited, 2) if self.waited else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max, 2),
+        }
+
+
+class SplitRequest(BaseRequest):
+    """Запросы с файлами — в пул media, всё остальное — в пул json."""
+
+    def __init__(self, json_request: BaseRequest, media_request: BaseRequest):
+        self.json = json_request
+        self.media = media_request
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.json.read_timeout
+
+    async def initialize(self) -> None:
+        await asyncio.gather(self.json.initialize(), self.media.initialize())
+
+    async def shutdown(self) -> None:
+        await asyncio.gather(self.json.shutdown(), self.media.shutdown())
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        if request_data is not None and request_data.contains_files:
+            target, pool = self.media, "media"
+        else:
+            target, pool = self.json, "json"
+        endpoint = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with span(f"api.{endpoint}", pool=pool):
+                code, payload = await target.do_request(url, method, request_data, read_timeout=read_timeout,
+                                                        write_timeout=write_timeout, connect_timeout=connect_timeout,
+                                                        pool_timeout=pool_timeout)
+            outcome = str(code)
+            return code, payload
+        except TimedOut:
+            outcome = "timeout"
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, endpoint, pool)
+            API_TOTAL.inc(endpoint, outcome)
+
+    def stats(self) -> dict:
+        return {"json": self.json.stats(), "media": self.media.stats()}
+
+
+def make_bot_request(*, json_pool: int, media_pool: int, keepalive: float, http_version: str,
+                     pool_timeout: float, connect_timeout: float, read_timeout: float,
+                     write_timeout: float) -> SplitRequest:
+    common = dict(keepalive_expiry=keepalive, http_version=http_version, pool_timeout=pool_timeout,
+                  connect_timeout=connect_timeout, read_timeout=read_timeout, write_timeout=write_timeout)
+    request = SplitRequest(
+        PooledHTTPXRequest("json", connection_pool_size=json_pool, **common),
+        PooledHTTPXRequest("media", connection_pool_size=media_pool, **common),
+    )
+    logger.info(f"Bot API: пулы json={json_pool}, media={media_pool}, "
+                f"keep-alive {keepalive:g}с, HTTP/{request.json.http_version}")
+    return request